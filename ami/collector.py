@@ -4,7 +4,6 @@ import collections
 import cProfile
 import datetime as dt
 import logging
-import multiprocessing.sharedctypes
 import os
 import signal
 import sys
@@ -12,14 +11,41 @@ import time
 
 import ami.multiproc as mp
 from ami import Defaults, LogConfig
-from ami.comm import Collector, Colors, EventBuilder, Node, PlatformAction, Ports, TransitionBuilder
-from ami.data import MsgTypes, Transitions
+from ami.comm import (
+    Collector,
+    Colors,
+    EventBuilder,
+    Node,
+    PlatformAction,
+    Ports,
+    SelectTable,
+    TransitionBuilder,
+    shard_addr,
+)
+from ami.data import Codecs, Deserializer, MsgTypes, Serializer, Transitions
 from ami.tracing import get_trace_id, setup_tracing
-from ami.worker import parse_args, run_worker
+from ami.worker import compression_options, parse_args, run_worker
 
 logger = logging.getLogger(__name__)
 
 
+def tier_name(level):
+    """
+    Returns the name of the collectors of one tier of the reduction tree.
+
+    Args:
+        level (int): the level of the tier, where 0 is the local collectors
+            and the intermediate tiers start at 1.
+
+    Returns:
+        The name of the collectors, which is formatted with their node number.
+    """
+    if level == 0:
+        return "localCollector%03d"
+    else:
+        return "%s_%%03d" % (Colors.IntermediateCollector % level)
+
+
 class GraphCollector(Node, Collector):
     def __init__(
         self,
@@ -37,6 +63,11 @@ class GraphCollector(Node, Collector):
         hutch,
         hwm,
         timeout,
+        shmem=False,
+        compression=None,
+        collapsed=False,
+        sender=None,
+        stride=None,
     ):
         Node.__init__(
             self,
@@ -48,17 +79,28 @@ class GraphCollector(Node, Collector):
             hutch=hutch,
         )
         Collector.__init__(self, collector_addr, ctx=self.ctx, hutch=hutch, hwm=hwm, timeout=timeout)
+        self.shmem = shmem
+        if self.shmem:
+            self.deserializer = Deserializer("shmem")
         self.base_name = base_name
         self.num_workers = num_workers
         self.transitions = TransitionBuilder(self.num_workers, downstream_addr, self.ctx, hwm)
-        self.store = EventBuilder(self.num_workers, eb_depth, color, downstream_addr, self.ctx, hwm)
-        self.sender = "worker%03d" if color == "localCollector" else "localCollector%03d"
+        serializer = Serializer(**compression) if compression else None
+        self.store = EventBuilder(self.num_workers, eb_depth, color, downstream_addr, self.ctx, hwm, serializer)
+        # in the collapsed topology the workers send directly to the global collector
+        if sender is None:
+            sender = "worker%03d" if color == "localCollector" or collapsed else "localCollector%03d"
+        self.sender = sender
+        # the number of upstream processes assigned to each collector of this tier
+        self.stride = self.num_workers if stride is None else stride
         self.pickers = {}
         self.strategies = {}
         self.heartbeat_time = collections.defaultdict(lambda: 0)
 
         self.downstream_addr = downstream_addr
 
+        self.graph_comm.add_handler("update_completion", self.update_completion)
+        self.graph_comm.add_handler("update_demand", self.update_demand)
         self.register(self.graph_comm.sock, self.graph_comm.recv)
 
     def __enter__(self):
@@ -72,6 +114,8 @@ class GraphCollector(Node, Collector):
         return self.base_name % self.node
 
     def close(self):
+        if self.shmem:
+            self.deserializer.close()
         self.ctx.destroy()
 
     def flush(self, configure):
@@ -111,12 +155,16 @@ class GraphCollector(Node, Collector):
             self.report("error", e)
 
     def eb_id(self, identity):
-        return identity - (self.node * self.num_workers)
+        # the node number of a global collector is its shard, which doesn't change who its contributors are
+        if self.store.color == Colors.GlobalCollector:
+            return identity
+        return identity - (self.node * self.stride)
 
     def report_times(self, times, name, heartbeat):
         if times:
             self.report(
-                "profile", {"graph": name, "heartbeat": heartbeat, "times": times, "version": self.store.version(name)}
+                "profile",
+                {"graph": name, "heartbeat": heartbeat.identity, "times": times, "version": self.store.version(name)},
             )
 
     def recv_graph(self, name, version, args, graph):
@@ -131,6 +179,14 @@ class GraphCollector(Node, Collector):
     def recv_graph_purge(self, name, version, args, graph):
         self.store.purge_graph(name, version, args, graph)
 
+    def update_completion(self, name, version, args, policy):
+        logger.info("%s: Setting completion policy of graph %s to %s", self.name, name, policy)
+        self.store.set_policy(name, policy)
+
+    def update_demand(self, name, version, args, demand):
+        logger.debug("%s: Updating the outputs in demand of graph %s", self.name, name)
+        self.store.set_demand(name, demand)
+
     def recv_graph_exception(self, name, version, exception):
         logger.exception("%s: Failure encountered updating graph (%s v%d):", self.name, name, version)
         self.report("error", "Failure updating graph: %s" % exception)
@@ -145,6 +201,34 @@ class GraphCollector(Node, Collector):
                 self.event_counter.labels(self.hutch, "Pruned Heartbeat", self.name).inc()
                 self.event_size.labels(self.hutch, self.name).set(pruned_size)
 
+        if self.shmem:
+            self.deserializer.reclaim()
+
+    def graph_failure(self, name, e):
+        e.graph_name = name
+        logger.exception("%s: Failure encountered while executing graph %s:", self.name, name)
+        self.report("error", e)
+        logger.error("%s: Purging graph (%s v%d)", self.name, name, self.store.version(name))
+        self.store.destroy(name)
+        self.report("purge", name)
+
+    def update(self, msg):
+        """
+        Adds a contribution to the event builder, which reduces it with the
+        graph as soon as it arrives.
+
+        Returns:
+            False if the graph failed and was purged, True otherwise.
+        """
+        try:
+            late = self.store.update(msg.name, msg.heartbeat, self.eb_id(msg.identity), msg.version, msg.payload)
+        except Exception as e:
+            self.graph_failure(msg.name, e)
+            return False
+        if late is not None:
+            self.event_counter.labels(self.hutch, "Late %s" % late.capitalize(), self.name).inc()
+        return True
+
     def process_msg(self, msg):
         if msg.mtype == MsgTypes.Transition:
             self.transitions.update(msg.payload.ttype, self.eb_id(msg.identity), msg.payload.payload)
@@ -172,8 +256,8 @@ class GraphCollector(Node, Collector):
                 exemplar={"TraceID": trace_id} if trace_id else None,
             )
             datagram_start = time.time()
-            self.store.update(msg.name, msg.heartbeat, self.eb_id(msg.identity), msg.version, msg.payload)
-            if self.store.ready(msg.name, msg.heartbeat):
+            updated = self.update(msg)
+            if updated and self.store.ready(msg.name, msg.heartbeat):
                 times, size = (None, None)
                 try:
                     # prune entries older than the current heartbeat
@@ -211,18 +295,14 @@ class GraphCollector(Node, Collector):
                     )
 
                     if self.store.graph(msg.name):
+                        self.report_times(self.store.graph(msg.name).pop_profile(), msg.name, msg.heartbeat)
                         for node, warning in self.store.graph(msg.name).warnings().items():
                             warning.graph_name = msg.name
                             self.report("warning", warning)
 
                 except Exception as e:
-                    e.graph_name = msg.name
-                    logger.exception("%s: Failure encountered while executing graph %s:", self.name, msg.name)
-                    self.report("error", e)
-                    logger.error("%s: Purging graph (%s v%d)", self.name, msg.name, self.store.version(msg.name))
-                    self.store.destroy(msg.name)
-                    self.report("purge", msg.name)
-            else:
+                    self.graph_failure(msg.name, e)
+            elif updated:
                 # prune older entries from the event builder
                 pruned_times, pruned_size = self.store.prune(msg.name, self.node)
                 if pruned_size:
@@ -245,6 +325,10 @@ class GraphCollector(Node, Collector):
 
             self.heartbeat_time[msg.heartbeat.identity] += time.time() - datagram_start
 
+            # release the shared memory of contributions which are no longer referenced
+            if self.shmem:
+                self.deserializer.reclaim()
+
 
 def run_collector(
     node_num,
@@ -261,6 +345,11 @@ def run_collector(
     hutch,
     hwm,
     timeout,
+    shmem=False,
+    compression=None,
+    collapsed=False,
+    sender=None,
+    stride=None,
 ):
     logger.info("Starting collector on node # %d PID: %d", node_num, os.getpid())
 
@@ -281,6 +370,11 @@ def run_collector(
         hutch,
         hwm,
         timeout,
+        shmem,
+        compression,
+        collapsed,
+        sender,
+        stride,
     ) as collector:
         collector.start_prometheus()
         return collector.run()
@@ -300,6 +394,8 @@ def run_node_collector(
     hwm,
     timeout,
     cprofile,
+    shmem=False,
+    compression=None,
 ):
     if cprofile:
         profiler = cProfile.Profile()
@@ -327,6 +423,8 @@ def run_node_collector(
         hutch,
         hwm,
         timeout,
+        shmem,
+        compression,
     )
 
 
@@ -344,6 +442,10 @@ def run_global_collector(
     hwm,
     timeout,
     cprofile,
+    compression=None,
+    shmem=False,
+    collapsed=False,
+    levels=0,
 ):
     if cprofile:
         profiler = cProfile.Profile()
@@ -371,6 +473,62 @@ def run_global_collector(
         hutch,
         hwm,
         timeout,
+        shmem,
+        compression,
+        collapsed,
+        tier_name(levels) if levels else None,
+    )
+
+
+def run_intermediate_collector(
+    level,
+    node_num,
+    num_contribs,
+    fan_in,
+    eb_depth,
+    collector_addr,
+    upstream_addr,
+    graph_addr,
+    msg_addr,
+    prometheus_dir,
+    prometheus_port,
+    hutch,
+    hwm,
+    timeout,
+    cprofile,
+    compression=None,
+):
+    if cprofile:
+        profiler = cProfile.Profile()
+        profiler.enable()
+
+        def handler(*args, **kwargs):
+            profiler.disable()
+            profiler.dump_stats(f"ami_intermediateCollector{level}_{node_num}.cprof")
+            sys.exit()
+
+        signal.signal(signal.SIGTERM, handler)
+
+    return run_collector(
+        node_num,
+        tier_name(level),
+        num_contribs,
+        eb_depth,
+        Colors.IntermediateCollector % level,
+        collector_addr,
+        upstream_addr,
+        graph_addr,
+        msg_addr,
+        prometheus_dir,
+        prometheus_port,
+        hutch,
+        hwm,
+        timeout,
+        False,
+        compression,
+        False,
+        tier_name(level - 1),
+        fan_in,
     )
 
 
@@ -431,6 +589,59 @@ def main(color, upstream_port, downstream_port):
 
     parser.add_argument("--cprofile", help="profile with cprofile", action="store_true")
 
+    parser.add_argument(
+        "--global-collectors",
+        type=int,
+        default=1,
+        help="number of global collector processes the graphs are sharded across, where the node number of each "
+        "global collector is its shard (default: 1)",
+    )
+
+    parser.add_argument(
+        "--fan-in",
+        type=int,
+        nargs="+",
+        default=[],
+        help="fan-in of each intermediate collector tier between the local and global collectors (default: none)",
+    )
+
+    if color == Colors.IntermediateCollector:
+        parser.add_argument(
+            "-L",
+            "--level",
+            type=int,
+            default=1,
+            help="level of the intermediate collector tier, starting at 1 after the local collectors (default: 1)",
+        )
+
+    parser.add_argument(
+        "--shmem-size",
+        type=int,
+        default=0,
+        help="size in MB of the shared memory buffer workers use to send large arrays to the node collector "
+        "(default: 0)",
+    )
+
+    parser.add_argument(
+        "--compression",
+        choices=sorted(Codecs),
+        default=None,
+        help="codec used to compress large arrays sent downstream (default: None)",
+    )
+
+    parser.add_argument(
+        "--compression-threshold",
+        type=int,
+        default=1024,
+        help="minimum size in kB of arrays to compress (default: 1024)",
+    )
+
+    parser.add_argument(
+        "--shuffle",
+        action="store_true",
+        help="byte shuffle numeric arrays before compressing them",
+    )
+
     parser.add_argument(
         "--tracing-endpoint",
         help="OpenTelemetry endpoint for tracing (e.g. localhost:4317 or 'console' for stdout)",
@@ -460,6 +671,36 @@ def main(color, upstream_port, downstream_port):
         default=[],
         help="extra flags as key=value pairs that are passed to the data source",
     )
+    worker_subparser.add_argument(
+        "--batch-size",
+        type=int,
+        default=1,
+        help="number of datagrams workers execute as a single batch within a heartbeat (default: 1)",
+    )
+    worker_subparser.add_argument(
+        "--prefetch",
+        type=int,
+        default=0,
+        help="number of messages workers read ahead from the data source on a background thread (default: 0)",
+    )
+    worker_subparser.add_argument(
+        "--share-subexpressions",
+        action="store_true",
+        help="workers compute the stateless nodes found in more than one graph once per event and share the results",
+    )
+    worker_subparser.add_argument(
+        "--branch-threads",
+        type=int,
+        default=0,
+        help="number of threads workers use to execute the independent branches of each graph in parallel "
+        "(default: 0)",
+    )
+    worker_subparser.add_argument(
+        "--select-slots",
+        type=int,
+        default=1024,
+        help="number of slots in the table used to select which worker sends each Pick1 (default: 1024)",
+    )
     worker_subparser.add_argument(
         "--use_supervisor",
         action="store_true",
@@ -468,6 +709,22 @@ def main(color, upstream_port, downstream_port):
 
     args = parser.parse_args()
 
+    if not 0 < args.global_collectors <= Ports.PortsPerPlatform // Ports.NumPorts:
+        parser.error("--global-collectors must be between 1 and %d" % (Ports.PortsPerPlatform // Ports.NumPorts))
+    if color == Colors.GlobalCollector and args.node_num >= args.global_collectors:
+        parser.error("the node number of a global collector must be less than --global-collectors")
+    if len(args.fan_in) >= Ports.PortsPerPlatform // Ports.NumPorts or any(fan < 1 for fan in args.fan_in):
+        parser.error(
+            "--fan-in must list at most %d tiers which are at least 1" % (Ports.PortsPerPlatform // Ports.NumPorts - 1)
+        )
+    level = 0
+    if color == Colors.IntermediateCollector:
+        level = args.level
+        if not 0 < level <= len(args.fan_in):
+            parser.error("--level must be between 1 and the number of tiers in --fan-in")
+        if args.num_contribs > args.fan_in[level - 1]:
+            parser.error("the number of contributors of an intermediate collector must not exceed its fan-in")
+
     if args.tracing_endpoint:
         os.environ["AMI_TRACING_ENDPOINT"] = args.tracing_endpoint
     if args.tracing_session_id:
@@ -484,6 +741,18 @@ def main(color, upstream_port, downstream_port):
     graph_addr = "tcp://%s:%d" % (args.host, args.port + Ports.Graph)
     msg_addr = "tcp://%s:%d" % (args.host, args.port + Ports.Message)
 
+    # the collectors of each intermediate tier listen on the node collector port of the block of the platform
+    # matching their level, and the collectors of the tier before them send to that port on the collection host
+    if color == Colors.IntermediateCollector:
+        collector_addr = shard_addr("tcp://*:%d" % (args.port + Ports.NodeCollector), level)
+    if color != Colors.GlobalCollector and level < len(args.fan_in):
+        downstream_addr = shard_addr("tcp://%s:%d" % (downstream_host, args.port + Ports.NodeCollector), level + 1)
+    # the graphs are sharded across the global collectors by name
+    elif color == Colors.GlobalCollector:
+        collector_addr = shard_addr(collector_addr, args.node_num)
+    elif args.global_collectors > 1:
+        downstream_addr = [shard_addr(downstream_addr, shard) for shard in range(args.global_collectors)]
+
     log_handlers = [logging.StreamHandler()]
     if args.log_file is not None:
         log_handlers.append(logging.FileHandler(args.log_file))
@@ -497,17 +766,9 @@ def main(color, upstream_port, downstream_port):
         if color == Colors.LocalCollector:
             if args.worker:
                 if args.num_contribs > 1:
-                    select_manager = mp.Manager()
-                    select_dict = select_manager.dict()
-                    select_lock = select_manager.Lock()
-                    select_hb = multiprocessing.sharedctypes.RawArray("Q", 128)
-                    select_idx = multiprocessing.sharedctypes.RawValue("I", 0)
+                    select_table = SelectTable(args.select_slots)
                 else:
-                    select_manager = None
-                    select_dict = None
-                    select_lock = None
-                    select_hb = None
-                    select_idx = None
+                    select_table = None
 
                 local_collector_addr = "tcp://localhost:%d" % (args.port + upstream_port)
                 export_addr = "tcp://%s:%d" % (args.host, args.port + Ports.Export)
@@ -537,7 +798,13 @@ def main(color, upstream_port, downstream_port):
                             args.hwm,
                             args.timeout,
                             args.cprofile,
-                            (select_lock, select_dict, select_idx, select_hb, select_manager),
+                            select_table,
+                            args.batch_size,
+                            args.prefetch,
+                            args.shmem_size,
+                            compression_options(args),
+                            args.share_subexpressions,
+                            args.branch_threads,
                         ),
                         daemon=True,
                     )
@@ -557,6 +824,8 @@ def main(color, upstream_port, downstream_port):
                 args.hwm,
                 args.timeout,
                 args.cprofile,
+                args.shmem_size > 0,
+                compression_options(args),
             )
         elif color == Colors.GlobalCollector:
             return run_global_collector(
@@ -573,6 +842,27 @@ def main(color, upstream_port, downstream_port):
                 args.hwm,
                 args.timeout,
                 args.cprofile,
+                compression_options(args),
+                levels=len(args.fan_in),
+            )
+        elif color == Colors.IntermediateCollector:
+            return run_intermediate_collector(
+                level,
+                args.node_num,
+                args.num_contribs,
+                args.fan_in[level - 1],
+                args.eb_depth,
+                collector_addr,
+                downstream_addr,
+                graph_addr,
+                msg_addr,
+                args.prometheus_dir,
+                args.prometheus_port,
+                args.hutch,
+                args.hwm,
+                args.timeout,
+                args.cprofile,
+                compression_options(args),
             )
         else:
             logger.critical("Invalid option collector color '%s' chosen!", color)
@@ -587,6 +877,10 @@ def node_main():
     return main(Colors.LocalCollector, Ports.NodeCollector, Ports.FinalCollector)
 
 
+def intermediate_main():
+    return main(Colors.IntermediateCollector, Ports.NodeCollector, Ports.FinalCollector)
+
+
 def global_main():
     return main(Colors.GlobalCollector, Ports.FinalCollector, Ports.Results)
 
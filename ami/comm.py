@@ -1,10 +1,18 @@
 import abc
 import argparse
 import asyncio
+import bisect
+import collections.abc
 import functools
+import hashlib
+import heapq
 import json
 import logging
+import math
+import multiprocessing
+import multiprocessing.sharedctypes
 import os
+import pickle
 import socket
 import sys
 import time
@@ -24,11 +32,13 @@ from ami.tracing import mark_span_error, start_child_span, start_span
 
 logger = logging.getLogger(__name__)
 ZMQ_TOPIC_DELIM = "\0"
+VIEW_LOD_MODES = ("mean", "max", "envelope")
 
 
 class Colors:
     Worker = "worker"
     LocalCollector = "localCollector"
+    IntermediateCollector = "intermediateCollector%d"
     GlobalCollector = "globalCollector"
 
 
@@ -69,6 +79,245 @@ class Ports(IntEnum):
             return port
 
 
+def shard_addr(addr, shard):
+    """
+    Returns the address of one shard of a collector tier whose first shard
+    uses `addr`. For ipc the shard number is appended to the path and for tcp
+    the shards use the port `Ports.NumPorts` after that of the previous shard,
+    so they fall in the unused ports of the platform.
+
+    Args:
+        addr (str): the zmq address of the first shard.
+        shard (int): the index of the shard.
+
+    Returns:
+        The zmq address of the shard.
+    """
+    if shard == 0:
+        return addr
+    elif addr.startswith("tcp://"):
+        host, port = addr.rsplit(":", 1)
+        return "%s:%d" % (host, int(port) + shard * Ports.NumPorts)
+    else:
+        return "%s%d" % (addr, shard)
+
+
+def view_stream_addr(addr):
+    """
+    Returns the address of the manager's PUB/SUB view stream, which is the
+    first free shard of the address used for view requests.
+
+    Args:
+        addr (str): the zmq address used for view requests.
+
+    Returns:
+        The zmq address of the view stream.
+    """
+    return shard_addr(addr, 1)
+
+
+def view_name(feature, mode=None, size=None):
+    """
+    Returns the name used to view a feature, optionally reduced by the manager
+    to a lower level of detail before it is sent. The reduced view is named
+    `feature@mode:size`, where the size is a number of points for 1D arrays
+    and `rowsxcols` for images.
+
+    Args:
+        feature (str): the name of the feature.
+        mode (str): the reduction mode, which is one of `VIEW_LOD_MODES`, or
+            None to view the feature at full resolution.
+        size (int or tuple): the target size of each axis of the view.
+
+    Returns:
+        The name of the view.
+
+    Raises:
+        ValueError: if the mode or size is invalid.
+    """
+    if mode is None:
+        return feature
+    if isinstance(size, int):
+        size = (size,)
+    if mode not in VIEW_LOD_MODES or not size or any(n < 1 for n in size):
+        raise ValueError("invalid level of detail %s:%s for %s" % (mode, size, feature))
+    return "%s@%s:%s" % (feature, mode, "x".join(map(str, size)))
+
+
+def parse_view_name(name):
+    """
+    Splits the name of a view created by `view_name` into its parts.
+
+    Args:
+        name (str): the name of the view.
+
+    Returns:
+        A tuple of the feature name, the reduction mode and the target size,
+        where the last two are None for full resolution views.
+
+    Raises:
+        ValueError: if the level of detail of the view is invalid.
+    """
+    feature, sep, lod = name.rpartition("@")
+    if not sep:
+        return name, None, None
+    mode, _, size = lod.partition(":")
+    try:
+        size = tuple(int(n) for n in size.split("x"))
+    except ValueError:
+        raise ValueError("invalid level of detail %s for %s" % (lod, feature)) from None
+    if mode not in VIEW_LOD_MODES or any(n < 1 for n in size):
+        raise ValueError("invalid level of detail %s for %s" % (lod, feature))
+    return feature, mode, size
+
+
+def downsample(value, mode, size):
+    """
+    Reduces a numeric array to a lower level of detail for viewing. Images
+    and 1D arrays are reduced by taking the mean (`mean`) or the maximum
+    (`max`) of blocks of elements, and 1D arrays can also be decimated to a
+    min/max envelope (`envelope`) of interleaved minimum and maximum values of
+    `size / 2` bins, which keeps the spikes of waveforms and time series.
+
+    Values which are not numeric arrays with one axis per target size, or
+    which are already small enough, are returned unchanged.
+
+    Args:
+        value: the value of the feature.
+        mode (str): the reduction mode, which is one of `VIEW_LOD_MODES`.
+        size (tuple): the target size of each axis.
+
+    Returns:
+        The reduced value.
+    """
+    if not isinstance(value, (np.ndarray, list, tuple)):
+        return value
+    data = np.asarray(value)
+    if data.dtype.kind not in "biuf" or data.ndim != len(size):
+        return value
+
+    if mode == "envelope":
+        bins = max(size[0] // 2, 1)
+        if data.ndim != 1 or data.size <= 2 * bins:
+            return value
+        starts = np.arange(0, data.size, math.ceil(data.size / bins))
+        envelope = np.empty(2 * starts.size, dtype=data.dtype)
+        envelope[0::2] = np.minimum.reduceat(data, starts)
+        envelope[1::2] = np.maximum.reduceat(data, starts)
+        return envelope
+
+    result = data
+    for axis, target in enumerate(size):
+        length = data.shape[axis]
+        factor = math.ceil(length / target)
+        if factor <= 1:
+            continue
+        starts = np.arange(0, length, factor)
+        if mode == "mean":
+            # the blocks at the edge are smaller when the length is not a multiple of the factor
+            blocks = np.diff(np.append(starts, length)).reshape([-1 if i == axis else 1 for i in range(data.ndim)])
+            result = np.add.reduceat(result, starts, axis=axis, dtype=np.float64) / blocks
+        else:
+            result = np.maximum.reduceat(result, starts, axis=axis)
+    return value if result is data else result
+
+
+def unpack_view(frames, deserializer):
+    """
+    Decodes the manager's reply to a batch view request. The reply starts with
+    a pickled header listing the number of frames of each feature, which are
+    followed by the serialized frames of the features.
+
+    Args:
+        frames (list): the frames of the reply.
+        deserializer (Deserializer): the deserializer for the features.
+
+    Returns:
+        A dictionary with the graph, the heartbeat and the data of the
+        requested features, where missing features are None.
+    """
+    header = pickle.loads(frames[0])
+    data = {}
+    offset = 1
+    for name, count in header["features"]:
+        data[name] = deserializer(frames[offset : offset + count]) if count else None
+        offset += count
+    return {"graph": header["graph"], "heartbeat": header["heartbeat"], "data": data}
+
+
+class ViewBuffer:
+    """Buffers the features streamed by the manager on the view stream by
+    heartbeat, so that the features a plot combines (e.g. the x and y of a
+    scatter plot or the bins and counts of a histogram) are always taken from
+    the same heartbeat.
+
+    The manager publishes each subscribed feature as its own message, so a
+    slow subscriber can drain the features of consecutive heartbeats in one go
+    and the send high water mark can drop some of them. A heartbeat missing
+    any of the features a plot needs is skipped rather than mixed with another
+    one.
+
+    Args:
+        depth (int): the number of most recent heartbeats to buffer.
+    """
+
+    def __init__(self, depth=4):
+        self.depth = depth
+        self.heartbeats = {}  # { heartbeat id : (Heartbeat, { feature : value }) }
+
+    def __len__(self):
+        return len(self.heartbeats)
+
+    def add(self, feature, heartbeat, value):
+        """
+        Adds a streamed feature to the buffer, evicting the oldest heartbeats
+        once more than `depth` are buffered.
+
+        Args:
+            feature (str): the name of the feature.
+            heartbeat (Heartbeat): the heartbeat the value belongs to.
+            value (object): the value of the feature.
+        """
+        if heartbeat.identity not in self.heartbeats:
+            self.heartbeats[heartbeat.identity] = (heartbeat, {})
+        self.heartbeats[heartbeat.identity][1][feature] = value
+        while len(self.heartbeats) > self.depth:
+            del self.heartbeats[min(self.heartbeats)]
+
+    def latest(self, required, optional=(), after=None):
+        """
+        Finds the most recent buffered heartbeat which has all the required
+        features.
+
+        Args:
+            required (set): the features which must all be from the heartbeat.
+            optional (set): features to include if they are from the heartbeat.
+            after (Heartbeat): only consider heartbeats newer than this one.
+
+        Returns:
+            A (Heartbeat, { feature : value }) tuple, or (None, {}) if no
+            buffered heartbeat has all the required features.
+        """
+        for identity in sorted(self.heartbeats, reverse=True):
+            if after is not None and identity <= after.identity:
+                break
+            heartbeat, values = self.heartbeats[identity]
+            if all(feature in values for feature in required):
+                features = set(required) | set(optional)
+                return heartbeat, {feature: value for feature, value in values.items() if feature in features}
+        return None, {}
+
+    def discard(self, heartbeat):
+        """
+        Drops the buffered heartbeats up to and including a heartbeat.
+
+        Args:
+            heartbeat (Heartbeat): the newest heartbeat to drop.
+        """
+        for identity in [identity for identity in self.heartbeats if identity <= heartbeat.identity]:
+            del self.heartbeats[identity]
+
+
 class PlatformAction(argparse.Action):
     """Class that defines an argparse action or ports/platforms.
 
@@ -377,22 +626,314 @@ class Store:
         self._plots = {}
 
 
+class FeatureHistory:
+    """Bounded ring buffer of the values a feature had over recent heartbeats.
+
+    Scalar values are kept in preallocated numpy columns alongside the id and
+    timestamp of their heartbeat. Any other kind of value (e.g. arrays) is
+    kept by reference in an object ring whose total size is capped at
+    `max_bytes`, evicting the oldest entries first. The newest entry is always
+    retained even if it alone exceeds the cap.
+
+    Args:
+        capacity (int): the maximum number of heartbeats to retain.
+        max_bytes (int): optional cap on the memory used by the retained
+            values. Defaults to no cap.
+
+    Raises:
+        ValueError: if `capacity` is less than one.
+    """
+
+    def __init__(self, capacity, max_bytes=None):
+        if capacity < 1:
+            raise ValueError("history capacity must be at least one not %d" % capacity)
+        self.capacity = capacity
+        self.max_bytes = max_bytes
+        self.clear()
+
+    def __len__(self):
+        return self._count
+
+    @staticmethod
+    def is_scalar(value):
+        """
+        Checks if a value can be stored in a compact numpy column.
+
+        Args:
+            value (object): the value to check.
+
+        Returns:
+            True if the value is a numeric scalar False otherwise.
+        """
+        return np.isscalar(value) and np.asarray(value).dtype.kind in "biufc"
+
+    @staticmethod
+    def sizeof(value):
+        """
+        Estimates the memory used by a retained value.
+
+        Args:
+            value (object): the value whose size is to be estimated.
+
+        Returns:
+            The size of the value in bytes.
+        """
+        if isinstance(value, np.ndarray):
+            return value.nbytes
+        else:
+            return sys.getsizeof(value)
+
+    @property
+    def nbytes(self):
+        """
+        Returns the memory used by the retained values in bytes.
+        """
+        return self._nbytes
+
+    def clear(self):
+        """
+        Discards all the retained entries.
+        """
+        self._heartbeats = np.zeros(self.capacity, dtype=np.int64)
+        self._timestamps = np.zeros(self.capacity, dtype=np.float64)
+        self._values = None
+        self._sizes = None
+        self._head = 0
+        self._count = 0
+        self._nbytes = 0
+
+    def _allocate(self, value):
+        if self.is_scalar(value):
+            dtype = np.asarray(value).dtype
+            capacity = self.capacity
+            if self.max_bytes is not None:
+                entry = dtype.itemsize + self._heartbeats.itemsize + self._timestamps.itemsize
+                capacity = max(1, min(capacity, self.max_bytes // entry))
+            self._values = np.zeros(capacity, dtype=dtype)
+            self._sizes = None
+        else:
+            self._values = np.empty(self.capacity, dtype=object)
+            self._sizes = np.zeros(self.capacity, dtype=np.int64)
+
+    def _evict(self):
+        tail = (self._head - self._count) % len(self._values)
+        if self._sizes is not None:
+            self._nbytes -= self._sizes[tail]
+            self._sizes[tail] = 0
+            self._values[tail] = None
+        self._count -= 1
+
+    def append(self, heartbeat, value):
+        """
+        Adds the value of the feature for a heartbeat to the history. If the
+        kind of value changes from scalar to non-scalar, or to a different
+        scalar type, the existing entries are discarded.
+
+        Args:
+            heartbeat (Heartbeat): the heartbeat the value belongs to.
+            value (object): the value of the feature.
+        """
+        if self._values is not None:
+            if self._sizes is None:
+                changed = not self.is_scalar(value) or np.asarray(value).dtype != self._values.dtype
+            else:
+                changed = self.is_scalar(value)
+            if changed:
+                logger.debug("History of feature changed type to %s - discarding previous entries", type(value))
+                self.clear()
+        if self._values is None:
+            self._allocate(value)
+
+        if self._count == len(self._values):
+            self._evict()
+
+        idx = self._head
+        self._heartbeats[idx] = heartbeat.identity
+        self._timestamps[idx] = heartbeat.timestamp
+        self._values[idx] = value
+        self._head = (self._head + 1) % len(self._values)
+        self._count += 1
+        if self._sizes is not None:
+            self._sizes[idx] = self.sizeof(value)
+            self._nbytes += self._sizes[idx]
+        else:
+            self._nbytes = self._count * self._values.itemsize
+
+        if self._sizes is not None and self.max_bytes is not None:
+            while self._count > 1 and self._nbytes > self.max_bytes:
+                self._evict()
+
+    def range(self, start=None, stop=None, key="heartbeat"):
+        """
+        Returns the retained entries, oldest first, that fall within the
+        inclusive range [start, stop] of heartbeat ids or timestamps.
+
+        Args:
+            start (int or float): the start of the range. Defaults to the
+                oldest entry.
+            stop (int or float): the end of the range. Defaults to the newest
+                entry.
+            key (str): either 'heartbeat' to select by heartbeat id or
+                'timestamp' to select by timestamp.
+
+        Raises:
+            ValueError: if `key` is not one of the supported values.
+
+        Returns:
+            A dictionary with the 'heartbeats', 'timestamps', and 'values' of
+            the selected entries. The values are a numpy array for scalar
+            features and a list otherwise.
+        """
+        if key == "heartbeat":
+            column = self._heartbeats
+        elif key == "timestamp":
+            column = self._timestamps
+        else:
+            raise ValueError("history range key must be 'heartbeat' or 'timestamp' not '%s'" % key)
+
+        size = len(self._values) if self._values is not None else self.capacity
+        order = np.arange(self._head - self._count, self._head) % size
+        selected = column[order]
+        mask = np.ones(len(order), dtype=bool)
+        if start is not None:
+            mask &= selected >= start
+        if stop is not None:
+            mask &= selected <= stop
+        order = order[mask]
+
+        if self._values is None:
+            values = []
+        elif self._sizes is None:
+            values = self._values[order]
+        else:
+            values = list(self._values[order])
+
+        return {"heartbeats": self._heartbeats[order], "timestamps": self._timestamps[order], "values": values}
+
+
+class GraphProfile:
+    """Execution profile of the nodes of a graph aggregated over the reports
+    of all the workers and collectors running it.
+
+    Each report maps the name of a node to its total execution time, number of
+    executions and total size of the outputs it returned since the previous
+    report of that process (see `Graph.pop_profile`). When the graph is
+    parallelized the wall time of each of its branches is reported in the same
+    way under the name of the branch. Reports of an older version of the graph
+    are ignored and those of a newer one start a new profile.
+
+    Args:
+        version (int): the version of the graph being profiled.
+    """
+
+    def __init__(self, version=None):
+        self.version = version
+        self.heartbeat = None
+        self.reporters = set()
+        self.nodes = {}  # { node name : [seconds, calls, bytes] }
+
+    def update(self, reporter, version, heartbeat, times):
+        """
+        Adds the report of a worker or collector to the profile.
+
+        Args:
+            reporter (str): the name of the process sending the report.
+            version (int): the version of the graph the report is for.
+            heartbeat (int): the id of the heartbeat of the report.
+            times (dict): the profile of each node reported by the process.
+
+        Returns:
+            True if the report was added to the profile, False if it is for
+            an older version of the graph.
+        """
+        if self.version is not None and version < self.version:
+            return False
+        if version != self.version:
+            self.version = version
+            self.heartbeat = None
+            self.reporters = set()
+            self.nodes = {}
+
+        self.reporters.add(reporter)
+        if self.heartbeat is None or heartbeat > self.heartbeat:
+            self.heartbeat = heartbeat
+        for name, (seconds, calls, nbytes) in times.items():
+            entry = self.nodes.setdefault(name, [0.0, 0, 0])
+            entry[0] += seconds
+            entry[1] += calls
+            entry[2] += nbytes
+        return True
+
+    def summary(self):
+        """
+        Summarizes the profile of each node.
+
+        Returns:
+            A dictionary mapping the name of each node to a dictionary with its
+            total execution time ('time') and mean time per execution ('mean')
+            in seconds, its number of executions ('calls'), and the total size
+            ('bytes') and mean size per execution ('mean_bytes') of its
+            outputs.
+        """
+        return {
+            name: {
+                "time": seconds,
+                "calls": calls,
+                "mean": seconds / calls if calls else 0.0,
+                "bytes": nbytes,
+                "mean_bytes": nbytes / calls if calls else 0.0,
+            }
+            for name, (seconds, calls, nbytes) in self.nodes.items()
+        }
+
+
 class ZmqHandler:
-    def __init__(self, addr, ctx=None, hwm=None):
+    """
+    Sends messages to the downstream collector tier over zmq.
+
+    When the downstream tier is split into several shards, each
+    `CollectorMessage` is sent to the shard its graph name is assigned to by
+    consistent hashing and all other messages (e.g. transitions) are sent to
+    every shard.
+
+    Args:
+        addr (str or list): the zmq address of the downstream collector, or a
+            list with the addresses of each shard of the downstream tier.
+        ctx (zmq.Context): optional zmq context to use. If none is passed it
+            creates one.
+        hwm (int): optional zmq send high water mark.
+        serializer (Serializer): optional serializer for the messages.
+    """
+
+    def __init__(self, addr, ctx=None, hwm=None, serializer=None):
         if ctx is None:
             self.ctx = zmq.Context()
         else:
             self.ctx = ctx
-        self.collector = self.ctx.socket(zmq.PUSH)
-        if hwm:
-            self.collector.setsockopt(zmq.SNDHWM, hwm)
-        self.collector.connect(addr)
-        self.serializer = Serializer()
+        self.collectors = []
+        for downstream_addr in [addr] if isinstance(addr, str) else addr:
+            collector = self.ctx.socket(zmq.PUSH)
+            if hwm:
+                collector.setsockopt(zmq.SNDHWM, hwm)
+            collector.connect(downstream_addr)
+            self.collectors.append(collector)
+        self.collector = self.collectors[0]
+        self.ring = HashRing(len(self.collectors)) if len(self.collectors) > 1 else None
+        if serializer is None:
+            self.serializer = Serializer()
+        else:
+            self.serializer = serializer
 
     def send(self, msg):
-        msg = self.serializer(msg)
-        self.collector.send_multipart(msg, copy=False)
-        return self.serializer.sizeof(msg)
+        frames = self.serializer(msg)
+        if self.ring is None:
+            self.collector.send_multipart(frames, copy=False)
+        elif isinstance(msg, CollectorMessage):
+            self.collectors[self.ring.shard(msg.name)].send_multipart(frames, copy=False)
+        else:
+            for collector in self.collectors:
+                collector.send_multipart(frames, copy=False)
+        return self.serializer.sizeof(frames)
 
     def message(self, mtype, identity, payload):
         msg = Message(mtype=mtype, identity=identity, payload=payload)
@@ -405,6 +946,200 @@ class ZmqHandler:
         return self.send(msg)
 
 
+class HashRing:
+    """
+    Consistent hash ring assigning names (e.g. graph names) to one of a fixed
+    number of shards. Each shard is placed on the ring at several points, and
+    a name belongs to the shard owning the first point after the hash of the
+    name, so the assignment is the same in all processes and only a small
+    fraction of the names move if the number of shards changes.
+
+    Args:
+        num_shards (int): the number of shards.
+        replicas (int): the number of points on the ring per shard.
+    """
+
+    def __init__(self, num_shards, replicas=64):
+        self.num_shards = num_shards
+        points = sorted(
+            (self.hash("%d:%d" % (shard, replica)), shard) for shard in range(num_shards) for replica in range(replicas)
+        )
+        self.points = [point for point, _ in points]
+        self.shards = [shard for _, shard in points]
+        self.assigned = {}
+
+    @staticmethod
+    def hash(key):
+        digest = hashlib.blake2b(key.encode(), digest_size=8).digest()
+        return int.from_bytes(digest, "little")
+
+    def shard(self, name):
+        """
+        Returns the shard a name is assigned to.
+
+        Args:
+            name (str): the name to look up.
+
+        Returns:
+            The index of the shard.
+        """
+        shard = self.assigned.get(name)
+        if shard is None:
+            idx = bisect.bisect(self.points, self.hash(name)) % len(self.points)
+            shard = self.assigned[name] = self.shards[idx]
+        return shard
+
+
+class SelectTable:
+    """
+    Shared memory table used by the workers on a node to pick which of them
+    sends the value of an automatically inserted Pick1 for each heartbeat.
+
+    Each (graph, output) pair is assigned a slot by hashing it into a fixed
+    size array (with linear probing on collisions). A slot holds the latest
+    heartbeat that has been claimed for it. Claiming a heartbeat is a
+    compare-and-swap done under a lock striped over the slots, so unlike a
+    `multiprocessing.Manager` no round-trip to a server process is needed.
+
+    A slot also records the latest graph version it was assigned for, so that
+    the slots of removed Pick1 nodes and purged graphs can be released for
+    reuse without releasing a slot a newer version of the graph still uses.
+
+    The table has to be created before the worker processes are started.
+
+    Args:
+        num_slots (int): the number of (graph, output) pairs the table can hold.
+        num_locks (int): the number of locks the slots are striped over.
+    """
+
+    def __init__(self, num_slots=1024, num_locks=64):
+        self.keys = multiprocessing.sharedctypes.RawArray("Q", num_slots)
+        self.versions = multiprocessing.sharedctypes.RawArray("Q", num_slots)
+        self.heartbeats = multiprocessing.sharedctypes.RawArray("Q", num_slots)
+        self.locks = [multiprocessing.Lock() for _ in range(min(num_locks, num_slots))]
+
+    def __len__(self):
+        return len(self.keys)
+
+    @staticmethod
+    def key(name, output):
+        """
+        Returns a non-zero 64-bit hash of a (graph, output) pair which is the
+        same in all processes.
+
+        Args:
+            name (str): the name of the graph.
+            output (str): the name of the output.
+
+        Returns:
+            The hash of the pair.
+        """
+        digest = hashlib.blake2b(("%s\0%s" % (name, output)).encode(), digest_size=8).digest()
+        return int.from_bytes(digest, "little") or 1
+
+    def _probe(self, key):
+        start = key % len(self.keys)
+        for probe in range(len(self.keys)):
+            yield (start + probe) % len(self.keys)
+
+    def _find(self, key):
+        # released slots leave gaps in the probe sequence, so the whole sequence is searched
+        for idx in self._probe(key):
+            if self.keys[idx] == key:
+                return idx
+        return None
+
+    def slot(self, name, output, version=0):
+        """
+        Returns the index of the slot for a (graph, output) pair, assigning a
+        free slot to it if needed.
+
+        Args:
+            name (str): the name of the graph.
+            output (str): the name of the output.
+            version (int): the version of the graph using the pair.
+
+        Returns:
+            The index of the slot, or None if the pair is not in the table and
+            there are no free slots.
+        """
+        key = self.key(name, output)
+
+        while True:
+            idx = self._find(key)
+            if idx is None:
+                break
+            with self.locks[idx % len(self.locks)]:
+                if self.keys[idx] == key:
+                    self.versions[idx] = max(self.versions[idx], version)
+                    return idx
+
+        for idx in self._probe(key):
+            if self.keys[idx] == 0:
+                with self.locks[idx % len(self.locks)]:
+                    if self.keys[idx] == 0:
+                        self.keys[idx] = key
+                        self.versions[idx] = version
+                        self.heartbeats[idx] = 0
+                        return idx
+                    elif self.keys[idx] == key:
+                        self.versions[idx] = max(self.versions[idx], version)
+                        return idx
+
+        return None
+
+    def release(self, name, output, version):
+        """
+        Frees the slot of a (graph, output) pair which is no longer used by
+        the passed version of the graph, unless a newer version uses it.
+
+        Args:
+            name (str): the name of the graph.
+            output (str): the name of the output.
+            version (int): the last version of the graph which used the pair.
+
+        Returns:
+            True if the slot was freed, False otherwise.
+        """
+        key = self.key(name, output)
+        idx = self._find(key)
+        if idx is None:
+            return False
+
+        with self.locks[idx % len(self.locks)]:
+            if self.keys[idx] == key and self.versions[idx] <= version:
+                self.keys[idx] = 0
+                self.versions[idx] = 0
+                self.heartbeats[idx] = 0
+                return True
+            else:
+                return False
+
+    def claim(self, idx, heartbeat):
+        """
+        Attempts to claim a heartbeat for the slot. Only the first claim for
+        each heartbeat succeeds.
+
+        Args:
+            idx (int): the index of the slot.
+            heartbeat (int): the identity of the heartbeat.
+
+        Returns:
+            True if the heartbeat was claimed, False otherwise.
+        """
+        # heartbeats are stored offset by one since zero marks an unclaimed slot
+        value = heartbeat + 1
+        if self.heartbeats[idx] >= value:
+            return False
+
+        with self.locks[idx % len(self.locks)]:
+            if self.heartbeats[idx] < value:
+                self.heartbeats[idx] = value
+                return True
+            else:
+                return False
+
+
 class ResultStore(ZmqHandler):
     """
     This class is a AMI /graph node that collects results
@@ -413,9 +1148,11 @@ class ResultStore(ZmqHandler):
     a Collector object.
     """
 
-    def __init__(self, addr, ctx=None, hwm=None, select_manager=(None, None, None, None, None)):
-        super().__init__(addr, ctx, hwm)
-        self.select_lock, self.select_dict, self.select_idx, self.select_hb, self.select_manager = select_manager
+    def __init__(self, addr, ctx=None, hwm=None, select_table=None, serializer=None):
+        super().__init__(addr, ctx, hwm, serializer)
+        self.select_table = select_table
+        self.select_slots = {}
+        self.select_full = set()
         self.stores = {}
 
     def __bool__(self):
@@ -429,22 +1166,54 @@ class ResultStore(ZmqHandler):
 
     def configure(self, name, version, outputs):
         if name not in self.stores:
+            previous = None
             self.stores[name] = Store(version=version)
         else:
+            previous = self.stores[name].version
             self.stores[name].version = version
 
-        if self.select_lock:
-            for output in outputs:
-                if not output.startswith("_auto"):
-                    continue
-
-                with self.select_lock:
-                    key = (name, output)
-                    if key not in self.select_dict:
-                        self.select_dict[key] = (self.select_idx.value, self.select_manager.Lock())
-                        self.select_idx.value = (self.select_idx.value + 1) % len(self.select_hb)
+        if self.select_table is not None:
+            selected = {output for output in outputs if output.startswith("_auto")}
+            # free the slots of the Pick1 nodes removed from the graph
+            if previous is not None:
+                self.release_slots(name, previous, keep=selected)
+            for output in selected:
+                self.select_slots.pop((name, output), None)
+                self.select_slot(name, output)
+
+    def select_slot(self, name, output):
+        """
+        Returns the index of the selection table slot of an automatically
+        inserted Pick1 output, or None if the table is full in which case
+        every worker sends the output.
+        """
+        key = (name, output)
+        if key not in self.select_slots:
+            idx = self.select_table.slot(name, output, self.stores[name].version)
+            if idx is None:
+                if key not in self.select_full:
+                    logger.warning(
+                        "No free slots left in the selection table (size %d) for %s of graph '%s', "
+                        "sending it from every worker",
+                        len(self.select_table),
+                        output,
+                        name,
+                    )
+                    self.select_full.add(key)
+                return None
+            self.select_full.discard(key)
+            self.select_slots[key] = idx
+        return self.select_slots[key]
+
+    def release_slots(self, name, version, keep=()):
+        for key in [key for key in self.select_slots if key[0] == name and key[1] not in keep]:
+            self.select_table.release(name, key[1], version)
+            del self.select_slots[key]
+        self.select_full = {key for key in self.select_full if key[0] != name or key[1] in keep}
 
     def remove(self, name):
+        if self.select_table is not None:
+            self.release_slots(name, self.stores[name].version)
         del self.stores[name]
 
     def update(self, name, updates):
@@ -453,34 +1222,16 @@ class ResultStore(ZmqHandler):
     def collect(self, identity, heartbeat):
         size = 0
 
-        if self.select_manager:
+        if self.select_table is not None:
             for name, store in self.stores.items():
                 ns = store.namespace
+                # Pick1 that are automatically inserted start with "_auto" and only one worker sends each of them
                 deletions = []
                 for val in ns:
-                    # Pick1 that are automatically inserted start with "_auto"
-                    if not val.startswith("_auto"):
-                        continue
-
-                    # select_dict stores a lock/detector and maps each detector to an index in select_hb
-                    # start = time.time()
-                    idx, lock = self.select_dict[(name, val)]  # { (graph, detector) : (index, lock) }
-                    if self.select_hb[idx] < heartbeat.identity:
-                        if lock.acquire(blocking=False):
-                            if self.select_hb[idx] < heartbeat.identity:
-                                # print(heartbeat, val, idx, identity, "SELECTED", time.time() - start)
-                                self.select_hb[idx] = heartbeat.identity
-
-                            else:
-                                # print(heartbeat, val, idx, identity, "FAILED UPDATE", time.time() - start)
-                                deletions.append(val)
-                            lock.release()
-                        else:
-                            # print(heartbeat, val, idx, identity, "NO LOCK", time.time() - start)
+                    if val.startswith("_auto"):
+                        idx = self.select_slot(name, val)
+                        if idx is not None and not self.select_table.claim(idx, heartbeat.identity):
                             deletions.append(val)
-                    else:
-                        # print(heartbeat, val, idx, identity, "DELETE", time.time() - start)
-                        deletions.append(val)
 
                 for delete in deletions:
                     del ns[delete]
@@ -504,11 +1255,143 @@ class ResultStore(ZmqHandler):
                 store.clear()
 
 
+class CompletionPolicy:
+    """
+    Policy which decides when a collector considers a heartbeat of a graph to
+    be complete, instead of waiting for every contributor.
+
+    Args:
+        quorum (float): the fraction of the contributors which must have sent
+            their contribution to a heartbeat before it is complete. Defaults
+            to 1.0 (all of them).
+        deadline (float): if set, the number of seconds after the arrival of
+            the first contribution to a heartbeat after which it is completed
+            with whatever contributions have arrived.
+        late (str): what to do with contributions to a heartbeat which has
+            already been completed: 'merge' them into the next pending
+            heartbeat or 'drop' them. Defaults to 'drop'.
+
+    Raises:
+        ValueError: if any of the arguments are out of range.
+    """
+
+    LATE = ("merge", "drop")
+
+    def __init__(self, quorum=1.0, deadline=None, late="drop"):
+        if not 0 < quorum <= 1:
+            raise ValueError("quorum of %s is not in the range (0, 1]" % quorum)
+        if deadline is not None and deadline <= 0:
+            raise ValueError("deadline of %s is not positive" % deadline)
+        if late not in self.LATE:
+            raise ValueError("late of '%s' is not one of: %s" % (late, ", ".join(self.LATE)))
+        self.quorum = quorum
+        self.deadline = deadline
+        self.late = late
+
+    def __repr__(self):
+        return "%s(quorum=%s, deadline=%s, late='%s')" % (
+            self.__class__.__name__,
+            self.quorum,
+            self.deadline,
+            self.late,
+        )
+
+    def required(self, num_contribs):
+        """
+        Returns the number of contributions needed for a heartbeat to be
+        complete.
+
+        Args:
+            num_contribs (int): the total number of contributors.
+        """
+        return max(1, math.ceil(self.quorum * num_contribs))
+
+
+class PendingRecord:
+    """
+    Compact record of everything a `ContributionBuilder` tracks for a pending
+    key: its payload, the bitmask of contributors which have sent it, when the
+    first contribution arrived and (for a `GraphBuilder`) the partial graph
+    results. Fields which have not been set hold `PendingRecord.EMPTY`.
+    """
+
+    __slots__ = ("payload", "contribs", "arrival", "result")
+
+    EMPTY = object()
+
+    def __init__(self):
+        self.payload = PendingRecord.EMPTY
+        self.contribs = PendingRecord.EMPTY
+        self.arrival = None
+        self.result = None
+
+
+class PendingView(collections.abc.MutableMapping):
+    """
+    Dict-like view of one field of the pending records of a
+    `ContributionBuilder`, keyed by the eb_key of the records.
+
+    Args:
+        builder (ContributionBuilder): the builder whose records are viewed
+        field (str): the name of the `PendingRecord` field to view
+    """
+
+    def __init__(self, builder, field):
+        self.builder = builder
+        self.field = field
+
+    def __getitem__(self, eb_key):
+        value = getattr(self.builder.records[eb_key], self.field)
+        if value is PendingRecord.EMPTY:
+            raise KeyError(eb_key)
+        return value
+
+    def __setitem__(self, eb_key, value):
+        setattr(self.builder.record(eb_key), self.field, value)
+
+    def __delitem__(self, eb_key):
+        record = self.builder.records[eb_key]
+        if getattr(record, self.field) is PendingRecord.EMPTY:
+            raise KeyError(eb_key)
+        setattr(record, self.field, PendingRecord.EMPTY)
+        if record.payload is PendingRecord.EMPTY and record.contribs is PendingRecord.EMPTY:
+            self.builder.discard(eb_key)
+
+    def __iter__(self):
+        return (
+            eb_key
+            for eb_key, record in self.builder.records.items()
+            if getattr(record, self.field) is not PendingRecord.EMPTY
+        )
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __repr__(self):
+        return repr(dict(self))
+
+
 class ContributionBuilder(abc.ABC):
     def __init__(self, num_contribs):
         self.num_contribs = num_contribs
-        self.pending = {}  # {eb_key : payload}
-        self.contribs = {}
+        self.records = {}  # {eb_key : PendingRecord}
+        self.pending = PendingView(self, "payload")  # {eb_key : payload}
+        self.contribs = PendingView(self, "contribs")  # {eb_key : bitmask of contributors}
+
+    def record(self, eb_key):
+        """
+        Returns the record of a pending key, creating it if needed.
+        """
+        record = self.records.get(eb_key)
+        if record is None:
+            record = self.records[eb_key] = PendingRecord()
+        return record
+
+    def discard(self, eb_key):
+        """
+        Removes the record of a pending key.
+        """
+        self.records.pop(eb_key, None)
 
     @abc.abstractmethod
     def _complete(self, eb_key, identity, drop, prune_metadata=None):
@@ -521,8 +1404,7 @@ class ContributionBuilder(abc.ABC):
     def complete(self, eb_key, identity, drop=False, prune_metadata=None):
         if eb_key in self.pending:
             times, size = self._complete(eb_key, identity, drop, prune_metadata=prune_metadata)
-            del self.pending[eb_key]
-            del self.contribs[eb_key]
+            self.discard(eb_key)
             logger.debug("Completed key %s", eb_key)
             return times, size
 
@@ -530,9 +1412,10 @@ class ContributionBuilder(abc.ABC):
 
     def mark(self, eb_key, eb_id):
         if 0 <= eb_id < self.num_contribs:
-            if eb_key not in self.contribs:
-                self.contribs[eb_key] = 0
-            self.contribs[eb_key] |= 1 << eb_id
+            record = self.record(eb_key)
+            if record.contribs is PendingRecord.EMPTY:
+                record.contribs = 0
+            record.contribs |= 1 << eb_id
         else:
             raise ValueError("eb_id of %d is invalid for %d contributors" % (eb_id, self.num_contribs))
 
@@ -544,9 +1427,10 @@ class ContributionBuilder(abc.ABC):
             raise ValueError("eb_id of %d is invalid for %d contributors" % (eb_id, self.num_contribs))
 
     def ready(self, eb_key):
-        if eb_key not in self.contribs:
+        record = self.records.get(eb_key)
+        if record is None:
             return False
-        return ((1 << self.num_contribs) - 1) == self.contribs[eb_key]
+        return ((1 << self.num_contribs) - 1) == record.contribs
 
 
 class GraphBuilder(ContributionBuilder):
@@ -559,7 +1443,12 @@ class GraphBuilder(ContributionBuilder):
         self.pending_graphs = {}
         self.version = None
         self.completion = completion
-        self.arrival_times = {}
+        self.order = []  # heap of pending heartbeats
+        self.streaming = None
+        self.policy = None
+        self.completed = None  # newest completed heartbeat
+        self.carryover = []  # late contributions waiting for a heartbeat to merge into
+        self.demand = None  # outputs of the graph in demand, or None to execute all of it
 
         self.last_idle_secs = 0
         self.last_graph_exec_secs = 0
@@ -584,6 +1473,7 @@ class GraphBuilder(ContributionBuilder):
 
     def _compile(self, args):
         if self.graph:
+            self.graph.demand(self.demand)
             self.graph.compile(**args)
 
     def prune(self, identity, prune_key=None, drop=False):
@@ -598,35 +1488,128 @@ class GraphBuilder(ContributionBuilder):
         else:
             depth = 1
 
-        if len(self.pending) > depth:
-            for eb_key in reversed(sorted(self.pending.keys(), reverse=True)[depth:]):
+        while len(self.records) > depth:
+            eb_key = self.oldest()
+            if eb_key in self.pending:
                 logger.debug("Pruned uncompleted key %s", eb_key)
-                # Capture pruning metadata from bitmask before complete() deletes it
-                contribs_mask = self.contribs.get(eb_key, 0)
-                num_present = bin(contribs_mask).count("1")
-                ratio = num_present / self.num_contribs if self.num_contribs else 0
-                age = self.latest.identity - eb_key.identity if hasattr(eb_key, "identity") else 0
-                missing_workers = [i for i in range(self.num_contribs) if not (contribs_mask & (1 << i))]
-
-                prune_metadata = {
-                    "collector.contrib_ratio": round(ratio, 4),
-                    "collector.num_present": num_present,
-                    "collector.num_contribs": self.num_contribs,
-                    "collector.prune_age": age,
-                    "collector.missing_workers": missing_workers,
-                }
-
-                times, size = self.complete(eb_key, identity, drop, prune_metadata=prune_metadata)
+                times, size = self.complete(eb_key, identity, drop, prune_metadata=self.prune_metadata(eb_key))
+            else:
+                self.discard(eb_key)
+
+        if prune_key is None and self.policy is not None and self.policy.deadline is not None:
+            expired = time.time_ns() - int(self.policy.deadline * 1e9)
+            while self.records:
+                eb_key = self.oldest()
+                arrival = self.records[eb_key].arrival
+                if arrival is None or arrival > expired:
+                    break
+                logger.debug("Deadline passed for uncompleted key %s", eb_key)
+                times, size = self.complete(eb_key, identity, drop, prune_metadata=self.prune_metadata(eb_key))
 
         return times, size
 
+    def record(self, eb_key):
+        if eb_key not in self.records:
+            heapq.heappush(self.order, eb_key)
+        return super().record(eb_key)
+
+    def oldest(self):
+        """
+        Returns the oldest pending heartbeat, or None if there are none.
+        Entries for heartbeats which are no longer pending are removed from
+        the heap lazily.
+        """
+        while self.order and self.order[0] not in self.records:
+            heapq.heappop(self.order)
+        return self.order[0] if self.order else None
+
+    def ready(self, eb_key):
+        if self.policy is None:
+            return super().ready(eb_key)
+        record = self.records.get(eb_key)
+        if record is None or record.contribs is PendingRecord.EMPTY:
+            return False
+        return bin(record.contribs).count("1") >= self.policy.required(self.num_contribs)
+
+    def update(self, eb_key, eb_id, ver_key, data):
+        """
+        Adds a contribution to a heartbeat.
+
+        Returns:
+            'merged' or 'dropped' if the heartbeat had already been completed
+            and the contribution was handled according to the late policy of
+            the builder, otherwise None.
+        """
+        if self.policy is None or self.completed is None or eb_key > self.completed:
+            return super().update(eb_key, eb_id, ver_key, data)
+
+        if not 0 <= eb_id < self.num_contribs:
+            raise ValueError("eb_id of %d is invalid for %d contributors" % (eb_id, self.num_contribs))
+
+        if self.policy.late == "drop":
+            logger.debug("Dropped late contribution to key %s from id %s", eb_key, eb_id)
+            return "dropped"
+
+        # late contributions are stored under their own name so they can't replace the contributor's own
+        # contribution to the heartbeat they are merged into, and they are not marked as contributing to it
+        target = self.oldest()
+        if target is None:
+            self.carryover.append(((eb_id, eb_key), ver_key, data))
+        else:
+            self._update(target, (eb_id, eb_key), ver_key, data)
+        logger.debug("Merged late contribution to key %s from id %s", eb_key, eb_id)
+        return "merged"
+
+    def prune_metadata(self, eb_key):
+        # Capture pruning metadata from bitmask before complete() deletes it
+        contribs_mask = self.contribs.get(eb_key, 0)
+        num_present = bin(contribs_mask).count("1")
+        ratio = num_present / self.num_contribs if self.num_contribs else 0
+        age = self.latest.identity - eb_key.identity if hasattr(eb_key, "identity") else 0
+        missing_workers = [i for i in range(self.num_contribs) if not (contribs_mask & (1 << i))]
+
+        return {
+            "collector.contrib_ratio": round(ratio, 4),
+            "collector.num_present": num_present,
+            "collector.num_contribs": self.num_contribs,
+            "collector.prune_age": age,
+            "collector.missing_workers": missing_workers,
+        }
+
     def flush(self, identity, drop=False):
         size = self.prune(identity, self.latest.identity + 1, drop)
         if drop and self.graph:
             self.graph.reset()
         self.latest = Heartbeat(0, 0)
+        self.completed = None
+        self.carryover = []
         return size
 
+    def set_policy(self, policy):
+        """
+        Sets the completion policy of the builder.
+
+        Args:
+            policy (CompletionPolicy): the new policy, or None to wait for all
+                the contributors and treat late contributions as a new
+                heartbeat.
+        """
+        self.policy = policy
+        if policy is None:
+            self.carryover = []
+
+    def set_demand(self, demand):
+        """
+        Sets the outputs of the graph in demand, see `Graph.demand`.
+
+        Args:
+            demand (set): the outputs in demand, or None to execute the whole
+                graph.
+        """
+        self.demand = demand
+        if self.graph:
+            self.graph.demand(demand)
+
     def begin_run(self):
         if self.graph:
             self.graph.begin_run(color=self.color)
@@ -671,33 +1654,63 @@ class GraphBuilder(ContributionBuilder):
         else:
             return False
 
-    def _complete(self, eb_key, identity, drop, prune_metadata=None):
-        times = []
-        if self.apply_graph(self.pending[eb_key].version):
-            contribs = self.pending[eb_key].namespace
-            self.pending[eb_key].clear()
+    def _fold(self, eb_key):
+        """
+        Executes the graph on the contributions to a heartbeat which have not
+        been reduced yet and merges the results, so that the contributions can
+        be freed as soon as they arrive.
+
+        Args:
+            eb_key (Heartbeat): the heartbeat to reduce.
+
+        Returns:
+            A (Store, times) tuple of the merged graph results of the heartbeat
+            and the execution times of the graph.
+        """
+        record = self.records[eb_key]
+        contribs = record.payload
+        if record.result is None:
+            record.result = (Store(version=contribs.version), [])
+        result, times = record.result
+
+        if contribs and self.apply_graph(contribs.version):
+            self.streaming = eb_key
             if self.graph:
-                for data in contribs.values():
+                for data in contribs.namespace.values():
                     start = time.time()
                     graph_result = self.graph(data, color=self.color)
                     stop = time.time()
-                    self.pending[eb_key].update(graph_result)
+                    result.update(graph_result)
+                    self.graph.record(graph_result)
                     exec_time = self.graph.times()
                     if exec_time:
                         times.append((start, stop, exec_time))
-        else:
-            self.pending[eb_key].clear()
+            contribs.clear()
+
+        return result, times
+
+    def _complete(self, eb_key, identity, drop, prune_metadata=None):
+        if self.streaming is not None and self.streaming != eb_key and self.streaming in self.pending:
+            # the graph holds a partial reduction of an older heartbeat, which has to be finished first
+            self.complete(self.streaming, identity, drop, prune_metadata=self.prune_metadata(self.streaming))
+
+        result, times = self._fold(eb_key)
+        self.streaming = None
+        if self.completed is None or eb_key > self.completed:
+            self.completed = eb_key
+        # drop any contributions whose graph version could not be applied
+        self.pending[eb_key].clear()
 
         send_start_ns = time.time_ns()
-        size = self.completion(eb_key, identity, self.pending[eb_key], drop)
+        size = self.completion(eb_key, identity, result, drop)
         send_end_ns = time.time_ns()
 
         if self.graph:
-            self.graph.heartbeat_finished()
+            self.graph.heartbeat_finished(color=self.color)
 
         # Create trace spans (unified for both normal and prune paths)
         hb_identity = eb_key.identity if hasattr(eb_key, "identity") else eb_key
-        arrival_ns = self.arrival_times.pop(eb_key, None)
+        arrival_ns = self.records[eb_key].arrival
         complete_end_ns = time.time_ns()
         graph_exec_secs = sum(s[1] - s[0] for s in times) if times else 0
         send_secs = (send_end_ns - send_start_ns) / 1e9
@@ -798,22 +1811,31 @@ class GraphBuilder(ContributionBuilder):
         return times, size
 
     def _update(self, eb_key, eb_id, ver_key, data):
-        if eb_key not in self.pending:
-            self.pending[eb_key] = Store(version=ver_key)
-            self.contribs[eb_key] = 0
-            self.arrival_times[eb_key] = time.time_ns()
+        record = self.record(eb_key)
+        if record.payload is PendingRecord.EMPTY:
+            record.payload = Store(version=ver_key)
+            record.contribs = 0
+            record.arrival = time.time_ns()
+            if self.carryover:
+                carryover, self.carryover = self.carryover, []
+                for late_id, late_ver, late_data in carryover:
+                    self._update(eb_key, late_id, late_ver, late_data)
         if eb_key > self.latest:
             self.latest = eb_key
-        if ver_key != self.pending[eb_key].version:
+        if ver_key != record.payload.version:
             logger.error(
                 "Graph version mismatch: heartbeat %s from id %s has version %s when %s was expected",
                 eb_key,
                 eb_id,
                 ver_key,
-                self.pending[eb_key].version,
+                record.payload.version,
             )
         else:
-            self.pending[eb_key].put(eb_id, data)
+            record.payload.put(eb_id, data)
+            # contributions are reduced on arrival, as long as the graph is not already holding the partial
+            # reduction of another heartbeat, otherwise they are buffered until the heartbeat is completed
+            if self.streaming == eb_key or (self.streaming is None and eb_key == self.oldest()):
+                self._fold(eb_key)
 
 
 class TransitionBuilder(ContributionBuilder, ZmqHandler):
@@ -846,17 +1868,49 @@ class TransitionBuilder(ContributionBuilder, ZmqHandler):
 
 class EventBuilder(ZmqHandler):
 
-    def __init__(self, num_contribs, depth, color, addr, ctx=None, hwm=None):
-        super().__init__(addr, ctx, hwm)
+    def __init__(self, num_contribs, depth, color, addr, ctx=None, hwm=None, serializer=None):
+        super().__init__(addr, ctx, hwm, serializer)
         self.num_contribs = num_contribs
         self.depth = depth
         self.color = color
         self.builders = {}
+        self.policies = {}
+        self.demands = {}
 
     def create(self, name):
         self.builders[name] = GraphBuilder(
             self.num_contribs, self.depth, self.color, functools.partial(self.completion, name)
         )
+        self.builders[name].set_policy(self.policies.get(name))
+        self.builders[name].set_demand(self.demands.get(name))
+
+    def set_policy(self, name, policy):
+        """
+        Sets the completion policy used for the heartbeats of a graph. The
+        policy is kept if the graph is purged and later recreated.
+
+        Args:
+            name (str): the name of the graph.
+            policy (CompletionPolicy): the new policy, or None to wait for all
+                the contributors.
+        """
+        self.policies[name] = policy
+        if name in self.builders:
+            self.builders[name].set_policy(policy)
+
+    def set_demand(self, name, demand):
+        """
+        Sets the outputs of a graph in demand, whose ancestors are the only
+        nodes of the graph executed.
+
+        Args:
+            name (str): the name of the graph.
+            demand (set): the outputs in demand, or None to execute the whole
+                graph.
+        """
+        self.demands[name] = demand
+        if name in self.builders:
+            self.builders[name].set_demand(demand)
 
     def destroy(self, name):
         del self.builders[name]
@@ -904,6 +1958,7 @@ class EventBuilder(ZmqHandler):
     def purge_graph(self, name, ver_key, args, graph):
         if name in self.builders:
             self.destroy(name)
+        self.demands.pop(name, None)
 
     def complete(self, name, eb_key, identity, drop=False):
         return self.builders[name].complete(eb_key, identity, drop)
@@ -915,7 +1970,7 @@ class EventBuilder(ZmqHandler):
     def update(self, name, eb_key, eb_id, ver_key, data):
         if name not in self.builders:
             self.create(name)
-        self.builders[name].update(eb_key, eb_id, ver_key, data)
+        return self.builders[name].update(eb_key, eb_id, ver_key, data)
 
     def phase_times(self, name):
         """Return (idle_secs, graph_exec_secs, send_secs) for last completed heartbeat."""
@@ -1484,6 +2539,7 @@ class ExportReceiver(BaseReceiver):
 
     def __init__(self, addr, ctx=None):
         super().__init__(addr, "data", ctx=ctx)
+        self.deserializer = Deserializer()
 
     def recv(self, block=True):
         """
@@ -1503,7 +2559,7 @@ class ExportReceiver(BaseReceiver):
         else:
             self.sock.recv_string(flags=zmq.NOBLOCK)
         name = self.sock.recv_string()
-        payload = self.sock.recv_pyobj()
+        payload = self.sock.recv_serialized(self.deserializer, copy=False)
         return name, payload
 
 
@@ -1906,6 +2962,95 @@ class CommHandler(abc.ABC):
     def updatePlots(self, plots):
         return self._post_dill("update_plots", plots)
 
+    def updateCompletion(self, policy):
+        """
+        Sets the policy the collectors use to decide when a heartbeat of the
+        graph is complete.
+
+        Args:
+            policy (CompletionPolicy): the new policy, or None to wait for all
+                the contributors.
+        """
+        return self._post_dill("update_completion", policy)
+
+    @property
+    def histories(self):
+        """
+        The features of the graph whose values over recent heartbeats are
+        retained by the manager.
+
+        Returns:
+            A dictionary where the keys are the names of the tracked features
+            and the values are the number of heartbeats currently retained.
+        """
+        return self._request("get_histories")
+
+    @property
+    def profile(self):
+        """
+        The execution profile of the nodes of the current version of the
+        graph, aggregated by the manager over the reports of all the workers
+        and collectors since the graph was last updated.
+
+        Returns:
+            A dictionary where the keys are the names of the nodes and the
+            values are dictionaries with their total execution time ('time')
+            and mean time per execution ('mean') in seconds, their number of
+            executions ('calls'), and the total size ('bytes') and mean size
+            per execution ('mean_bytes') of the outputs they sent downstream.
+        """
+        return self._request("get_profile")
+
+    def trackHistory(self, name, capacity=None, max_bytes=None):
+        """
+        Asks the manager to retain the values of a feature of the graph over
+        the most recent heartbeats, so that they can later be retrieved with
+        `fetchHistory` without adding a buffer to the graph itself.
+
+        Args:
+            name (str): the name of the feature to track.
+            capacity (int): the number of heartbeats to retain. Defaults to
+                the manager's default.
+            max_bytes (int): the cap on the memory used by the retained values
+                of non-scalar features. Defaults to the manager's default.
+
+        Returns:
+            True if the request was successful, False otherwise.
+        """
+        return self._post_dill("track_history", (name, capacity, max_bytes))
+
+    def untrackHistory(self, name):
+        """
+        Stops retaining the values of a feature and discards its history.
+
+        Args:
+            name (str): the name of the tracked feature.
+
+        Returns:
+            True if the request was successful, False otherwise.
+        """
+        return self._post_dill("untrack_history", name)
+
+    def fetchHistory(self, name, start=None, stop=None, key="heartbeat"):
+        """
+        Fetches the retained values of a tracked feature that fall within the
+        inclusive range [start, stop] of heartbeat ids or timestamps.
+
+        Args:
+            name (str): the name of the tracked feature.
+            start (int or float): the start of the range. Defaults to the
+                oldest retained heartbeat.
+            stop (int or float): the end of the range. Defaults to the newest
+                retained heartbeat.
+            key (str): either 'heartbeat' to select by heartbeat id or
+                'timestamp' to select by unix timestamp.
+
+        Returns:
+            A dictionary with the 'heartbeats', 'timestamps', and 'values' of
+            the selected entries, or None if the feature is not tracked.
+        """
+        return self._post_query("get_history", (name, start, stop, key))
+
     def fetch(self, names):
         """
         Attempts to fetch a feature with the requested name from the global
@@ -2269,6 +3414,10 @@ class CommHandler(abc.ABC):
     def _post_dill(self, cmd, payload):
         pass
 
+    @abc.abstractmethod
+    def _post_query(self, cmd, payload):
+        pass
+
     @abc.abstractmethod
     def _view(self, names):
         pass
@@ -2408,6 +3557,13 @@ class AsyncGraphCommHandler(ZmqCommHandler):
             await self._sock.send(dill.dumps(payload))
             return (await self._sock.recv_string()) == "ok"
 
+    async def _post_query(self, cmd, payload):
+        async with self.lock:
+            await self._header(cmd, zmq.SNDMORE)
+            await self._sock.send(dill.dumps(payload))
+            if (await self._sock.recv_string()) == "ok":
+                return await self._sock.recv_pyobj()
+
     async def _view(self, names):
         nodes = []
         for name, parent in names.items():
@@ -2522,6 +3678,12 @@ class GraphCommHandler(ZmqCommHandler):
         self._sock.send(dill.dumps(payload))
         return self._sock.recv_string() == "ok"
 
+    def _post_query(self, cmd, payload):
+        self._header(cmd, zmq.SNDMORE)
+        self._sock.send(dill.dumps(payload))
+        if self._sock.recv_string() == "ok":
+            return self._sock.recv_pyobj()
+
     def _view(self, names):
         nodes = []
         for name, parent in names.items():
@@ -1,6 +1,8 @@
 import abc
+import collections
 import datetime
 import inspect
+import io
 import json
 import logging
 import os
@@ -10,6 +12,7 @@ import sys
 import threading
 import time
 import typing
+from multiprocessing import resource_tracker, shared_memory
 
 import dill
 import zmq
@@ -19,16 +22,18 @@ try:
 except ImportError:
     h5py = None
 try:
-    import warnings
-
-    warnings.simplefilter(action="ignore", category=FutureWarning)
     import pyarrow as pa
-
-    if not hasattr(pa, "SerializationContext"):
-        pa = None
 except ImportError:
     pa = None
-from dataclasses import asdict, dataclass, field
+try:
+    import lz4.frame as lz4
+except ImportError:
+    lz4 = None
+try:
+    import zstandard as zstd
+except ImportError:
+    zstd = None
+from dataclasses import dataclass, field
 from enum import Enum
 
 import amitypes as at
@@ -45,12 +50,6 @@ class MsgTypes(Enum):
     Datagram = 2
     Graph = 3
 
-    def _serialize(msgType):
-        return {"type": msgType.value}
-
-    def _deserialize(data):
-        return MsgTypes(data["type"])
-
 
 class Transitions(Enum):
     Allocate = 0
@@ -61,25 +60,12 @@ class Transitions(Enum):
     Enable = 5
     Disable = 6
 
-    def _serialize(transitionType):
-        return {"type": transitionType.value}
-
-    def _deserialize(data):
-        return Transitions(data["type"])
-
 
 @dataclass
 class Transition:
     ttype: Transitions
     payload: dict
 
-    def _serialize(self):
-        return asdict(self)
-
-    @classmethod
-    def _deserialize(cls, data):
-        return cls(**data)
-
 
 @dataclass(frozen=True)
 class Heartbeat:
@@ -115,13 +101,6 @@ class Heartbeat:
     def __ge__(self, other):
         return self.identity >= other
 
-    def _serialize(self):
-        return asdict(self)
-
-    @classmethod
-    def _deserialize(cls, data):
-        return cls(**data)
-
 
 @dataclass
 class Datagram:
@@ -129,13 +108,6 @@ class Datagram:
     dtype: type
     data: dict = field(default_factory=dict)
 
-    def _serialize(self):
-        return self.__dict__
-
-    @classmethod
-    def _deserialize(cls, data):
-        return cls(**data)
-
 
 @dataclass
 class Message:
@@ -156,14 +128,6 @@ class Message:
     timestamp: int = 0  # typically raw data source (LCLS) timestamp
     unix_ts: float = 0  # timestamp converted to unix_ts
 
-    def _serialize(self):
-        return asdict(self)
-
-    def _deserialize(data):
-        if data["mtype"] == MsgTypes.Transition:
-            data["payload"] = Transition(**data["payload"])
-        return Message(**data)
-
 
 @dataclass
 class CollectorMessage(Message):
@@ -182,47 +146,161 @@ class CollectorMessage(Message):
     name: str = ""
     version: int = 0
 
-    def _serialize(self):
-        return self.__dict__
 
-    @classmethod
-    def _deserialize(cls, data):
-        return cls(**data)
+class Codec:
+    """
+    Base class of the compression codecs which `ModuleSerializer` can apply
+    to large out-of-band buffers. The id of each codec is recorded in the
+    serialized message so `ModuleDeserializer` can decode it.
+
+    Args:
+        level (int): the compression level, or None for the codec's default.
+    """
+
+    ident = 0
+
+    def __init__(self, level=None):
+        self.level = level
+
+    def encode(self, data):
+        return data
+
+    def decode(self, data):
+        return data
+
+
+class Lz4Codec(Codec):
+
+    ident = 1
+
+    def __init__(self, level=None):
+        if lz4 is None:
+            raise NotImplementedError("lz4 compression requires the lz4 package!")
+        super().__init__(level)
 
+    def encode(self, data):
+        return lz4.compress(data, compression_level=self.level or 0)
 
-def build_serialization_context():
-    def register(ctx, cls):
-        ctx.register_type(cls, cls.__name__, custom_serializer=cls._serialize, custom_deserializer=cls._deserialize)
+    def decode(self, data):
+        return lz4.decompress(data)
 
-    context = pa.SerializationContext()
-    for cls in [MsgTypes, Transitions, Heartbeat, Message, CollectorMessage, Transition, Datagram]:
-        register(context, cls)
-    for cls in at.PyArrowTypes:
-        register(context, cls)
 
-    return context
+class ZstdCodec(Codec):
+
+    ident = 2
+
+    def __init__(self, level=None):
+        if zstd is None:
+            raise NotImplementedError("zstd compression requires the zstandard package!")
+        super().__init__(level)
+        self.compressor = zstd.ZstdCompressor(level=3 if level is None else level)
+        self.decompressor = zstd.ZstdDecompressor()
+
+    def encode(self, data):
+        return self.compressor.compress(data)
+
+    def decode(self, data):
+        return self.decompressor.decompress(data)
+
+
+Codecs = {
+    "lz4": Lz4Codec,
+    "zstd": ZstdCodec,
+}
+
+
+def byte_shuffle(data, itemsize):
+    """
+    Byte shuffles a buffer so that the n-th byte of every element is stored
+    contiguously, which makes numeric arrays far more compressible.
+    """
+    return np.frombuffer(data, dtype=np.uint8).reshape(-1, itemsize).T.tobytes()
+
+
+def byte_unshuffle(data, itemsize):
+    """
+    Reverses `byte_shuffle`.
+    """
+    return np.frombuffer(data, dtype=np.uint8).reshape(itemsize, -1).T.tobytes()
 
 
 class ModuleSerializer:
+    """
+    Serializer using the pickle or dill module. With pickle protocol 5 the
+    out-of-band buffers of the message (e.g. numpy arrays) are sent as
+    separate frames.
 
-    def __init__(self, module):
+    If a codec is set, out-of-band buffers of at least threshold bytes are
+    compressed and a codec frame is appended after the pickle frame. It starts
+    with `CODEC_MAGIC` followed by a (codec id, shuffle itemsize) pair of
+    bytes for each buffer.
+
+    Args:
+        module: the module used for serialization (pickle or dill).
+        codec (str): the name of the codec in `Codecs` to compress buffers
+            with, or None to disable compression.
+        threshold (int): the minimum size in bytes of buffers to compress.
+        shuffle (bool): byte shuffle numeric buffers before compressing them.
+        level (int): the compression level passed to the codec.
+    """
+
+    CODEC_MAGIC = b"AMIC"
+
+    def __init__(self, module, codec=None, threshold=1024 * 1024, shuffle=False, level=None):
         self.module = module
+        self.codec = None
+        self.threshold = threshold
+        self.shuffle = shuffle
 
         if module == pickle and pickle.HIGHEST_PROTOCOL >= 5:
+            if codec is not None:
+                if codec not in Codecs:
+                    raise NotImplementedError("%s codec is not avaliable!" % codec)
+                self.codec = Codecs[codec](level)
 
             def dumps(msg):
                 buffers = []
                 m = pickle.dumps(msg, protocol=5, buffer_callback=buffers.append)
-                buffers.append(m)
+                if self.codec is not None:
+                    buffers, codecs = self.compress(buffers)
+                    buffers.append(m)
+                    buffers.append(codecs)
+                else:
+                    buffers.append(m)
                 return buffers
 
         else:
+            if codec is not None:
+                raise NotImplementedError("compression requires pickle protocol 5!")
 
             def dumps(msg):
                 return [self.module.dumps(msg)]
 
         self.dumps = dumps
 
+    def compress(self, buffers):
+        frames = []
+        codecs = bytearray(self.CODEC_MAGIC)
+        for buf in buffers:
+            raw = buf.raw()
+            ident = Codec.ident
+            itemsize = 0
+            if raw.nbytes >= self.threshold:
+                if self.shuffle:
+                    itemsize = memoryview(buf).itemsize
+                    if itemsize <= 1 or itemsize > 255 or raw.nbytes % itemsize:
+                        itemsize = 0
+                data = self.codec.encode(byte_shuffle(raw, itemsize) if itemsize else raw)
+                # keep the original buffer if it does not compress
+                if len(data) < raw.nbytes:
+                    buf = data
+                    ident = self.codec.ident
+                else:
+                    itemsize = 0
+            frames.append(buf)
+            codecs.extend((ident, itemsize))
+        return frames, bytes(codecs)
+
     def __call__(self, msg):
         return self.dumps(msg)
 
@@ -241,10 +319,13 @@ class ModuleDeserializer:
 
     def __init__(self, module):
         self.module = module
+        self.codecs = {}
 
         if module == pickle and pickle.HIGHEST_PROTOCOL >= 5:
 
             def loads(data):
+                if len(data) > 1 and bytes(memoryview(data[-1])[:4]) == ModuleSerializer.CODEC_MAGIC:
+                    return pickle.loads(data[-2], buffers=self.decompress(data[:-2], data[-1]))
                 return pickle.loads(data[-1], buffers=data[:-1])
 
         else:
@@ -260,49 +341,388 @@ class ModuleDeserializer:
 
         self.loads = loads
 
+    def codec(self, ident):
+        if ident not in self.codecs:
+            for cls in Codecs.values():
+                if cls.ident == ident:
+                    self.codecs[ident] = cls()
+                    break
+            else:
+                raise ValueError("Unknown codec id %d in serialized message" % ident)
+        return self.codecs[ident]
+
+    def decompress(self, buffers, codecs):
+        codecs = memoryview(codecs)[len(ModuleSerializer.CODEC_MAGIC) :]
+        decoded = []
+        for idx, buf in enumerate(buffers):
+            ident, itemsize = codecs[2 * idx], codecs[2 * idx + 1]
+            if ident != Codec.ident:
+                buf = self.codec(ident).decode(buf)
+                if itemsize:
+                    buf = byte_unshuffle(buf, itemsize)
+            decoded.append(buf)
+        return decoded
+
     def __call__(self, data):
         return self.loads(data)
 
 
+class ShmemSerializer(ModuleSerializer):
+    """
+    Pickle-5 serializer for same host transfers which places large
+    out-of-band buffers in a shared memory ring buffer, so only a small
+    descriptor of each buffer is sent over zeromq.
+
+    The first frame of a serialized message is a pickled list with an entry
+    for each out-of-band buffer: None if the buffer is sent inline as a frame
+    of the message, otherwise a (name, start, end, offset, nbytes) descriptor
+    of its location in the ring buffer. Buffers are sent inline if they are
+    smaller than the threshold or if the ring buffer is full.
+
+    The first bytes of the ring buffer hold a counter of how far into the ring
+    the receiving `ShmemDeserializer` has released buffers.
+
+    Args:
+        size (int): the size of the ring buffer in bytes.
+        threshold (int): the minimum size in bytes of buffers to place in the
+            ring buffer.
+    """
+
+    HEADER = 64
+
+    def __init__(self, size=256 * 1024 * 1024, threshold=64 * 1024):
+        super().__init__(pickle)
+        self.size = size
+        self.threshold = threshold
+        self.shm = None
+        self.released = None
+        self.head = 0
+
+    def close(self):
+        """
+        Closes and removes the shared memory ring buffer.
+        """
+        if self.shm is not None:
+            self.released.release()
+            self.shm.close()
+            self.shm.unlink()
+            self.shm = None
+            self.released = None
+
+    def allocate(self, nbytes):
+        """
+        Allocates space in the ring buffer. Allocations never wrap around the
+        end of the ring buffer so the remaining space is skipped instead.
+
+        Args:
+            nbytes (int): the number of bytes to allocate.
+
+        Returns:
+            A (start, end, offset) tuple of the position of the allocation in
+            the stream of allocations and its offset into the shared memory,
+            or None if there is not enough free space.
+        """
+        if self.shm is None:
+            self.shm = shared_memory.SharedMemory(create=True, size=self.HEADER + self.size)
+            self.released = self.shm.buf[:8].cast("Q")
+            self.released[0] = 0
+
+        start = self.head
+        offset = start % self.size
+        if offset + nbytes > self.size:
+            start += self.size - offset
+            offset = 0
+        end = start + nbytes
+
+        if end - self.released[0] > self.size:
+            return None
+
+        self.head = end
+        return start, end, self.HEADER + offset
+
+    def __call__(self, msg):
+        buffers = []
+        data = pickle.dumps(msg, protocol=5, buffer_callback=buffers.append)
+
+        descriptors = []
+        frames = [None]
+        for buf in buffers:
+            raw = buf.raw()
+            region = None
+            if self.threshold <= raw.nbytes <= self.size:
+                region = self.allocate(raw.nbytes)
+
+            if region is None:
+                descriptors.append(None)
+                frames.append(buf)
+            else:
+                start, end, offset = region
+                self.shm.buf[offset : offset + raw.nbytes] = raw
+                descriptors.append((self.shm.name, start, end, offset, raw.nbytes))
+
+        frames[0] = pickle.dumps(descriptors)
+        frames.append(data)
+        return frames
+
+
+class ShmemDeserializer:
+    """
+    Deserializer for messages created by `ShmemSerializer`. Buffers in a ring
+    buffer are mapped zero-copy, so they stay in use until every object
+    referring to them is gone. Calling `reclaim` releases all the buffers that
+    are no longer in use back to the sender, in the order they were sent.
+
+    Each mapped buffer is handed to pickle wrapped in a `pickle.PickleBuffer`,
+    so every object using its memory (including the new read-only views pickle
+    creates for read-only buffers) holds an export of the mapped view, and the
+    view can only be released once all of those are gone.
+    """
+
+    def __init__(self):
+        self.rings = {}
+
+    def ring(self, name):
+        if name not in self.rings:
+            shm = shared_memory.SharedMemory(name=name)
+            # the sender created the ring buffer so it is responsible for removing it
+            resource_tracker.unregister(shm._name, "shared_memory")
+            self.rings[name] = (shm, shm.buf[:8].cast("Q"), collections.deque())
+        return self.rings[name]
+
+    def reclaim(self):
+        """
+        Releases the ring buffer space of deserialized buffers which are no
+        longer referenced.
+        """
+        for shm, released, pending in self.rings.values():
+            while pending:
+                end, view = pending[0]
+                try:
+                    view.release()
+                except BufferError:
+                    # the buffer is still exported to an object using it
+                    break
+                pending.popleft()
+                released[0] = end
+
+    def close(self):
+        """
+        Detaches from all the ring buffers.
+        """
+        for shm, released, pending in self.rings.values():
+            try:
+                for end, view in pending:
+                    view.release()
+                released.release()
+                shm.close()
+            except BufferError:
+                # buffers are still in use so leave the mapping to be cleaned up on exit
+                logger.debug("Shared memory ring buffer %s still in use on close", shm.name)
+        self.rings = {}
+
+    def __call__(self, data):
+        descriptors = pickle.loads(data[0])
+        inline = iter(data[1:-1])
+
+        buffers = []
+        for desc in descriptors:
+            if desc is None:
+                buffers.append(next(inline))
+            else:
+                name, start, end, offset, nbytes = desc
+                shm, released, pending = self.ring(name)
+                view = shm.buf[offset : offset + nbytes]
+                pending.append((end, view))
+                buffers.append(pickle.PickleBuffer(view))
+
+        return pickle.loads(data[-1], buffers=buffers)
+
+
+class TensorPickler(pickle.Pickler):
+    """
+    Pickler which replaces numeric numpy arrays with references to a list of
+    tensors that are sent separately from the pickle stream.
+    """
+
+    def __init__(self, file, tensors, buffer_callback=None):
+        super().__init__(file, protocol=pickle.HIGHEST_PROTOCOL, buffer_callback=buffer_callback)
+        self.tensors = tensors
+
+    def persistent_id(self, obj):
+        if type(obj) is np.ndarray and obj.dtype.kind in "biuf" and obj.dtype.isnative:
+            self.tensors.append(obj if obj.flags.c_contiguous else obj.copy(order="C"))
+            return len(self.tensors) - 1
+        return None
+
+
+class TensorUnpickler(pickle.Unpickler):
+
+    def __init__(self, file, tensors, buffers=None):
+        super().__init__(file, buffers=buffers)
+        self.tensors = tensors
+
+    def persistent_load(self, pid):
+        return self.tensors[pid]
+
+
 class ArrowSerializer:
+    """
+    Serializer built on Arrow IPC.
+
+    The envelope of a `Message` or `CollectorMessage` (including its
+    `Heartbeat`) is encoded as a single row record batch with a fixed schema.
+    Numeric numpy arrays in the payload are sent as tensors: their Arrow type
+    and shape go in a second record batch and their data is sent zero-copy as
+    separate frames. The rest of the payload (e.g. a `Datagram` or
+    `Transition`) is pickled with the arrays replaced by references to the
+    tensors. Objects which are not messages are pickled whole.
+
+    The frames of a serialized message are [envelope, tensors, pickle, tensor
+    data..., out-of-band pickle buffers...], where the tensors frame is empty
+    if the message has no arrays.
+    """
+
+    KINDS = {Message: 1, CollectorMessage: 2}
 
     def __init__(self):
-        self.context = build_serialization_context()
+        if pa is None:
+            raise NotImplementedError("arrow serialization requires the pyarrow package!")
+        self.envelope_schema = envelope_schema()
+        self.tensor_schema = tensor_schema()
+        self.tensor_types = {}
+
+    def tensor_type(self, dtype):
+        if dtype not in self.tensor_types:
+            self.tensor_types[dtype] = str(pa.from_numpy_dtype(dtype))
+        return self.tensor_types[dtype]
+
+    def envelope(self, msg):
+        kind = self.KINDS.get(type(msg), 0)
+        row = {"kind": kind}
+        if kind and isinstance(msg.mtype, MsgTypes) and isinstance(msg.timestamp, (int, np.integer)):
+            row.update(mtype=msg.mtype.value, identity=msg.identity, timestamp=msg.timestamp, unix_ts=msg.unix_ts)
+            if kind == self.KINDS[CollectorMessage]:
+                if isinstance(msg.heartbeat, Heartbeat):
+                    row.update(heartbeat=msg.heartbeat.identity, heartbeat_ts=msg.heartbeat.timestamp)
+                else:
+                    row.update(heartbeat=msg.heartbeat)
+                row.update(name=msg.name, version=msg.version)
+
+            try:
+                return pa.RecordBatch.from_pylist([row], schema=self.envelope_schema).serialize(), msg.payload
+            except (TypeError, ValueError, OverflowError):
+                # fields which do not fit the schema, so send the whole message in the pickle
+                pass
+
+        row = {"kind": 0}
+        return pa.RecordBatch.from_pylist([row], schema=self.envelope_schema).serialize(), msg
 
     def __call__(self, msg):
-        serialized_msg = []
-        ser = pa.serialize(msg, context=self.context)
-        comp = ser.to_components()
-        metadata = {k: comp[k] for k in ["num_tensors", "num_ndarrays", "num_buffers", "num_sparse_tensors"]}
-        serialized_msg.append(pickle.dumps(metadata))
-        views = list(map(memoryview, comp["data"]))
-        serialized_msg.extend(views)
+        envelope, obj = self.envelope(msg)
+
+        tensors = []
+        buffers = []
+        stream = io.BytesIO()
+        TensorPickler(stream, tensors, buffers.append).dump(obj)
+
+        metadata = b""
+        if tensors:
+            metadata = pa.RecordBatch.from_arrays(
+                [
+                    pa.array([self.tensor_type(t.dtype) for t in tensors], pa.string()),
+                    pa.array([t.shape for t in tensors], pa.list_(pa.int64())),
+                ],
+                schema=self.tensor_schema,
+            ).serialize()
+
+        serialized_msg = [envelope, metadata, stream.getbuffer()]
+        serialized_msg.extend(map(pa.py_buffer, tensors))
+        serialized_msg.extend(buffers)
         return serialized_msg
 
     def sizeof(self, msg):
-        assert type(msg) is list and type(msg[0]) is bytes, "Excepts serialized message!"
-        size = sys.getsizeof(msg[0])
-        for c in msg[1:]:
-            size += c.nbytes
-        return size
+        assert type(msg) is list, "Excepts serialized message!"
+        return sum(memoryview(frame).nbytes for frame in msg)
 
 
 class ArrowDeserializer:
 
+    KINDS = ArrowSerializer.KINDS
+
     def __init__(self):
-        self.context = build_serialization_context()
+        if pa is None:
+            raise NotImplementedError("arrow serialization requires the pyarrow package!")
+        self.envelope_schema = envelope_schema()
+        self.tensor_schema = tensor_schema()
+        self.tensor_dtypes = {}
+
+    def tensor_dtype(self, ttype):
+        if ttype not in self.tensor_dtypes:
+            self.tensor_dtypes[ttype] = np.dtype(pa.type_for_alias(ttype).to_pandas_dtype())
+        return self.tensor_dtypes[ttype]
 
     def __call__(self, data):
-        components = pickle.loads(data[0])
-        data = list(map(pa.py_buffer, data[1:]))
-        components["data"] = data
-        return pa.deserialize_components(components, context=self.context)
+        row = pa.ipc.read_record_batch(pa.py_buffer(data[0]), self.envelope_schema).to_pylist()[0]
+        tensors = []
+        metadata = pa.py_buffer(data[1])
+        if metadata.size:
+            metadata = pa.ipc.read_record_batch(metadata, self.tensor_schema).to_pydict()
+            for ttype, shape, buf in zip(metadata["type"], metadata["shape"], data[3:]):
+                tensors.append(np.frombuffer(buf, dtype=self.tensor_dtype(ttype)).reshape(shape))
+        ntensors = len(tensors)
+        obj = TensorUnpickler(io.BytesIO(data[2]), tensors, data[3 + ntensors :]).load()
+
+        if row["kind"] == self.KINDS[Message]:
+            return Message(MsgTypes(row["mtype"]), row["identity"], obj, row["timestamp"], row["unix_ts"])
+        elif row["kind"] == self.KINDS[CollectorMessage]:
+            heartbeat = row["heartbeat"]
+            if row["heartbeat_ts"] is not None:
+                heartbeat = Heartbeat(heartbeat, row["heartbeat_ts"])
+            return CollectorMessage(
+                MsgTypes(row["mtype"]),
+                row["identity"],
+                obj,
+                row["timestamp"],
+                row["unix_ts"],
+                heartbeat,
+                row["name"],
+                row["version"],
+            )
+        else:
+            return obj
+
+
+def envelope_schema():
+    """
+    Schema of the envelope of messages serialized by `ArrowSerializer`.
+    """
+    return pa.schema(
+        [
+            ("kind", pa.int8()),
+            ("mtype", pa.int8()),
+            ("identity", pa.int64()),
+            ("timestamp", pa.int64()),
+            ("unix_ts", pa.float64()),
+            ("heartbeat", pa.int64()),
+            ("heartbeat_ts", pa.float64()),
+            ("name", pa.string()),
+            ("version", pa.int64()),
+        ]
+    )
+
+
+def tensor_schema():
+    """
+    Schema of the tensor metadata of messages serialized by `ArrowSerializer`.
+    """
+    return pa.schema([("type", pa.string()), ("shape", pa.list_(pa.int64()))])
 
 
 SerializationProtocols = {
     "pickle": (ModuleSerializer, ModuleDeserializer, {"module": pickle}),
     "dill": (ModuleSerializer, ModuleDeserializer, {"module": dill}),
     "arrow": (ArrowSerializer, ArrowDeserializer, {}),
+    "shmem": (ShmemSerializer, ShmemDeserializer, {}),
     None: (
         (ArrowSerializer, ArrowDeserializer, {})
         if pa is not None and pickle.HIGHEST_PROTOCOL < 5
@@ -311,18 +731,18 @@ SerializationProtocols = {
 }
 
 
-def Serializer(protocol=None):
+def Serializer(protocol=None, **options):
     if protocol in SerializationProtocols:
         cls, _, kwargs = SerializationProtocols[protocol]
-        return cls(**kwargs)
+        return cls(**kwargs, **options)
     else:
         raise NotImplementedError("%s protocol is not avaliable!" % protocol)
 
 
-def Deserializer(protocol=None):
+def Deserializer(protocol=None, **options):
     if protocol in SerializationProtocols:
         _, cls, kwargs = SerializationProtocols[protocol]
-        return cls(**kwargs)
+        return cls(**kwargs, **options)
     else:
         raise NotImplementedError("%s protocol is not avaliable!" % protocol)
 
@@ -366,6 +786,7 @@ class TimeoutIterator:
       Updated using set_timeout()
     - sentinel: the object returned by iterator when timeout happens
     - reset_on_next: if set to True, timeout is reset to the value of ZERO_TIMEOUT on each iteration
+    - depth: the maximum number of elements read ahead from the actual iterator. Default=1
 
     TimeoutIterator uses a thread internally.
     The thread stops once the iterator exhausts or raises an exception during iteration.
@@ -395,8 +816,9 @@ class TimeoutIterator:
     """
 
     ZERO_TIMEOUT = 0.0
+    DAEMON = False
 
-    def __init__(self, iterator, timeout=0.0, sentinel=Timeout(), reset_on_next=False):
+    def __init__(self, iterator, timeout=0.0, sentinel=Timeout(), reset_on_next=False, depth=1):
         self._iterator = iterator
         self._timeout = timeout
         self._sentinel = sentinel
@@ -404,8 +826,8 @@ class TimeoutIterator:
 
         self._interrupt = False
         self._done = False
-        self._buffer = queue.Queue(maxsize=1)
-        self._thread = threading.Thread(target=self.__lookahead)
+        self._buffer = queue.Queue(maxsize=max(depth, 1))
+        self._thread = threading.Thread(target=self.__lookahead, daemon=self.DAEMON)
         self._thread.start()
 
     def get_sentinel(self):
@@ -464,11 +886,67 @@ class TimeoutIterator:
     def __lookahead(self):
         try:
             while True:
-                self._buffer.put(next(self._iterator))
+                data = next(self._iterator)
                 if self._interrupt:
                     raise StopIteration()
+                self._buffer.put(data)
         except BaseException as e:
-            self._buffer.put(e)
+            try:
+                # nothing may be reading an interrupted iterator anymore, so do not wait for room
+                self._buffer.put(e, block=not self._interrupt)
+            except queue.Full:
+                pass
+
+
+class PrefetchIterator(TimeoutIterator):
+    """
+    Wrapper class that reads ahead from an iterator on a background thread so
+    that reading the next message overlaps with processing the current one.
+
+    The messages are passed through a single bounded FIFO queue so their order
+    (including heartbeats and transitions) is preserved. Any exceptions raised
+    within the wrapped iterator are propagated once all the messages generated
+    before the exception have been consumed.
+
+    Args:
+        iterator (iterator): the iterator to read ahead from.
+        depth (int): the maximum number of messages to read ahead.
+    """
+
+    DAEMON = True
+
+    def __init__(self, iterator, depth):
+        super().__init__(iterator, depth=depth)
+
+    @property
+    def depth(self):
+        """
+        Returns the number of messages currently waiting in the queue.
+        """
+        return self._buffer.qsize()
+
+    def close(self, timeout=1.0):
+        """
+        Stops the read ahead thread. Any messages still in the queue are
+        discarded and the wrapped iterator is closed if it is a generator.
+
+        If the thread is blocked reading from the wrapped iterator, e.g. a live
+        source without events, it is abandoned after the timeout and exits
+        without queueing anything once the iterator yields its next message.
+
+        Args:
+            timeout (float): how long to wait in seconds for the thread to exit.
+        """
+        self.interrupt()
+        self._done = True
+        try:
+            while True:
+                self._buffer.get_nowait()
+        except queue.Empty:
+            pass
+        self._thread.join(timeout)
+        if not self._thread.is_alive() and hasattr(self._iterator, "close"):
+            self._iterator.close()
 
 
 @dataclass
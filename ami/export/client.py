@@ -38,6 +38,12 @@ class RpcProxyThreads:
         except self.errors:
             return False
 
+    def request(self, cmd, payload):
+        try:
+            return self.query(self.name, cmd, payload)
+        except self.errors:
+            return None
+
     def command(self, cmd):
         if cmd in self.command_map:
             try:
@@ -67,6 +73,10 @@ class RpcProxyThreads:
     def post(graph="s", topic="s", payload="aB"):
         pass
 
+    @rpccall("%s:query")
+    def query(graph="s", topic="s", payload="aB"):
+        pass
+
 
 class RpcProxyAsyncio:
 
@@ -105,6 +115,14 @@ class RpcProxyAsyncio:
         except self.errors:
             return False
 
+    async def request(self, cmd, payload):
+        try:
+            pvname = "%s:query" % self.basepv
+            uri = self.wrap(self.payload_nturi, pvname, graph=self.name, topic=cmd, payload=payload)
+            return await asyncio.wait_for(self.ctx.rpc(pvname, uri, request=None), timeout=self.timeout)
+        except self.errors:
+            return None
+
     async def command(self, cmd):
         if cmd in self.command_map:
             try:
@@ -290,6 +308,11 @@ class GraphCommHandler(PvaCommHandler):
     def _post_dill(self, cmd, payload):
         return self._proxy.payload(cmd, self._serialize(payload))
 
+    def _post_query(self, cmd, payload):
+        reply = self._proxy.request(cmd, self._serialize(payload))
+        if reply is not None:
+            return self._deserialize(reply)
+
     def _view(self, names):
         nodes = []
         for name, parent in names.items():
@@ -414,6 +437,11 @@ class AsyncGraphCommHandler(PvaCommHandler):
     async def _post_dill(self, cmd, payload):
         return await self._proxy.payload(cmd, self._serialize(payload))
 
+    async def _post_query(self, cmd, payload):
+        reply = await self._proxy.request(cmd, self._serialize(payload))
+        if reply is not None:
+            return self._deserialize(reply)
+
     async def _view(self, names):
         nodes = []
         for name, parent in names.items():
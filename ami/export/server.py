@@ -21,7 +21,7 @@ from p4p.server.asyncio import SharedPV
 
 import ami.comm
 from ami import LogConfig, p4pConfig
-from ami.data import TimestampConverter
+from ami.data import Deserializer, TimestampConverter
 from ami.export.nt import CAGraph, CAStore, NTBytes, NTGraph, NTObject, NTStore
 
 logger = logging.getLogger(LogConfig.get_package_name(__name__))
@@ -34,6 +34,7 @@ class EpicsExportServer(abc.ABC):
         self.export = self.ctx.socket(zmq.SUB)
         self.export.setsockopt_string(zmq.SUBSCRIBE, "")
         self.export.connect(export_addr)
+        self.deserializer = Deserializer()
 
         self.node_msg_comm = self.ctx.socket(zmq.PUSH)
         self.node_msg_comm.connect(msg_addr)
@@ -174,7 +175,7 @@ class EpicsExportServer(abc.ABC):
         while True:
             topic = await self.export.recv_string()
             graph = await self.export.recv_string()
-            exports = await self.export.recv_pyobj()
+            exports = await self.export.recv_serialized(self.deserializer, copy=False)
             timestamp = time.time()
             logger.debug("received: %s graph: %s", topic, graph)
             if topic == "data":
@@ -279,6 +280,11 @@ class PvaExportRpcHandler:
     def post(self, graph, topic, payload):
         return self._get_comm(graph)._post_dill(topic, dill.loads(payload.tobytes()))
 
+    @tsrpc(NTScalar("aB"))
+    def query(self, graph, topic, payload):
+        reply = self._get_comm(graph)._post_query(topic, dill.loads(payload.tobytes()))
+        return np.frombuffer(dill.dumps(reply), np.ubyte)
+
     @tsrpc(NTScalar("as"))
     def names(self, graph):
         return self._get_comm(graph).names
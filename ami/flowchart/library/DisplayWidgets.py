@@ -15,6 +15,7 @@ from pyqtgraph.GraphicsScene.exportDialog import ExportDialog
 from qtpy import QtCore, QtGui, QtWidgets
 
 from ami import LogConfig
+from ami.comm import ZMQ_TOPIC_DELIM, ViewBuffer, view_name, view_stream_addr
 from ami.data import Deserializer
 from ami.flowchart.library.Editors import (
     STYLE,
@@ -39,28 +40,35 @@ symbols_colors = list(it.product(symbols, colors))
 class AsyncFetcher(QtCore.QThread):
     sig = QtCore.Signal()
 
-    def __init__(self, topics, terms, addr, parent=None, ratelimit=None):
+    def __init__(self, topics, terms, addr, parent=None, ratelimit=None, lod=None):
         super(__class__, self).__init__(parent)
         self.addr = addr
+        # optional {feature: (mode, size)} of features the manager should reduce before sending them
+        self.lod = lod or {}
+        # the level of detail last requested from the GUI thread, which the fetcher thread applies
+        self.requested_lod = self.lod
+        self.view_to_feature = {}
         self.running = True
         self.ctx = zmq.Context()
         self.poller = zmq.Poller()
-        self.data = {}
+        # the streamed features by heartbeat and the last heartbeat passed to the widget
+        self.buffer = ViewBuffer()
+        self.heartbeat = None
         self.reply_queue = queue.Queue()
         self.heartbeat_timestamp = 0
         self.deserializer = Deserializer()
-        self.update_topics(topics, terms)
 
-        self.recv_interrupt = self.ctx.socket(zmq.REP)
+        # passes a new level of detail, or None to stop, to the fetcher thread which owns the view socket
+        self.recv_interrupt = self.ctx.socket(zmq.PULL)
         self.recv_interrupt.bind("inproc://fetcher_interrupt")
         self.poller.register(self.recv_interrupt, zmq.POLLIN)
-        self.send_interrupt = self.ctx.socket(zmq.REQ)
+        self.send_interrupt = self.ctx.socket(zmq.PUSH)
         self.send_interrupt.connect("inproc://fetcher_interrupt")
-        self.export = self.ctx.socket(zmq.SUB)
-        self.export.connect(addr.export)
-        self.export.setsockopt_string(zmq.SUBSCRIBE, "heartbeat")
-        self.view = self.ctx.socket(zmq.REQ)
-        self.view.connect(addr.view)
+        # the manager publishes each subscribed feature once per heartbeat on the view stream
+        self.view = self.ctx.socket(zmq.SUB)
+        self.view.connect(view_stream_addr(addr.view))
+        self.poller.register(self.view, zmq.POLLIN)
+        self.update_topics(topics, terms)
 
         if parent is not None:
             if ratelimit is None:
@@ -84,42 +92,81 @@ class AsyncFetcher(QtCore.QThread):
         self.terms = terms
         self.input_to_feature = topics  # Renamed for clarity
 
-        # Build reverse mapping: feature_name → input_name (for unpacking batch data)
+        # Build reverse mapping: feature_name → input_name (for unpacking streamed data)
         self.feature_to_input = {feature: input_name for input_name, feature in topics.items()}
 
         # Separate required vs optional features
         self.required_features = {feature for key, feature in topics.items() if not isinstance(key, modifiers.optional)}
         self.optional_features = {feature for key, feature in topics.items() if isinstance(key, modifiers.optional)}
 
-        # Pre-build request list (computed once, not per heartbeat)
-        self.feature_requests = [f"view:{self.addr.name}:{feature}" for feature in self.feature_to_input.keys()]
+        # the newly subscribed features are first sent with the current heartbeat, which may already have been shown
+        self.heartbeat = None
+
+        # Subscribe to the view stream of each feature, at a reduced level of detail if requested
+        previous = self.view_to_feature
+        self.view_to_feature = {
+            view_name(feature, *self.lod.get(feature, ())): feature for feature in self.feature_to_input
+        }
+        for view in previous.keys() - self.view_to_feature.keys():
+            self.view.setsockopt_string(zmq.UNSUBSCRIBE, f"view:{self.addr.name}:{view}{ZMQ_TOPIC_DELIM}")
+        for view in self.view_to_feature.keys() - previous.keys():
+            self.view.setsockopt_string(zmq.SUBSCRIBE, f"view:{self.addr.name}:{view}{ZMQ_TOPIC_DELIM}")
+
+    def set_lod(self, lod):
+        """
+        Changes the level of detail of the features requested from the manager.
+        The subscriptions are changed by the fetcher thread, since zmq sockets
+        must not be used from more than one thread.
+
+        Args:
+            lod (dict): {feature: (mode, size)} of the features to reduce.
+        """
+        if self.running and lod != self.requested_lod:
+            self.requested_lod = lod
+            self.send_interrupt.send_pyobj(lod)
+
+    def recv_view(self, flags=0):
+        topic = self.view.recv_string(flags=flags)
+        heartbeat = self.view.recv_pyobj()
+        data = self.view.recv_serialized(self.deserializer, copy=False)
+        # topics are of the form view:graph:view_name, views unsubscribed from may still be queued
+        return self.view_to_feature.get(topic.rstrip(ZMQ_TOPIC_DELIM).split(":", 2)[2]), heartbeat, data
 
     def run(self):
         while self.running:
-            _ = self.export.recv_string()  # topic - unused but required by protocol
-            graph = self.export.recv_string()
-            heartbeat = self.export.recv_pyobj()
+            events = dict(self.poller.poll())
 
-            if graph != self.addr.name:
-                continue
+            # Check for interrupt
+            if self.recv_interrupt in events:
+                lod = self.recv_interrupt.recv_pyobj()
+                if lod is None:
+                    break
+                self.lod = lod
+                self.update_topics(self.input_to_feature, self.terms)
 
-            if self.heartbeat_timestamp >= heartbeat.timestamp:
+            if self.view not in events:
                 continue
 
-            self.heartbeat_timestamp = heartbeat.timestamp
+            # Conflate everything queued since the last update to the latest heartbeat with all the required features
+            while True:
+                try:
+                    feature, latest, data_value = self.recv_view(flags=zmq.NOBLOCK)
+                except zmq.error.Again:
+                    break
+                if feature is not None:
+                    self.buffer.add(feature, latest, data_value)
 
-            # Build and send batch request (simplified - use pre-built list)
-            self.view.send_pyobj(self.feature_requests, flags=zmq.NOBLOCK)
+            heartbeat, data = self.buffer.latest(self.required_features, self.optional_features, after=self.heartbeat)
+            if heartbeat is None:
+                continue
 
-            # Receive batch response
-            response = self.view.recv_serialized(self.deserializer, copy=False)
-            batch_heartbeat = response["heartbeat"]
-            batch_data = response["data"]  # Keys are graph feature names
+            self.heartbeat = heartbeat
+            self.buffer.discard(heartbeat)
+            self.heartbeat_timestamp = max(self.heartbeat_timestamp, heartbeat.timestamp)
 
             # Map from graph feature names → input names for widget consumption
-            # NO STRING PARSING NEEDED!
             input_data = {}
-            for feature_name, data_value in batch_data.items():
+            for feature_name, data_value in data.items():
                 if feature_name in self.feature_to_input:
                     input_name = self.feature_to_input[feature_name]
                     input_data[input_name] = data_value
@@ -150,23 +197,16 @@ class AsyncFetcher(QtCore.QThread):
                 reply = valid_input_data
 
             if reply:
-                self.reply_queue.put((batch_heartbeat.timestamp, reply))
+                self.reply_queue.put((self.heartbeat_timestamp, reply))
                 self.sig.emit()
 
-            # Check for interrupt
-            try:
-                if self.recv_interrupt.recv_pyobj(flags=zmq.NOBLOCK):
-                    break
-            except zmq.error.Again:
-                continue
-
     def close(self):
         self.running = False
         # signal asyncfetcher thread to die then wait
-        self.send_interrupt.send_pyobj(True)
+        self.send_interrupt.send_pyobj(None)
         self.wait()
         self.poller.unregister(self.recv_interrupt)
-        self.export.close()
+        self.poller.unregister(self.view)
         self.view.close()
         self.ctx.destroy()
 
@@ -302,6 +342,9 @@ class CSVDialog(QtWidgets.QWidget):
 class PlotWidget(QtWidgets.QWidget):
     latency = pc.Gauge("ami_plot_latency_secs", "Plot Latency", ["hutch", "process"])
     memory = pc.Gauge("ami_plot_memory_mb", "Plot Memory", ["hutch", "process"])
+    # the mode the manager reduces the features of the widget with to fit its size (see `ami.comm.downsample`), only
+    # set for widgets whose x values are implicit, since the x and y of the other ones would no longer match
+    lod_mode = None
 
     def __init__(self, topics=None, terms=None, addr=None, uiTemplate=None, parent=None, **kwargs):
         super().__init__(parent)
@@ -311,8 +354,11 @@ class PlotWidget(QtWidgets.QWidget):
         self.name = kwargs.get("name", None)
 
         self.fetcher = None
+        # the level of detail follows the size of the widget unless it is given explicitly
+        self.auto_lod = "lod" not in kwargs
         if addr:
-            self.fetcher = AsyncFetcher(topics, terms, addr, parent=self)
+            lod = self.view_lod(topics) if self.auto_lod else kwargs["lod"]
+            self.fetcher = AsyncFetcher(topics, terms, addr, parent=self, lod=lod)
             self.fetcher.start()
 
         self.layout = QtWidgets.QGridLayout()
@@ -1006,6 +1052,35 @@ class PlotWidget(QtWidgets.QWidget):
         if self.fetcher:
             self.fetcher.close()
 
+    @staticmethod
+    def lod_pixels(pixels):
+        """
+        Rounds a number of pixels up to a power of two, so the level of detail only changes when the size of the
+        widget doubles or halves.
+        """
+        return 1 << (max(int(pixels), 2) - 1).bit_length()
+
+    def lod_size(self):
+        """
+        Returns the size the manager should reduce the features of the widget to, based on its size in pixels.
+        """
+        return (self.lod_pixels(self.width()),)
+
+    def view_lod(self, topics):
+        """
+        Returns the level of detail to request from the manager for the features of the widget.
+
+        Args:
+            topics (dict): {input name: feature} of the widget.
+
+        Returns:
+            A dictionary of {feature: (mode, size)}, which is empty if the widget is not reduced.
+        """
+        if self.lod_mode is None or not topics:
+            return {}
+        size = self.lod_size()
+        return {feature: (self.lod_mode, size) for feature in set(topics.values())}
+
     def itemPos(self, attr):
         if hasattr(self, attr):
             item = getattr(self, attr)
@@ -1015,6 +1090,9 @@ class PlotWidget(QtWidgets.QWidget):
     def resizeEvent(self, ev):
         super().resizeEvent(ev)
 
+        if self.fetcher is not None and self.auto_lod:
+            self.fetcher.set_lod(self.view_lod(self.fetcher.input_to_feature))
+
         if hasattr(self, "plot_view"):
             self.configure_btn.setPos(0, 0)
 
@@ -1085,6 +1163,8 @@ class ScalarWidget(QtWidgets.QLCDNumber):
 
 
 class ImageWidget(PlotWidget):
+    lod_mode = "mean"
+
     def __init__(self, topics=None, terms=None, addr=None, parent=None, **kwargs):
         uiTemplate = [
             ("Title", "text"),
@@ -1158,6 +1238,11 @@ class ImageWidget(PlotWidget):
         if self.node:
             self.histogramLUT.sigLookupTableChanged.connect(lambda args: self.node.sigStateChanged.emit(self.node))
 
+    def lod_size(self):
+        # the image may be rotated, so both axes are reduced to fit the longest side of the widget
+        pixels = self.lod_pixels(max(self.width(), self.height()))
+        return (pixels, pixels)
+
     def cursor_hover_evt(self, evt):
         pos = evt[0]
         pos = self.view.mapSceneToView(pos)
@@ -1227,6 +1312,8 @@ class ImageWidget(PlotWidget):
 
 class PixelDetWidget(ImageWidget):
     sigClicked = QtCore.Signal(object, object)
+    # the clicked pixel has to be the one of the full image
+    lod_mode = None
 
     def __init__(self, topics=None, terms=None, addr=None, parent=None, **kwargs):
         super().__init__(topics, terms, addr, parent, display=False, **kwargs)
@@ -1290,6 +1377,9 @@ class HistogramWidget(PlotWidget):
 
 
 class Histogram2DWidget(ImageWidget):
+    # the counts have to match the x and y bins
+    lod_mode = None
+
     def __init__(self, topics=None, terms=None, addr=None, parent=None, **kwargs):
         super().__init__(topics, terms, addr, parent, display=False, axis=True, **kwargs)
 
@@ -1362,9 +1452,15 @@ class ScatterWidget(PlotWidget):
 
 
 class WaveformWidget(PlotWidget):
+    # keeps the spikes of the waveforms with a min/max pair per pixel
+    lod_mode = "envelope"
+
     def __init__(self, topics=None, terms=None, addr=None, parent=None, **kwargs):
         super().__init__(topics, terms, addr, parent=parent, **kwargs)
 
+    def lod_size(self):
+        return (2 * self.lod_pixels(self.width()),)
+
     def data_updated(self, data):
         i = len(self.plot)
 
@@ -1449,6 +1545,9 @@ class LineWidget(PlotWidget):
 
 
 class TimeWidget(LineWidget):
+    # the timestamps and the values of each series have the same length and are averaged over the same blocks
+    lod_mode = "mean"
+
     def __init__(self, topics=None, terms=None, addr=None, parent=None, **kwargs):
         super().__init__(topics, terms, addr, parent=parent, **kwargs)
         self.graphics_layout.useOpenGL(False)
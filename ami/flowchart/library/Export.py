@@ -7,7 +7,7 @@ from amitypes import Array1d, Array2d
 from qtpy import QtCore, QtWidgets
 
 import ami.graph_nodes as gn
-from ami.comm import GraphCommHandler
+from ami.comm import GraphCommHandler, view_stream_addr
 from ami.data import TimestampConverter
 from ami.flowchart.library.common import CtrlNode
 
@@ -80,7 +80,7 @@ class ZMQWidget(QtWidgets.QLabel):
         topic_label = ""
 
         if addr:
-            topic_label = f"Address: {addr.view}\n"
+            topic_label = f"Address: {view_stream_addr(addr.view)}\n"
 
         if terms:
             for term, name in terms.items():
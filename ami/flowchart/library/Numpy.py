@@ -20,7 +20,12 @@ class Sum(Node):
         super().__init__(name, terminals={"In": {"io": "in", "ttype": Array}, "Out": {"io": "out", "ttype": float}})
 
     def to_operation(self, **kwargs):
-        return gn.Map(name=self.name() + "_operation", **kwargs, func=lambda a: np.sum(a, dtype=np.float64))
+        return gn.Map(
+            name=self.name() + "_operation",
+            **kwargs,
+            func=lambda a: np.sum(a, dtype=np.float64),
+            batch_func=lambda a: np.sum(a.reshape(len(a), -1), axis=1, dtype=np.float64),
+        )
 
 
 class Binning(CtrlNode):
@@ -76,13 +81,38 @@ class Binning(CtrlNode):
             counts, bins = np.histogram(arr, bins=nbins, range=range, density=density, weights=weights)
             return bins, counts
 
+        if range is not None and not density and not self.values["weighted"]:
+            edges = np.linspace(range[0], range[1], nbins + 1)
+
+            def fixed_batch_bin(arr):
+                arr = arr.reshape(len(arr), -1)
+                idx = np.searchsorted(edges, arr, side="right") - 1
+                # like np.histogram the last bin is closed on the right
+                idx[arr == edges[-1]] = nbins - 1
+                valid = (idx >= 0) & (idx < nbins)
+                rows = np.broadcast_to(np.arange(len(arr))[:, np.newaxis], idx.shape)
+                counts = np.zeros((len(arr), nbins), dtype=np.intp)
+                np.add.at(counts, (rows[valid], idx[valid]), 1)
+                return [edges] * len(arr), counts
+
+            batch_bin = fixed_batch_bin
+        else:
+            batch_bin = None
+
         def reduction(res, *rest, **kwargs):
             res[0] = rest[0]  # bins
             res[1] = res[1] + rest[1]  # counts
             return res
 
         node = [
-            gn.Map(name=self.name() + "_map", inputs=inputs, outputs=map_outputs, func=bin, **kwargs),
+            gn.Map(
+                name=self.name() + "_map",
+                inputs=inputs,
+                outputs=map_outputs,
+                func=bin,
+                batch_func=batch_bin,
+                **kwargs,
+            ),
             gn.Accumulator(
                 name=self.name() + "_accumulated",
                 inputs=map_outputs,
@@ -397,7 +427,8 @@ class Polynomial(CtrlNode):
         def poly(x):
             return np.polynomial.polynomial.polyval(x, coeffs)
 
-        return gn.Map(name=self.name() + "_operation", **kwargs, func=poly)
+        # polyval is elementwise so it works unchanged on a batch of events
+        return gn.Map(name=self.name() + "_operation", **kwargs, func=poly, batch_func=poly)
 
 
 class Average(GroupedNode):
@@ -423,12 +454,18 @@ class Average(GroupedNode):
             def func(arr):
                 return np.average(arr, axis=axis)
 
+            def batch_func(arr):
+                return np.average(arr, axis=axis + 1)
+
         else:
 
             def func(*arr):
                 return list(map(lambda a: np.average(a, axis=axis), arr))
 
-        return gn.Map(name=self.name() + "_operation", **kwargs, func=func)
+            def batch_func(*arr):
+                return list(map(lambda a: np.average(a, axis=axis + 1), arr))
+
+        return gn.Map(name=self.name() + "_operation", **kwargs, func=func, batch_func=batch_func)
 
 
 class RMS(GroupedNode):
@@ -451,12 +488,18 @@ class RMS(GroupedNode):
             def func(arr):
                 return np.sqrt(np.mean(np.square(arr)))
 
+            def batch_func(arr):
+                return np.sqrt(np.mean(np.square(arr.reshape(len(arr), -1)), axis=1))
+
         else:
 
             def func(*arr):
                 return list(map(lambda a: np.sqrt(np.mean(np.square(a))), arr))
 
-        return gn.Map(name=self.name() + "_operation", **kwargs, func=func)
+            def batch_func(*arr):
+                return list(map(lambda a: np.sqrt(np.mean(np.square(a.reshape(len(a), -1)), axis=1)), arr))
+
+        return gn.Map(name=self.name() + "_operation", **kwargs, func=func, batch_func=batch_func)
 
 
 class TimeMeanRMS0D(CtrlNode):
@@ -310,7 +310,11 @@ class Roi2D(CtrlNode):
         def func(img):
             return np.rot90(img, rotation)[slice(oy, oy + ey), slice(ox, ox + ex)], (ox, ex, oy, ey)
 
-        return gn.Map(name=self.name() + "_operation", **kwargs, func=func)
+        def batch_func(imgs):
+            rois = np.rot90(imgs, rotation, axes=(1, 2))[:, slice(oy, oy + ey), slice(ox, ox + ex)]
+            return rois, [(ox, ex, oy, ey)] * len(imgs)
+
+        return gn.Map(name=self.name() + "_operation", **kwargs, func=func, batch_func=batch_func)
 
 
 class Roi1D(CtrlNode):
@@ -371,7 +375,10 @@ class Roi1D(CtrlNode):
         def func(arr):
             return arr[slice(*size)]
 
-        return gn.Map(name=self.name() + "_operation", **kwargs, func=func)
+        def batch_func(arrs):
+            return arrs[:, slice(*size)]
+
+        return gn.Map(name=self.name() + "_operation", **kwargs, func=func, batch_func=batch_func)
 
 
 class ScatterRoi(CtrlNode):
@@ -15,6 +15,8 @@ class Transformation(abc.ABC):
             inputs (list): List of inputs
             outputs (list): List of outputs
             func (function): Function node will call
+            batch_func (function): Optional vectorized version of func which is
+                called once with its inputs stacked along a leading event axis
         """
 
         self.name = kwargs["name"]
@@ -32,6 +34,7 @@ class Transformation(abc.ABC):
             self.outputs = outputs
 
         self.func = kwargs["func"]
+        self.batch_func = kwargs.get("batch_func", None)
         self.parent = kwargs.get("parent", None)
         self.color = kwargs.get("color", "")
         self.begin_run_func = kwargs.get("begin_run", None)
@@ -64,13 +67,16 @@ class Transformation(abc.ABC):
             self.parent,
         )
 
-    def to_operation(self):
+    def to_operation(self, func=None):
         """
         Return NetworkFoX operation node.
+
+        Args:
+            func (function): Optional function the operation calls in place of the node's func, e.g. a wrapper of it
         """
         return operation(
             name=self.name, needs=self.inputs, provides=self.outputs, color=self.color, metadata={"parent": self.parent}
-        )(self.func)
+        )(func or self.func)
 
     def begin_run(self, color=""):
         if color == self.color and callable(self.begin_run_func):
@@ -98,6 +104,8 @@ class Map(Transformation):
             inputs (list): List of inputs
             outputs (list): List of outputs
             func (function): Function node will call
+            batch_func (function): Optional vectorized version of func which is
+                called once with its inputs stacked along a leading event axis
         """
         super().__init__(**kwargs)
 
@@ -160,13 +168,13 @@ class StatefulTransformation(Transformation):
             return self._worker_reduction(*args, **kwargs)
         elif self.color == "localCollector":
             return self._local_reduction(*args, **kwargs)
-        elif self.color == "globalCollector":
+        elif self.color == "globalCollector" or self.color.startswith("intermediateCollector"):
             return self._global_reduction(*args, **kwargs)
 
-    def to_operation(self):
+    def to_operation(self, func=None):
         return operation(
             name=self.name, needs=self.inputs, provides=self.outputs, color=self.color, metadata={"parent": self.parent}
-        )(self)
+        )(func or self)
 
 
 class GlobalTransformation(StatefulTransformation):
@@ -1,7 +1,12 @@
 import collections
+import hashlib
+import math
+import sys
+import time
 
 import dill
 import networkx as nx
+import numpy as np
 from networkfox import compose, modifiers
 
 import ami.graph_nodes as gn
@@ -12,6 +17,101 @@ def skip(n):
     return type(n) is str or type(n) is modifiers.optional
 
 
+def intermediate_color(level):
+    """
+    Returns the color of the nodes which execute on the collectors of an intermediate tier.
+
+    Args:
+        level (int): The level of the tier, starting at 1 for the tier after the local collectors.
+    """
+    return "intermediateCollector%d" % level
+
+
+def reduction_tiers(num_collectors, fan_in=None):
+    """
+    Returns the number of collectors in each intermediate tier of the reduction tree. Each collector of a tier reduces
+    the results of up to the fan-in of that tier consecutive collectors of the tier before it.
+
+    Args:
+        num_collectors (int): The number of collectors feeding the first intermediate tier.
+        fan_in (list): The fan-in of each intermediate tier.
+
+    Returns:
+        A list with the number of collectors in each intermediate tier.
+    """
+    tiers = []
+    for fan in fan_in or []:
+        num_collectors = math.ceil(num_collectors / fan)
+        tiers.append(num_collectors)
+    return tiers
+
+
+class SubexpressionCache:
+    """
+    Shares the results of identical stateless worker nodes between the graphs executed by a worker, so that e.g. the
+    same ROI placed on a detector by several users is computed once per event instead of once per graph.
+
+    The graphs sharing the cache wrap the functions of their fingerprinted nodes (see ``Graph.share_subexpressions``).
+    When a fingerprint is found in more than one graph the results of its calls are looked up by the fingerprint and
+    the identity of the arguments, which are the same objects for every graph executing the same event. Each graph
+    still provides the results under its own names so what it sends to the collectors is unchanged.
+    """
+
+    def __init__(self):
+        self.shared = set()
+        self.results = {}
+        self.hits = 0
+        self.misses = 0
+
+    def update(self, graphs):
+        """
+        Find the fingerprints found in more than one graph. Must be called after any of the graphs is compiled.
+
+        Args:
+            graphs (list): The graphs executed by the worker, empty ones and None are ignored.
+        """
+        counts = collections.Counter()
+        for graph in graphs:
+            if graph:
+                counts.update({fingerprint for fingerprint in graph.fingerprints.values() if fingerprint is not None})
+        self.shared = {fingerprint for fingerprint, count in counts.items() if count > 1}
+
+    def wrap(self, fingerprint, func):
+        """
+        Wrap the function of a node so that its results are shared with the nodes of other graphs with the same
+        fingerprint.
+
+        Args:
+            fingerprint (str): Fingerprint of the node.
+            func (function): Function of the node.
+        """
+
+        def shared(*args, **kwargs):
+            if fingerprint not in self.shared:
+                return func(*args, **kwargs)
+
+            values = args + tuple(kwargs.values())
+            key = (fingerprint, tuple(kwargs), tuple(map(id, values)))
+            entry = self.results.get(key)
+            # the arguments are kept with the result so their ids can't be reused until the cache is cleared
+            if entry is not None and all(a is b for a, b in zip(entry[0], values)):
+                self.hits += 1
+                return entry[1]
+
+            self.misses += 1
+            result = func(*args, **kwargs)
+            self.results[key] = (values, result)
+            return result
+
+        return shared
+
+    def clear(self):
+        """
+        Drop the results cached so far. Called once all the graphs executed the current events.
+        """
+        self.results = {}
+
+
 class Graph:
     def __init__(self, name):
         """
@@ -22,6 +122,8 @@ class Graph:
         self.name = name
         self.graph = nx.DiGraph()
         self.graphkit = None
+        self.graphkit_batch = None
+        self.batch_nodes = []
         self.global_operations = set()
         self.expanded_global_operations = set()
         self.children_of_global_operations = {}
@@ -29,6 +131,64 @@ class Graph:
         self.outputs = collections.defaultdict(set)
         self.latched_names = {}
         self.latch_cache = {}
+        # nodes inserted since the last compile and the networkfox operations of the compiled nodes
+        self.dirty = set()
+        self.operations = {}
+        # indexes of the nodes by name, parent and the key used to detect duplicate global operations. Entries of
+        # removed nodes are ignored on lookup and pruned at compile time.
+        self.nodes_by_name = {}
+        self.nodes_by_parent = {}
+        self.global_outputs = {}
+        # the nodes and stateful nodes of each color used by the lifecycle hooks, refreshed at compile time
+        self.nodes_by_color = {}
+        self.stateful_by_color = {}
+        # fingerprints of the stateless worker nodes and the cache sharing their results with other graphs
+        self.fingerprints = {}
+        self.subexpressions = None
+        # the outputs in demand, which restrict the execution to their ancestors, the ancestors and the demanded
+        # outputs of each color
+        self.demanded = None
+        self.needed = None
+        self.demanded_outputs = {}
+        # the thread pool executing the independent branches of the graph, their networkfox graphs and the wall time
+        # of their last execution
+        self.executor = None
+        self.branches = []
+        self.branch_times = {}
+        # the node producing each output and the execution profile accumulated since it was last popped
+        self.producers = {}
+        self.profile = {}
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        # thread pools can't be pickled, the graph is executed serially until it is given a new one
+        state["executor"] = None
+        state["branches"] = []
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        # graphs pickled before compilation was incremental are compiled in full
+        if "dirty" not in state:
+            self.dirty = {node for node in self.graph.nodes if not skip(node)}
+        if "operations" not in state:
+            self.operations = {}
+        if "nodes_by_name" not in state:
+            self._index_nodes()
+        if "fingerprints" not in state:
+            self.fingerprints = {}
+            self.subexpressions = None
+        if "demanded" not in state:
+            self.demanded = None
+            self.needed = None
+            self.demanded_outputs = {}
+        if "executor" not in state:
+            self.executor = None
+            self.branches = []
+            self.branch_times = {}
+        if "profile" not in state:
+            self.profile = {}
+            self._index_nodes()
 
     def __bool__(self):
         return self.graph.size() != 0
@@ -48,7 +208,9 @@ class Graph:
             True if the name is valid, False otherwise.
         """
         if isinstance(name, str):
-            return not name.endswith(("_worker", "_localCollector", "_globalCollector"))
+            if name.endswith(("_worker", "_localCollector", "_globalCollector")):
+                return False
+            return not name.rstrip("0123456789").endswith("_intermediateCollector")
         else:
             return False
 
@@ -74,9 +236,10 @@ class Graph:
             The set of all the input data sources
         """
         sources = RequestedData()
+        needed = self._needed()
 
         for var in self.inputs["worker"]:
-            if self.name_is_valid(var):
+            if self.name_is_valid(var) and (needed is None or var in needed):
                 sources.add(var)
 
         return sources
@@ -113,11 +276,9 @@ class Graph:
         assert op not in self.graph.nodes(), "Operation may only be added once %s" % op.name
 
         if op.is_global_operation:
-            for n in self.graph.nodes:
-                if skip(n):
-                    continue
-                if n.is_global_operation and n.parent == op.parent and n.outputs == op.outputs:
-                    assert False, "Operation may only be added once %s" % op.name
+            other = self.global_outputs.get((op.parent, tuple(op.outputs)))
+            if other is not None and self._lookup(other.name) is other:
+                assert False, "Operation may only be added once %s" % op.name
 
         for i in op.inputs:
             self.graph.add_edge(i, op)
@@ -125,6 +286,8 @@ class Graph:
         for o in op.outputs:
             self.graph.add_edge(op, o)
 
+        self._register(op)
+        self.dirty.add(op)
         self.graphkit = None
 
     def remove(self, name):
@@ -135,14 +298,14 @@ class Graph:
             name (str): Name of node to remove from graph.
         """
 
-        for n in self.graph.nodes:
-            if skip(n):
-                continue
-            if n.name == name or n.parent == name:
-                desc = nx.dag.descendants(self.graph, n)
-                self.graph.remove_nodes_from(desc)
-                self.graph.remove_node(n)
-                break
+        n = self._lookup(name)
+        if n is None:
+            n = next((c for c in self.nodes_by_parent.get(name, {}).values() if self._lookup(c.name) is c), None)
+
+        if n is not None:
+            desc = nx.dag.descendants(self.graph, n)
+            self.graph.remove_nodes_from(desc)
+            self.graph.remove_node(n)
 
         if name in self.children_of_global_operations:
             for child in self.children_of_global_operations[name]:
@@ -209,13 +372,7 @@ class Graph:
 
                 self.children_of_global_operations[new_node.parent].difference_update(nodes_to_remove)
         else:
-            old_node = None
-            for n in self.graph.nodes:
-                if skip(n):
-                    continue
-                if n.name == new_node.name:
-                    old_node = n
-                    break
+            old_node = self._lookup(new_node.name)
 
             if old_node is not None:
                 # assert old_node is not None, "Old node not found: %s" % new_node.name
@@ -230,74 +387,229 @@ class Graph:
         self.insert(new_node)
         self.graphkit = None
 
+    def _lookup(self, name):
+        """
+        Look up an operation of the graph by name.
+
+        Args:
+            name (str): Name of the operation.
+
+        Returns:
+            The operation, or None if the graph has no operation with that name
+        """
+        node = self.nodes_by_name.get(name)
+        if node is not None and node in self.graph:
+            return node
+        return None
+
+    def _register(self, node):
+        """
+        Add an operation which was just added to the graph to the name, parent and global operation indexes.
+
+        Args:
+            node (Transformation): The operation to index.
+        """
+        self.nodes_by_name[node.name] = node
+        self.nodes_by_parent.setdefault(node.parent, {})[node.name] = node
+        if node.is_global_operation:
+            self.global_outputs[(node.parent, tuple(node.outputs))] = node
+
+    def _index_nodes(self):
+        """
+        Rebuild the indexes of the operations in the graph, dropping the entries of the removed ones, and the lists of
+        operations used by the lifecycle hooks and the latching of the global collector.
+        """
+        self.nodes_by_name = {}
+        self.nodes_by_parent = {}
+        self.global_outputs = {}
+        self.nodes_by_color = collections.defaultdict(list)
+        self.stateful_by_color = collections.defaultdict(list)
+        self.producers = {}
+
+        for node in self.graph.nodes:
+            if skip(node):
+                continue
+            self._register(node)
+            self.nodes_by_color[node.color].append(node)
+            for output in node.outputs:
+                self.producers[output] = node.name
+            if isinstance(node, gn.StatefulTransformation):
+                self.stateful_by_color[node.color].append(node)
+
+        self.latched_names = {
+            node.name: (set(node.inputs), node.outputs)
+            for node in self.expanded_global_operations
+            if node.latched and self._lookup(node.name) is node
+        }
+
+    def _lifecycle_nodes(self, color=None, stateful=False):
+        """
+        Returns the operations whose lifecycle hooks have to be executed. The lists are built at compile time, a graph
+        which was modified since is indexed again.
+
+        Args:
+            color (str): Only return the operations of this color, or all of them if None.
+            stateful (bool): Only return the StatefulTransformation operations.
+        """
+        if self.graphkit is None:
+            self._index_nodes()
+
+        index = self.stateful_by_color if stateful else self.nodes_by_color
+        if color is None:
+            return [node for nodes in index.values() for node in nodes]
+        return index.get(color, [])
+
+    def demand(self, names):
+        """
+        Restrict the execution of the graph to the nodes needed to compute the outputs in demand, e.g. the ones which
+        are viewed or exported. Outputs in demand which are not in the graph are ignored.
+
+        Args:
+            names (set): The outputs in demand, or None to execute the whole graph.
+        """
+        self.demanded = None if names is None else set(names)
+        self.needed = None
+        self.demanded_outputs = {}
+
+    def _needed(self):
+        """
+        Returns the outputs in demand and all their ancestors, or None if the whole graph is executed.
+        """
+        if self.demanded is None:
+            return None
+
+        if self.needed is None:
+            needed = set()
+            for name in self.demanded:
+                if name in self.graph:
+                    needed.add(name)
+                    needed.update(nx.algorithms.dag.ancestors(self.graph, name))
+            self.needed = needed
+
+        return self.needed
+
+    def _outputs(self, color):
+        """
+        Returns the outputs of the given color needed by the outputs in demand, or None if the whole graph is
+        executed.
+        """
+        needed = self._needed()
+        if needed is None:
+            return None
+
+        outputs = self.demanded_outputs.get(color)
+        if outputs is None:
+            outputs = [o for o in self.outputs[color] if skip(o) and o in needed]
+            self.demanded_outputs[color] = outputs
+        return outputs
+
+    def parallelize(self, executor):
+        """
+        Execute the independent branches of the graph, i.e. the parts which only have graph inputs in common, in
+        parallel on a thread pool. Takes effect the next time the graph is compiled.
+
+        Args:
+            executor (concurrent.futures.Executor): The thread pool, or None to execute the graph serially.
+        """
+        self.executor = executor
+        if executor is None:
+            self.branches = []
+
+    def share_subexpressions(self, cache):
+        """
+        Share the results of the stateless worker nodes with the other graphs using the same cache. Takes effect the
+        next time the graph is compiled.
+
+        Args:
+            cache (SubexpressionCache): The cache, or None to stop sharing results.
+        """
+        if cache is not self.subexpressions:
+            self.subexpressions = cache
+            # the operations of the compiled nodes have to be wrapped (or unwrapped) too
+            self.operations = {}
+
     def reset(self):
         """
         Resets the state of all StatefulTransmation nodes in the graph that
         have reset_on_run enabled (default True).
         """
-        nodes = list(
-            filter(
-                lambda node: isinstance(node, gn.StatefulTransformation),
-                self.graph.nodes,
-            )
-        )
-        for node in nodes:
+        for node in self._lifecycle_nodes(stateful=True):
             if getattr(node, "reset_on_run", True):
                 node.reset()
         self.latch_cache = {}
 
-    def heartbeat_finished(self):
+    def heartbeat_finished(self, color=None):
         """
         Execute post heartbeat hook on StatefulTransformation nodes in the graph.
+
+        Args:
+            color (str): Only execute the hook of the nodes of this color, or of all nodes if None.
         """
-        nodes = list(
-            filter(
-                lambda node: isinstance(node, gn.StatefulTransformation),
-                self.graph.nodes,
-            )
-        )
-        list(map(lambda node: node.heartbeat_finished(), nodes))
+        for node in self._lifecycle_nodes(color, stateful=True):
+            node.heartbeat_finished()
 
     def begin_run(self, color):
         """
         Execute pre run hook on nodes in the graph.
         """
-        nodes = list(filter(lambda node: hasattr(node, "begin_run"), self.graph.nodes))
-        list(map(lambda node: node.begin_run(color), nodes))
+        for node in self._lifecycle_nodes(color):
+            node.begin_run(color)
 
     def end_run(self, color):
         """
         Execute post run hook on nodes in the graph.
         """
-        nodes = list(filter(lambda node: hasattr(node, "end_run"), self.graph.nodes))
-        list(map(lambda node: node.end_run(color), nodes))
+        for node in self._lifecycle_nodes(color):
+            node.end_run(color)
 
     def begin_step(self, step, color):
         """
         Execute pre step hook on nodes in the graph.
         """
-        nodes = list(filter(lambda node: hasattr(node, "begin_step"), self.graph.nodes))
-        list(map(lambda node: node.begin_step(step, color), nodes))
+        for node in self._lifecycle_nodes(color):
+            node.begin_step(step, color)
 
     def end_step(self, step, color):
         """
         Execute post step hook on nodes in the graph.
         """
-        nodes = list(filter(lambda node: hasattr(node, "end_step"), self.graph.nodes))
-        list(map(lambda node: node.end_step(step, color), nodes))
+        for node in self._lifecycle_nodes(color):
+            node.end_step(step, color)
+
+    def _affected_nodes(self):
+        """
+        Find the part of the graph which has to be compiled again: the nodes inserted since the last compile and all
+        of their descendants. The rest of the graph keeps its colors, expansions and networkfox operations.
 
-    def _color_nodes(self):
+        Returns:
+            The set of affected nodes, including the names of their inputs and outputs
+        """
+        affected = {node for node in self.dirty if node in self.graph}
+        stack = list(affected)
+        while stack:
+            for successor in self.graph.successors(stack.pop()):
+                if successor not in affected:
+                    affected.add(successor)
+                    stack.append(successor)
+        return affected
+
+    def _color_nodes(self, affected):
         """
         Generate all paths from inputs to outputs, for each path look for nodes which have the ``is_global_operation``
         attribute set to True. If in a given path for which we've found a global operation node there is no
         other node with ``is_global_operation`` true which preceeds it then we mark that node for expansion.
+
+        Nodes outside of the affected part of the graph were colored by an earlier compile and are left untouched.
+
+        Args:
+            affected (set): The nodes to color (see ``_affected_nodes``).
         """
         self.global_operations = set()
 
         global_operations = list(
             filter(
                 lambda node: getattr(node, "is_global_operation", False),
-                self.graph.nodes,
+                affected,
             )
         )
         for node in global_operations:
@@ -328,7 +640,7 @@ class Graph:
                 if descendant.color == "":
                     descendant.color = "globalCollector"
 
-        for node in nx.algorithms.topological_sort(self.graph):
+        for node in nx.algorithms.topological_sort(self.graph.subgraph(affected)):
             if skip(node) or node.color:
                 continue
 
@@ -342,20 +654,33 @@ class Graph:
             else:
                 node.color = "worker"
 
-    def _expand_global_operations(self, num_workers, num_local_collectors):
+    def _expand_global_operations(self, num_workers, num_local_collectors, fan_in=None):
         """
         Expand the nodes found in color_nodes into three nodes which execute on the worker, local collector, and
         global collector respectively. The number of workers and number of local collectors must be known in order to
         properly expand PickN operations.
 
+        If there are no local collectors, i.e. the workers send their results directly to the global collector, the
+        nodes are instead expanded into two nodes which execute on the worker and global collector. If there are
+        intermediate collector tiers an extra node is inserted before the global collector for each of them.
+
         Args:
             num_workers (int): Total number of workers.
-            num_local_collectors (int): Total number of local collectors.
+            num_local_collectors (int): Total number of local collectors, or zero if there are none.
+            fan_in (list): The number of upstream collectors reduced by each collector of each intermediate tier.
         """
 
         inputs = [n for n, d in self.graph.in_degree() if d == 0]
         self.inputs["worker"].update(inputs)
 
+        # the tiers of the reduction and the number of processes in each
+        tiers = [("worker", num_workers)]
+        if num_local_collectors:
+            tiers.append(("localCollector", num_local_collectors))
+        for level, count in enumerate(reduction_tiers(num_local_collectors or num_workers, fan_in), start=1):
+            tiers.append((intermediate_color(level), count))
+        tiers.append(("globalCollector", 1))
+
         for node in self.global_operations:
             inputs = node.inputs
             outputs = node.outputs
@@ -365,12 +690,20 @@ class Graph:
             self.graph.remove_node(node)
             NewNode = getattr(gn, node.__class__.__name__)
 
-            color_order = ["worker", "localCollector", "globalCollector"]
-            worker_outputs = None
-            local_collector_outputs = None
             extras = node.on_expand()
+            upstream_outputs = None
+            upstream_count = None
+
+            for tier, (color, count) in enumerate(tiers):
+                # the first collector tier reduces the results of the workers and the later ones the partial
+                # reductions of the collectors before them
+                if tier == 0:
+                    reduction = node._worker_reduction
+                elif tier == 1:
+                    reduction = node._local_reduction
+                else:
+                    reduction = node._global_reduction
 
-            for color in color_order:
                 if color == "worker":
                     worker_outputs = list(map(lambda o: o + "_worker", node.outputs))
 
@@ -382,7 +715,7 @@ class Graph:
                         name=node.name + "_worker",
                         inputs=inputs,
                         outputs=worker_outputs,
-                        reduction=node._worker_reduction,
+                        reduction=reduction,
                         N=worker_N,
                         **extras,
                     )
@@ -394,74 +727,85 @@ class Graph:
                         self.graph.add_edge(i, worker_node)
                     for o in worker_outputs:
                         self.graph.add_edge(worker_node, o)
+                    self._register(worker_node)
 
-                elif color == "localCollector":
-                    self.inputs[color].update(worker_outputs)
-                    local_collector_outputs = list(map(lambda o: o + "_localCollector", node.outputs))
-
-                    local_collector_N = 1
-                    workers_per_local_collector = None
-                    if hasattr(node, "N"):
-                        local_collector_N = max(node.N // num_local_collectors, 1)
-                        workers_per_local_collector = max(num_workers // num_local_collectors, 1)
-
-                    local_collector_node = NewNode(
-                        name=node.name + "_localCollector",
-                        inputs=worker_outputs,
-                        outputs=local_collector_outputs,
-                        reduction=node._local_reduction,
-                        N=local_collector_N,
-                        is_expanded=True,
-                        num_contributors=workers_per_local_collector,
-                        **extras,
-                    )
-                    local_collector_node.color = color
-                    local_collector_node.is_global_operation = False
-                    self.children_of_global_operations[node.parent].add(local_collector_node)
-                    self.outputs[color].update(local_collector_outputs)
-                    for i in worker_outputs:
-                        self.graph.add_edge(i, local_collector_node)
-                    for o in local_collector_outputs:
-                        self.graph.add_edge(local_collector_node, o)
+                    upstream_outputs = worker_outputs
 
                 elif color == "globalCollector":
-                    self.inputs[color].update(local_collector_outputs)
-
                     N = getattr(node, "N", 1)
                     N = max((N // num_workers) * num_workers, 1)
 
                     global_collector_node = NewNode(
                         name=node.name + "_globalCollector",
-                        inputs=local_collector_outputs,
+                        inputs=upstream_outputs,
                         outputs=outputs,
-                        reduction=node._global_reduction,
+                        reduction=reduction,
                         N=N,
                         is_expanded=True,
-                        num_contributors=num_local_collectors,
+                        num_contributors=upstream_count,
                         **extras,
                     )
                     global_collector_node.color = color
                     self.children_of_global_operations[node.parent].add(global_collector_node)
                     self.expanded_global_operations.add(global_collector_node)
-                    for i in local_collector_outputs:
+                    for i in upstream_outputs:
                         self.graph.add_edge(i, global_collector_node)
                     for o in outputs:
                         self.graph.add_edge(global_collector_node, o)
-                    if global_collector_node.latched:
-                        self.latched_names[global_collector_node.name] = (
-                            set(global_collector_node.inputs),
-                            global_collector_node.outputs,
-                        )
+                    self._register(global_collector_node)
+
+                else:
+                    # the local collector and intermediate collector tiers
+                    collector_outputs = list(map(lambda o: o + "_" + color, node.outputs))
+
+                    collector_N = 1
+                    contributors_per_collector = None
+                    if hasattr(node, "N"):
+                        collector_N = max(node.N // count, 1)
+                        contributors_per_collector = max(upstream_count // count, 1)
+
+                    collector_node = NewNode(
+                        name=node.name + "_" + color,
+                        inputs=upstream_outputs,
+                        outputs=collector_outputs,
+                        reduction=reduction,
+                        N=collector_N,
+                        is_expanded=True,
+                        num_contributors=contributors_per_collector,
+                        **extras,
+                    )
+                    collector_node.color = color
+                    collector_node.is_global_operation = False
+                    self.children_of_global_operations[node.parent].add(collector_node)
+                    self.outputs[color].update(collector_outputs)
+                    for i in upstream_outputs:
+                        self.graph.add_edge(i, collector_node)
+                    for o in collector_outputs:
+                        self.graph.add_edge(collector_node, o)
+                    self._register(collector_node)
+
+                    upstream_outputs = collector_outputs
+
+                upstream_count = count
+
+        # the collector tiers subscribe to the inputs of all their expanded nodes, including those expanded by earlier
+        # compiles, so the inputs of every color are recomputed rather than only those of the new global operations
+        for node in self.graph.nodes:
+            if not skip(node) and getattr(node, "is_expanded", False):
+                self.inputs[node.color].update(node.inputs)
 
-    def _collect_global_inputs(self):
+    def _collect_global_inputs(self, affected):
         """
         Insert Pick1 for nodes which run global collector but depend on inputs which are only available on worker.
+
+        Args:
+            affected (set): The nodes being compiled, the inputs of the others were already collected.
         """
         inputs = [n for n, d in self.graph.in_degree() if d == 0]
 
         global_collector_nodes = list(
             filter(
-                lambda node: getattr(node, "color", "") == "globalCollector",
+                lambda node: node in affected and getattr(node, "color", "") == "globalCollector",
                 self.graph.nodes,
             )
         )
@@ -490,7 +834,150 @@ class Graph:
                 node.inputs = new_inputs
             self.add(node)
 
-    def compile(self, num_workers=1, num_local_collectors=1):
+    def _fingerprint_nodes(self, affected):
+        """
+        Fingerprint the stateless worker nodes by their class, their function (code, closure and parameters), and the
+        fingerprints of the nodes providing their inputs. Nodes of different graphs with the same fingerprint compute
+        the same values from the same event.
+
+        Args:
+            affected (set): The nodes being compiled, the others keep their fingerprints.
+        """
+        fingerprints = {}
+
+        for node in nx.algorithms.topological_sort(self.graph):
+            if skip(node) or node.color != "worker" or isinstance(node, gn.StatefulTransformation):
+                continue
+            if node not in affected and node in self.fingerprints:
+                fingerprints[node] = self.fingerprints[node]
+                continue
+
+            fingerprints[node] = None
+            inputs = []
+            for i in node.inputs:
+                producers = [p for p in self.graph.predecessors(i) if not skip(p)]
+                if not producers:
+                    inputs.append(("source", str(i), type(i).__name__))
+                elif fingerprints.get(producers[0]) is not None:
+                    inputs.append((fingerprints[producers[0]], producers[0].outputs.index(i)))
+                else:
+                    break
+            else:
+                try:
+                    data = dill.dumps((node.__class__.__name__, node.func, len(node.outputs), inputs))
+                except Exception:
+                    continue
+                fingerprints[node] = hashlib.sha1(data).hexdigest()
+
+        self.fingerprints = fingerprints
+
+    def _to_operation(self, node):
+        """
+        Convert a node to a networkfox operation, wrapping its function if its results are shared with other graphs.
+
+        Args:
+            node (Transformation): The node to convert.
+        """
+        fingerprint = self.fingerprints.get(node)
+        if self.subexpressions is None or fingerprint is None:
+            return node.to_operation()
+        return node.to_operation(self.subexpressions.wrap(fingerprint, node.func))
+
+    def _compose_branches(self, operations):
+        """
+        Split the graph into independent branches, which are the connected parts of the graph once its inputs are
+        left out, and compose a networkfox graph for each of them.
+
+        Args:
+            operations (dict): The networkfox operation of each node.
+
+        Returns:
+            A list of (name, networkfox graph, outputs, colors) tuples for each branch, empty if there is only one.
+        """
+        inputs = {n for n, d in self.graph.in_degree() if d == 0}
+        body = self.graph.subgraph(n for n in self.graph.nodes if n not in inputs)
+        components = [
+            [n for n in component if not skip(n)]
+            for component in nx.algorithms.components.weakly_connected_components(body)
+        ]
+        components = [nodes for nodes in components if nodes]
+        if len(components) < 2:
+            return []
+
+        branches = []
+        for index, nodes in enumerate(components):
+            name = "%s_branch%d" % (self.name, index)
+            graphkit = compose(name=name)(*(operations[node] for node in nodes))
+            outputs = {o for node in nodes for o in node.outputs}
+            branches.append((name, graphkit, outputs, {node.color for node in nodes}))
+        return branches
+
+    def _run_branch(self, inputs, name, graphkit, kwargs):
+        start = time.perf_counter()
+        try:
+            return graphkit(dict(inputs), **kwargs)
+        finally:
+            self.branch_times[name] = time.perf_counter() - start
+
+    def _run_branches(self, inputs, kwargs):
+        """
+        Execute the branches of the graph with nodes of the requested color in parallel and merge their results.
+
+        Args:
+            inputs (dict): The arguments required to execute the graph nodes.
+            kwargs (dict): The keyword arguments passed to the networkfox graph of each branch.
+        """
+        color = kwargs["color"]
+        outputs = kwargs.get("outputs")
+        tasks = []
+
+        for name, graphkit, provides, colors in self.branches:
+            if color not in colors:
+                continue
+            branch_kwargs = kwargs
+            if outputs is not None:
+                branch_outputs = [o for o in outputs if o in provides]
+                if not branch_outputs:
+                    continue
+                branch_kwargs = dict(kwargs, outputs=branch_outputs)
+            tasks.append((name, graphkit, branch_kwargs))
+
+        if len(tasks) == 1:
+            results = [self._run_branch(inputs, *tasks[0])]
+        else:
+            futures = [self.executor.submit(self._run_branch, inputs, *task) for task in tasks]
+            results = [future.result() for future in futures]
+
+        result = dict(inputs)
+        for branch_result in results:
+            result.update(branch_result)
+        return result
+
+    def _find_batch_nodes(self):
+        """
+        Find the worker nodes which can be executed over a whole batch of events at once. These are the nodes that
+        provide a batched implementation and whose inputs are either graph inputs or the outputs of other batched
+        nodes.
+
+        Returns:
+            List of batchable nodes in topological order
+        """
+        available = {n for n, d in self.graph.in_degree() if d == 0}
+        nodes = []
+
+        for node in nx.algorithms.topological_sort(self.graph):
+            if skip(node) or node.color != "worker" or getattr(node, "batch_func", None) is None:
+                continue
+            # optional inputs are passed by networkfox as keyword arguments so leave those nodes alone
+            if any(type(i) is not str for i in node.inputs):
+                continue
+            if available.issuperset(node.inputs):
+                nodes.append(node)
+                available.update(node.outputs)
+
+        return nodes
+
+    def compile(self, num_workers=1, num_local_collectors=1, fan_in=None):
         """
         Convert an AMI graph to a networkfox graph. This function must be called after any function which modifies the
         graph, ie add, insert, remove, or replace.
@@ -498,26 +985,53 @@ class Graph:
         This is done by coloring nodes, expanding global operations, and replacing filter nodes with the appropriate
         networkfox equivalents.
 
+        Compilation is incremental: only the nodes inserted since the last compile and their descendants are colored
+        and expanded, and the networkfox operations of the other nodes are reused when composing the graph.
+
         Args:
             num_workers (int): Total number of workers.
-            num_local_collectors (int): Total number of local collectors.
+            num_local_collectors (int): Total number of local collectors, or zero if the workers send their results
+                directly to the global collector.
+            fan_in (list): Optional number of upstream collectors reduced by each collector of each intermediate
+                collector tier between the local collectors and the global collector.
         """
         self.inputs = collections.defaultdict(set)
-        self._color_nodes()
-        self._collect_global_inputs()
-        self._expand_global_operations(num_workers, num_local_collectors)
+        affected = self._affected_nodes()
+        self._color_nodes(affected)
+        self._collect_global_inputs(affected)
+        self._expand_global_operations(num_workers, num_local_collectors, fan_in)
+        if self.subexpressions is not None:
+            self._fingerprint_nodes(affected)
 
-        seen = set()
         outputs = [n for n, d in self.graph.out_degree() if d == 0]
-        body = []
+        operations = {}
 
         for node in self.graph.nodes:
-            if node in seen or skip(node):
+            if skip(node):
                 continue
-            body.append(node.to_operation())
+            if node in affected or node not in self.operations:
+                operations[node] = self._to_operation(node)
+            else:
+                operations[node] = self.operations[node]
 
         self.outputs["globalCollector"].update(outputs)
-        self.graphkit = compose(name=self.name)(*body)
+        self.graphkit = compose(name=self.name)(*operations.values())
+        self.operations = operations
+        self.branches = self._compose_branches(operations) if self.executor is not None else []
+        self.branch_times = {}
+        self.dirty = set()
+        self._index_nodes()
+        self.needed = None
+        self.demanded_outputs = {}
+
+        self.batch_nodes = self._find_batch_nodes()
+        self.graphkit_batch = None
+        if self.batch_nodes:
+            batch_body = [
+                self._to_operation(node) for node in self.graph.nodes if not skip(node) and node not in self.batch_nodes
+            ]
+            if batch_body:
+                self.graphkit_batch = compose(name=self.name + "_batch")(*batch_body)
 
     def nxplot(self, filename=None):
         A = nx.nx_agraph.to_agraph(self.graph)
@@ -558,6 +1072,12 @@ class Graph:
         assert self.graphkit is not None, "call compile first"
         color = kwargs.get("color", None)
         assert color is not None
+        outputs = self._outputs(color)
+        if outputs is not None:
+            if not outputs:
+                # nothing downstream is in demand
+                return {}
+            kwargs["outputs"] = outputs
         if color == "globalCollector":
             for node, names in self.latched_names.items():
                 inputs, outputs = names
@@ -568,7 +1088,10 @@ class Graph:
                     if output in self.latch_cache:
                         # print("LATCHING:", output)
                         args[0][output] = self.latch_cache[output]
-        result = self.graphkit(*args, **kwargs)
+        if self.branches:
+            result = self._run_branches(args[0], kwargs)
+        else:
+            result = self.graphkit(*args, **kwargs)
         if color == "globalCollector":
             for node, names in self.latched_names.items():
                 inputs, outputs = names
@@ -578,16 +1101,126 @@ class Graph:
                         self.latch_cache[output] = result[output]
         return {k: result[k] for k in self.outputs[color] if k in result}
 
+    def batch(self, events, color):
+        """
+        Executes the graph over a batch of events. Nodes with a batched implementation are called once with their
+        inputs stacked along a leading event axis and the rest of the graph is then executed event by event. If the
+        inputs of a batched node can not be stacked (e.g. ragged arrays) the whole batch falls back to executing the
+        full graph event by event.
+
+        Args:
+            events (list): List of dictionaries of arguments required to execute graph nodes, one per event.
+            color (str): Color of the nodes to execute.
+
+        Returns:
+            A list with the result dictionary of each event.
+        """
+        assert self.graphkit is not None, "call compile first"
+
+        if not self.batch_nodes or color != "worker":
+            return [self(event, color=color) for event in events]
+
+        values = [{k: v for k, v in event.items() if v is not None} for event in events]
+        needed = self._needed()
+        outputs = self._outputs(color)
+        if outputs is not None:
+            # the rest of the graph only has to provide the outputs in demand which are not computed in batches
+            batched = {o for node in self.batch_nodes for o in node.outputs}
+            outputs = [o for o in outputs if o not in batched]
+
+        for node in self.batch_nodes:
+            if needed is not None and not needed.intersection(node.outputs):
+                continue
+
+            present = [idx for idx, value in enumerate(values) if all(i in value for i in node.inputs)]
+            if not present:
+                continue
+
+            try:
+                args = [np.stack([values[idx][i] for idx in present]) for i in node.inputs]
+            except ValueError:
+                return [self(event, color=color) for event in events]
+
+            result = node.batch_func(*args)
+            if len(node.outputs) == 1:
+                result = (result,)
+
+            for output, batch in zip(node.outputs, result):
+                for idx, value in zip(present, batch):
+                    values[idx][output] = value
+
+        results = []
+        for value in values:
+            if self.graphkit_batch is not None and outputs is None:
+                value.update(self.graphkit_batch(value, color=color))
+            elif self.graphkit_batch is not None and outputs:
+                value.update(self.graphkit_batch(value, outputs=outputs, color=color))
+            results.append({k: value[k] for k in self.outputs[color] if k in value})
+
+        return results
+
     def times(self):
         """
-        Return time per execution of graphkit node.
+        Return time per execution of graphkit node. When the branches of the graph are executed in parallel the wall
+        time of the last execution of each branch is included under the name of the branch.
         """
         assert self.graphkit is not None, "call compile first"
-        return self.graphkit.times()
+        if self.branches:
+            times = {}
+            for name, graphkit, outputs, colors in self.branches:
+                times.update(graphkit.times())
+            times.update(self.branch_times)
+        else:
+            times = dict(self.graphkit.times())
+        if self.graphkit_batch is not None:
+            times.update(self.graphkit_batch.times())
+        return times
+
+    def record(self, results=None, calls=1):
+        """
+        Accumulate the times of the last execution of the graph and the sizes of the outputs it returned into the
+        profile of its nodes.
+
+        Args:
+            results (dict): The outputs returned by the execution, which are attributed to the nodes producing them.
+            calls (int): The number of executions to count, e.g. the number of events of a batch. The times and the
+                output sizes of the last execution are counted for each of them.
+        """
+        for name, seconds in self.times().items():
+            entry = self.profile.setdefault(name, [0.0, 0, 0])
+            entry[0] += seconds * calls
+            entry[1] += calls
+
+        for output, value in (results or {}).items():
+            name = self.producers.get(output)
+            if name is None:
+                continue
+            entry = self.profile.setdefault(name, [0.0, 0, 0])
+            entry[2] += (value.nbytes if isinstance(value, np.ndarray) else sys.getsizeof(value)) * calls
+
+    def pop_profile(self):
+        """
+        Return the profile accumulated by `record` since the last call and start a new one.
+
+        Returns:
+            A dictionary mapping the name of each node to its total execution time in seconds, number of executions
+            and total size in bytes of the outputs it returned.
+        """
+        profile = {name: tuple(entry) for name, entry in self.profile.items()}
+        self.profile = {}
+        return profile
 
     def warnings(self):
         assert self.graphkit is not None, "call compile first"
-        return self.graphkit.warnings()
+        if self.branches:
+            warnings = {}
+            for name, graphkit, outputs, colors in self.branches:
+                warnings.update(graphkit.warnings())
+        else:
+            warnings = dict(self.graphkit.warnings())
+        if self.graphkit_batch is not None:
+            warnings.update(self.graphkit_batch.warnings())
+        return warnings
 
     def metadata(self):
         """
@@ -2,7 +2,6 @@ import argparse
 import contextlib
 import functools
 import logging
-import multiprocessing.sharedctypes
 import os
 import re
 import shutil
@@ -16,12 +15,13 @@ import ami.multiproc as mp
 from ami import Defaults, LogConfig
 from ami.client import check_dir, run_client
 from ami.collector import run_global_collector, run_node_collector
-from ami.comm import GraphCommHandler, PlatformAction, Ports
+from ami.comm import GraphCommHandler, PlatformAction, Ports, SelectTable, shard_addr
 from ami.console import run_console
+from ami.data import Codecs
 from ami.fc_to_worker import generate_worker_json
 from ami.manager import run_manager
 from ami.multiproc import check_mp_start_method
-from ami.worker import run_worker
+from ami.worker import compression_options, run_worker
 
 try:
     from ami.export import run_export
@@ -142,6 +142,88 @@ def build_parser():
 
     parser.add_argument("--cprofile", help="profile with cprofile", action="store_true")
 
+    parser.add_argument(
+        "--collapse",
+        action="store_true",
+        help="have the workers send directly to the global collector instead of through a node collector",
+    )
+
+    parser.add_argument(
+        "--prune",
+        action="store_true",
+        help="only execute the nodes needed by the features which are viewed, exported or subscribed to",
+    )
+
+    parser.add_argument(
+        "--global-collectors",
+        type=int,
+        default=1,
+        help="number of global collector processes the graphs are sharded across (default: 1)",
+    )
+
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=1,
+        help="number of datagrams workers execute as a single batch within a heartbeat (default: 1)",
+    )
+
+    parser.add_argument(
+        "--prefetch",
+        type=int,
+        default=0,
+        help="number of messages workers read ahead from the data source on a background thread (default: 0)",
+    )
+
+    parser.add_argument(
+        "--share-subexpressions",
+        action="store_true",
+        help="workers compute the stateless nodes found in more than one graph once per event and share the results",
+    )
+
+    parser.add_argument(
+        "--branch-threads",
+        type=int,
+        default=0,
+        help="number of threads workers use to execute the independent branches of each graph in parallel "
+        "(default: 0)",
+    )
+
+    parser.add_argument(
+        "--select-slots",
+        type=int,
+        default=1024,
+        help="number of slots in the table used to select which worker sends each Pick1 (default: 1024)",
+    )
+
+    parser.add_argument(
+        "--shmem-size",
+        type=int,
+        default=0,
+        help="size in MB of the shared memory buffer workers use to send large arrays to the node collector "
+        "(default: 0)",
+    )
+
+    parser.add_argument(
+        "--compression",
+        choices=sorted(Codecs),
+        default=None,
+        help="codec used to compress large arrays sent between processes (default: None)",
+    )
+
+    parser.add_argument(
+        "--compression-threshold",
+        type=int,
+        default=1024,
+        help="minimum size in kB of arrays to compress (default: 1024)",
+    )
+
+    parser.add_argument(
+        "--shuffle",
+        action="store_true",
+        help="byte shuffle numeric arrays before compressing them",
+    )
+
     parser.add_argument(
         "--source-type",
         type=str,
@@ -310,22 +392,28 @@ def run_ami(args, queue=None):
         logger.info("Starting ami-local using comm address: %s", comm_addr)
 
         if args.num_workers > 1:
-            select_manager = mp.Manager()
-            select_dict = select_manager.dict()
-            select_lock = select_manager.Lock()
-            select_hb = multiprocessing.sharedctypes.RawArray("Q", 128)
-            select_idx = multiprocessing.sharedctypes.RawValue("I", 0)
+            select_table = SelectTable(args.select_slots)
         else:
-            select_manager = None
-            select_dict = None
-            select_lock = None
-            select_hb = None
-            select_idx = None
+            select_table = None
 
         if args.tracing_endpoint:
             os.environ["AMI_TRACING_ENDPOINT"] = args.tracing_endpoint
             os.environ["AMI_TRACING_SESSION_ID"] = str(uuid.uuid4())
 
+        # the graphs are sharded across the global collectors by name
+        globalcol_addrs = [shard_addr(globalcol_addr, shard) for shard in range(args.global_collectors)]
+
+        # in the collapsed topology the workers send directly to the global collectors, which can only use the
+        # shared memory transport if there is a single one to release the workers' buffers
+        if args.collapse:
+            worker_addr = globalcol_addrs
+            shmem_size = args.shmem_size if args.global_collectors == 1 else 0
+            if args.shmem_size and not shmem_size:
+                logger.warning("Shared memory transport is disabled when collapsing to several global collectors")
+        else:
+            worker_addr = collector_addr
+            shmem_size = args.shmem_size
+
         for i in range(args.num_workers):
             proc = mp.Process(
                 name="worker%03d-n0" % i,
@@ -335,7 +423,7 @@ def run_ami(args, queue=None):
                     args.num_workers,
                     args.heartbeat,
                     src_cfg,
-                    collector_addr,
+                    worker_addr,
                     graph_addr,
                     msg_addr,
                     export_addr,
@@ -346,58 +434,71 @@ def run_ami(args, queue=None):
                     args.hwm,
                     args.timeout,
                     args.cprofile,
-                    (select_lock, select_dict, select_idx, select_hb, select_manager),
+                    select_table,
+                    args.batch_size,
+                    args.prefetch,
+                    shmem_size,
+                    compression_options(args),
+                    args.share_subexpressions,
+                    args.branch_threads,
                 ),
             )
             proc.daemon = True
             proc.start()
             procs.append(proc)
 
-        collector_proc = mp.Process(
-            name="nodecol-n0",
-            target=functools.partial(_sys_exit, run_node_collector),
-            args=(
-                0,
-                args.num_workers,
-                args.eb_depth,
-                collector_addr,
-                globalcol_addr,
-                graph_addr,
-                msg_addr,
-                args.prometheus_dir,
-                args.prometheus_port,
-                args.hutch,
-                args.hwm,
-                args.timeout,
-                args.cprofile,
-            ),
-        )
-        collector_proc.daemon = True
-        collector_proc.start()
-        procs.append(collector_proc)
-
-        globalcol_proc = mp.Process(
-            name="globalcol",
-            target=functools.partial(_sys_exit, run_global_collector),
-            args=(
-                0,
-                1,
-                args.eb_depth,
-                globalcol_addr,
-                results_addr,
-                graph_addr,
-                msg_addr,
-                args.prometheus_dir,
-                args.prometheus_port,
-                args.hutch,
-                args.hwm,
-                args.timeout,
-                args.cprofile,
-            ),
-        )
-        globalcol_proc.daemon = True
-        globalcol_proc.start()
-        procs.append(globalcol_proc)
+        if not args.collapse:
+            collector_proc = mp.Process(
+                name="nodecol-n0",
+                target=functools.partial(_sys_exit, run_node_collector),
+                args=(
+                    0,
+                    args.num_workers,
+                    args.eb_depth,
+                    collector_addr,
+                    globalcol_addrs,
+                    graph_addr,
+                    msg_addr,
+                    args.prometheus_dir,
+                    args.prometheus_port,
+                    args.hutch,
+                    args.hwm,
+                    args.timeout,
+                    args.cprofile,
+                    shmem_size > 0,
+                    compression_options(args),
+                ),
+            )
+            collector_proc.daemon = True
+            collector_proc.start()
+            procs.append(collector_proc)
+
+        for shard, shard_globalcol_addr in enumerate(globalcol_addrs):
+            globalcol_proc = mp.Process(
+                name="globalcol" if args.global_collectors == 1 else "globalcol%03d" % shard,
+                target=functools.partial(_sys_exit, run_global_collector),
+                args=(
+                    shard,
+                    args.num_workers if args.collapse else 1,
+                    args.eb_depth,
+                    shard_globalcol_addr,
+                    results_addr,
+                    graph_addr,
+                    msg_addr,
+                    args.prometheus_dir,
+                    args.prometheus_port,
+                    args.hutch,
+                    args.hwm,
+                    args.timeout,
+                    args.cprofile,
+                    compression_options(args),
+                    args.collapse and shmem_size > 0,
+                    args.collapse,
+                ),
+            )
+            globalcol_proc.daemon = True
+            globalcol_proc.start()
+            procs.append(globalcol_proc)
 
         manager_proc = mp.Process(
             name="manager",
@@ -417,6 +518,9 @@ def run_ami(args, queue=None):
                 args.hutch,
                 args.hwm,
                 args.cprofile,
+                args.collapse,
+                None,
+                args.prune,
             ),
         )
         manager_proc.daemon = True
@@ -510,6 +614,8 @@ def main():
     # start the ami processes
     parser = build_parser()
     args = parser.parse_args()
+    if not 0 < args.global_collectors <= Ports.PortsPerPlatform // Ports.NumPorts:
+        parser.error("--global-collectors must be between 1 and %d" % (Ports.PortsPerPlatform // Ports.NumPorts))
     return run_ami(args)
 
 
@@ -6,10 +6,12 @@ import datetime as dt
 import json
 import logging
 import os
+import pickle
 import re
 import signal
 import socket
 import sys
+import threading
 import time
 
 import dill
@@ -17,7 +19,19 @@ import prometheus_client as pc
 import zmq
 
 from ami import LogConfig
-from ami.comm import ZMQ_TOPIC_DELIM, AutoExport, Collector, PlatformAction, Ports, Store
+from ami.comm import (
+    ZMQ_TOPIC_DELIM,
+    AutoExport,
+    Collector,
+    FeatureHistory,
+    GraphProfile,
+    PlatformAction,
+    Ports,
+    Store,
+    downsample,
+    parse_view_name,
+    view_stream_addr,
+)
 from ami.data import Deserializer, MsgTypes, Serializer, Transitions
 from ami.graphkit_wrapper import Graph
 from ami.tracing import get_trace_id, setup_tracing, start_span
@@ -25,6 +39,66 @@ from ami.tracing import get_trace_id, setup_tracing, start_span
 logger = logging.getLogger(__name__)
 
 
+class Relay:
+    """
+    Sends messages on a PUSH socket without ever blocking the sender. If the
+    peer has fallen too far behind, droppable messages are discarded and the
+    others are kept in order in a backlog, which is retried on the next send
+    or `flush`.
+
+    Args:
+        sock (zmq.Socket): the PUSH socket to send the messages on.
+        on_drop (function): optional function called each time a droppable
+            message is discarded.
+    """
+
+    def __init__(self, sock, on_drop=None):
+        self.sock = sock
+        self.on_drop = on_drop
+        self.backlog = collections.deque()
+
+    def __len__(self):
+        return len(self.backlog)
+
+    def _send(self, frames):
+        try:
+            self.sock.send_multipart(frames, flags=zmq.NOBLOCK, copy=False)
+            return True
+        except zmq.Again:
+            return False
+
+    def flush(self):
+        """
+        Retries the messages in the backlog in order.
+
+        Returns:
+            True if the backlog is empty.
+        """
+        while self.backlog:
+            if not self._send(self.backlog[0]):
+                return False
+            self.backlog.popleft()
+        return True
+
+    def send(self, frames, droppable=False):
+        """
+        Sends a message, unless there are older messages still waiting to be
+        sent in which case it is sent after them.
+
+        Args:
+            frames (list): the frames of the message.
+            droppable (bool): if True the message is discarded instead of
+                being kept in the backlog when it cannot be sent right away.
+        """
+        if self.flush() and self._send(frames):
+            return
+        if droppable:
+            if self.on_drop is not None:
+                self.on_drop()
+        else:
+            self.backlog.append(frames)
+
+
 class Manager(Collector):
     """
     An AMI graph Manager is the control point for an
@@ -34,6 +108,13 @@ class Manager(Collector):
     configuration changes to the graph.
     """
 
+    VIEW_STREAM_HWM = 100
+    CONTROL_POLL_TIMEOUT = 100
+    HISTORY_CAPACITY = 1000
+    HISTORY_MAX_BYTES = 64 * 1024 * 1024
+    DEMAND_TIMEOUT = 10
+    DEMAND_INTERVAL = 1
+
     def __init__(
         self,
         num_workers,
@@ -48,17 +129,41 @@ class Manager(Collector):
         prometheus_dir,
         hutch,
         hwm,
+        collapsed=False,
+        fan_in=None,
+        prune=False,
     ):
         """
         protocol right now only tells you how to communicate with workers
+
+        Client commands, views, info and export subscriptions are served by a
+        separate control thread (see `run_control`), so that a slow command
+        does not hold up the ingest of the collector results on the main
+        thread. The two threads share the feature stores under `store_lock`.
+
+        If collapsed is True the workers send their results directly to the
+        global collector and graphs are compiled without a local collector tier.
+
+        The optional fan_in lists the number of upstream collectors reduced by
+        each collector of the intermediate tiers between the local collectors
+        and the global collector.
+
+        If prune is True the workers and collectors only execute the nodes
+        needed by the features in demand, i.e. the ones viewed or fetched in
+        the last `DEMAND_TIMEOUT` seconds, subscribed to on the view stream,
+        exported, or whose history is retained (see `demand`).
         """
-        super().__init__(results_addr, hutch=hutch, hwm=hwm)
+        super().__init__(results_addr, hutch=hutch, hwm=hwm, timeout=self.CONTROL_POLL_TIMEOUT)
         self.name = "manager"
         self.num_workers = num_workers
         self.num_nodes = num_nodes
+        self.collapsed = collapsed
+        self.fan_in = fan_in
+        self.prune = prune
         self.heartbeats = {}
         self.partition = {}
         self.feature_stores = {}
+        self.histories = collections.defaultdict(dict)  # { graph_name : { feature name : FeatureHistory } }
         self.feature_req = re.compile(r"(?P<type>fetch):(?P<name>.*)")
         self.view_req = re.compile(r"view:(?P<graph>[^:]+):(?P<name>.+)$")
         self.graphs = {}
@@ -69,44 +174,95 @@ class Manager(Collector):
         self.global_cmds = {"list_graphs"}
         self.no_auto_create_cmds = {"create_graph", "destroy_graph"}
         self.epics_prefix = ""
+        self.demands = {}  # { graph_name : features in demand last published to the workers and collectors }
+        self.viewed = collections.defaultdict(dict)  # { graph_name : { feature name : time of the last request } }
+        self.demand_deadline = 0
+        self.policies = {}  # { graph_name : CompletionPolicy replayed to late joining collectors }
+        self.profiles = {}  # { graph_name : GraphProfile }
+        self.profiled = collections.defaultdict(set)  # { graph_name : {node names with profile metrics} }
+
+        # guards the feature stores, heartbeats, histories and view cache shared by the ingest and control threads
+        self.store_lock = threading.RLock()
+        self.control_poller = zmq.Poller()
+        self.control_handlers = {}
+        self.control_thread = None
+        self.control_ident = None
+        self.command_duration = pc.Histogram(
+            "ami_command_duration_seconds",
+            "Manager command service time",
+            ["hutch", "command", "process"],
+            buckets=[0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0],
+        )
+        self.node_duration = pc.Histogram(
+            "ami_node_duration_seconds",
+            "Mean execution time of a graph node per event over each profile report",
+            ["hutch", "graph", "node"],
+            buckets=[0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0],
+        )
+        self.node_output_size = pc.Histogram(
+            "ami_node_output_bytes",
+            "Mean size of the outputs a graph node sends downstream per event over each profile report",
+            ["hutch", "graph", "node"],
+            buckets=[64, 256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216],
+        )
+
+        # hands the export, info and demand messages of the ingest thread to the control thread which owns those sockets
+        self.relay_in = self.ctx.socket(zmq.PULL)
+        self.relay_in.bind("inproc:///manager_relay")
+        self.register_control(self.relay_in, self.relay_request)
+        self.relay_out = self.ctx.socket(zmq.PUSH)
+        self.relay_out.connect("inproc:///manager_relay")
+        self.relay_sender = Relay(
+            self.relay_out, lambda: self.event_counter.labels(self.hutch, "Relay Dropped", self.name).inc()
+        )
 
         self.export = self.ctx.socket(zmq.XPUB)
         self.export.setsockopt(zmq.XPUB_VERBOSE, True)
         self.export.bind(export_addr)
-        self.register(self.export, self.export_request)
+        self.register_control(self.export, self.export_request)
 
         self.serializer = Serializer()
         self.deserializer = Deserializer()
         self.comm = self.ctx.socket(zmq.REP)  # receives commands from client
         self.comm.bind(comm_addr)
-        self.register(self.comm, self.client_request)
+        self.register_control(self.comm, self.client_request)
 
         self.graph_comm = self.ctx.socket(zmq.XPUB)  # pushes graph to workers/collectors
         self.graph_comm.setsockopt(zmq.XPUB_VERBOSE, True)
         self.graph_comm.bind(graph_addr)
-        self.register(self.graph_comm, self.graph_request)
+        self.register_control(self.graph_comm, self.graph_request)
 
         self.info_comm = self.ctx.socket(zmq.XPUB)  # status messages from manager to client
         self.info_comm.setsockopt(zmq.XPUB_VERBOSE, True)
         self.info_comm.bind(info_addr)
-        self.register(self.info_comm, self.info_request)
+        self.register_control(self.info_comm, self.info_request)
 
         self.node_msg_comm = self.ctx.socket(zmq.PULL)  # receives status from workers/collectors to push to info
         self.node_msg_comm.bind(msg_addr)
-        self.register(self.node_msg_comm, self.node_request)
+        self.register_control(self.node_msg_comm, self.node_request)
 
         self.view_comm_frontend = self.ctx.socket(zmq.ROUTER)  # exports plot data to clients
         self.view_comm_frontend.bind(view_addr)
-        self.register(self.view_comm_frontend, self.view_front_forward)
+        self.register_control(self.view_comm_frontend, self.view_front_forward)
 
         self.view_comm_backend = self.ctx.socket(zmq.DEALER)
         self.view_comm_backend.bind("inproc:///view_dealer")
-        self.register(self.view_comm_backend, self.view_back_forward)
+        self.register_control(self.view_comm_backend, self.view_back_forward)
 
         self.view_comm = self.ctx.socket(zmq.REP)
         self.view_comm.connect("inproc:///view_dealer")
 
-        self.register(self.view_comm, self.view_request)
+        self.register_control(self.view_comm, self.view_request)
+
+        # { graph_name : { (feature name, store version, heartbeat) : serialized frames } }
+        self.view_cache = collections.defaultdict(dict)
+        self.view_subscriptions = collections.defaultdict(set)  # { graph_name : {subscribed feature names} }
+        self.view_stream = self.ctx.socket(zmq.XPUB)  # streams the subscribed plot data to clients
+        self.view_stream.setsockopt(zmq.XPUB_VERBOSE, True)
+        # bound the updates queued for slow subscribers, which drop the rest and catch up on the latest values
+        self.view_stream.setsockopt(zmq.SNDHWM, self.VIEW_STREAM_HWM)
+        self.view_stream.bind(view_stream_addr(view_addr))
+        self.register(self.view_stream, self.view_subscribe)
 
         self.prometheus_dir = prometheus_dir
 
@@ -119,6 +275,95 @@ class Manager(Collector):
     def close(self):
         self.ctx.destroy()
 
+    def register_control(self, sock, handler):
+        """
+        Register the passed socket with the poller of the control thread. If
+        data is received on the socket then the associated handler function is
+        called from the control thread, which is then the only thread allowed
+        to use the socket.
+
+        Args:
+            sock (zmq.Socket): the zmq socket to add to the poller.
+            handler (function): the handler function to be called when the
+                socket has data available.
+        """
+        self.control_handlers[sock] = handler
+        self.control_poller.register(sock, zmq.POLLIN)
+
+    def in_control_thread(self):
+        return threading.get_ident() == self.control_ident
+
+    def run_control(self):
+        """
+        The control loop serving the client commands, views and subscriptions
+        until the manager stops running. An unhandled exception in one of the
+        handlers stops the manager with a non-zero exit code.
+        """
+        self.control_ident = threading.get_ident()
+        while self.running:
+            for sock, flag in self.control_poller.poll(timeout=self.CONTROL_POLL_TIMEOUT):
+                if flag != zmq.POLLIN or sock not in self.control_handlers:
+                    continue
+
+                try:
+                    self.control_handlers[sock]()
+                except Exception:
+                    logger.exception("Unhandled exception in the manager control thread:")
+                    self.exitcode = 1
+                    self.running = False
+                    return
+
+            if self.prune and time.time() >= self.demand_deadline:
+                self.demand_deadline = time.time() + self.DEMAND_INTERVAL
+                try:
+                    self.update_demands()
+                except Exception:
+                    logger.exception("Unhandled exception in the manager control thread:")
+                    self.exitcode = 1
+                    self.running = False
+                    return
+
+    def run(self):
+        self.control_thread = threading.Thread(target=self.run_control, name="manager-control", daemon=True)
+        self.control_thread.start()
+        try:
+            return super().run()
+        finally:
+            self.running = False
+            self.control_thread.join()
+
+    def relay(self, target, frames, droppable=False):
+        """
+        Hands a message published by the ingest thread to the control thread
+        without blocking the ingest of results. If the control thread has
+        fallen too far behind, droppable messages are discarded and the others
+        are queued until it catches up (see `Relay`).
+
+        Args:
+            target (str): either 'export' or 'info' for the socket to forward
+                the message to, 'config' to have the configuration exported, or
+                'demand' to have the demand of the graph named in the message
+                published.
+            frames (list): the frames of the message.
+            droppable (bool): if True the message may be discarded, which is
+                only safe for the periodic updates superseded by the next one.
+        """
+        self.relay_sender.send([target.encode()] + frames, droppable=droppable)
+
+    def relay_request(self):
+        target, *frames = self.relay_in.recv_multipart(copy=False)
+        target = target.bytes.decode()
+        if target == "export":
+            self.export.send_multipart(frames, copy=False)
+        elif target == "info":
+            self.info_comm.send_multipart(frames, copy=False)
+        elif target == "config":
+            self.export_config()
+        elif target == "demand":
+            name = frames[0].bytes.decode()
+            if name in self.graphs:
+                self.publish_demand(name)
+
     def process_msg(self, msg):
         if msg.mtype == MsgTypes.Datagram:
             latency = dt.datetime.now() - dt.datetime.fromtimestamp(msg.heartbeat.timestamp)
@@ -132,52 +377,57 @@ class Manager(Collector):
                 exemplar={"TraceID": trace_id} if trace_id else None,
             )
             datagram_start = time.time()
-            if msg.name not in self.feature_stores:
-                if msg.name in self.purged:
-                    logger.debug("Received data from deleted graph '%s'!", msg.name)
+            with self.store_lock:
+                if msg.name not in self.feature_stores:
+                    if msg.name in self.purged:
+                        logger.debug("Received data from deleted graph '%s'!", msg.name)
+                    else:
+                        logger.warning("Received data from unknown graph '%s'!", msg.name)
+                elif msg.version > self.versions[msg.name]:
+                    logger.debug(
+                        "Received data from version %d of the graph '%s' which is newer the actual version %d",
+                        msg.version,
+                        msg.name,
+                        self.versions[msg.name],
+                    )
+                elif msg.version < self.feature_stores[msg.name].version:
+                    logger.warning(
+                        "Received data from version %d of the graph '%s' when version %d or newer was expected!",
+                        msg.version,
+                        msg.name,
+                        self.feature_stores[msg.name].version,
+                    )
                 else:
-                    logger.warning("Received data from unknown graph '%s'!", msg.name)
-            elif msg.version > self.versions[msg.name]:
-                logger.debug(
-                    "Received data from version %d of the graph '%s' which is newer the actual version %d",
-                    msg.version,
-                    msg.name,
-                    self.versions[msg.name],
-                )
-            elif msg.version < self.feature_stores[msg.name].version:
-                logger.warning(
-                    "Received data from version %d of the graph '%s' when version %d or newer was expected!",
-                    msg.version,
-                    msg.name,
-                    self.feature_stores[msg.name].version,
-                )
-            else:
-                old_names = self.feature_stores[msg.name].names
-                self.feature_stores[msg.name].update(msg.payload)
-                if msg.version > self.feature_stores[msg.name].version:
-                    self.feature_stores[msg.name].version = msg.version
-                    self.export_store(msg.name)
-                elif old_names != self.feature_stores[msg.name].names:
-                    # if there are new entries in the store notify the export layer
-                    self.export_store(msg.name)
-                # export the collector data to epics
-                self.export_data(msg.name, msg.payload)
-                # update the latest heartbeat indicator
-                self.heartbeats[msg.name] = msg.heartbeat
-                # export the heartbeat to epics
-                self.export_heartbeat(msg.name)
-                # export data for viewing in the AMI GUI
-                # self.export_view(msg.name, keys=msg.payload.keys())
-
-                span = start_span(
-                    "manager.heartbeat",
-                    msg.heartbeat.identity,
-                    attributes={
-                        "manager.graph": msg.name,
-                    },
-                )
-                if span:
-                    span.end()
+                    old_names = self.feature_stores[msg.name].names
+                    self.feature_stores[msg.name].update(msg.payload)
+                    # the serialized views of the previous heartbeat are stale now
+                    self.view_cache.pop(msg.name, None)
+                    # record the new values of the features whose history is retained
+                    self.record_history(msg.name, msg.heartbeat, msg.payload)
+                    if msg.version > self.feature_stores[msg.name].version:
+                        self.feature_stores[msg.name].version = msg.version
+                        self.export_store(msg.name)
+                    elif old_names != self.feature_stores[msg.name].names:
+                        # if there are new entries in the store notify the export layer
+                        self.export_store(msg.name)
+                    # export the collector data to epics
+                    self.export_data(msg.name, msg.payload)
+                    # update the latest heartbeat indicator
+                    self.heartbeats[msg.name] = msg.heartbeat
+                    # export the heartbeat to epics
+                    self.export_heartbeat(msg.name)
+                    # stream the subscribed data for viewing in the AMI GUI
+                    self.export_view(msg.name)
+
+                    span = start_span(
+                        "manager.heartbeat",
+                        msg.heartbeat.identity,
+                        attributes={
+                            "manager.graph": msg.name,
+                        },
+                    )
+                    if span:
+                        span.end()
 
             self.event_counter.labels(self.hutch, "Heartbeat", self.name).inc()
             self.event_time.labels(self.hutch, "Heartbeat", self.name).set(time.time() - datagram_start)
@@ -199,7 +449,11 @@ class Manager(Collector):
 
     @property
     def compiler_args(self):
-        return {"num_workers": self.num_workers, "num_local_collectors": self.num_nodes}
+        return {
+            "num_workers": self.num_workers,
+            "num_local_collectors": 0 if self.collapsed else self.num_nodes,
+            "fan_in": self.fan_in,
+        }
 
     def exists(self, name):
         return all(name in val for val in [self.feature_stores, self.graphs, self.versions, self.heartbeats])
@@ -208,10 +462,11 @@ class Manager(Collector):
         if self.exists(name):
             raise ValueError("Graph with the name '%s' already exists" % name)
         else:
-            self.feature_stores[name] = Store()
-            self.graphs[name] = None
-            self.versions[name] = 0
-            self.heartbeats[name] = None
+            with self.store_lock:
+                self.feature_stores[name] = Store()
+                self.graphs[name] = None
+                self.versions[name] = 0
+                self.heartbeats[name] = None
             # notify export of the new graph
             self.export_create(name)
             # remove the graph name from the purged list if there
@@ -220,10 +475,17 @@ class Manager(Collector):
 
     def delete(self, name):
         if self.exists(name):
-            del self.feature_stores[name]
-            del self.graphs[name]
-            del self.versions[name]
-            del self.heartbeats[name]
+            with self.store_lock:
+                del self.feature_stores[name]
+                self.view_cache.pop(name, None)
+                self.histories.pop(name, None)
+                self.demands.pop(name, None)
+                self.viewed.pop(name, None)
+                self.policies.pop(name, None)
+                del self.graphs[name]
+                del self.versions[name]
+                del self.heartbeats[name]
+            self.delete_profile(name)
             # notify export of the removed graph
             self.export_destroy(name)
             # add the graph name to the purged list
@@ -244,7 +506,8 @@ class Manager(Collector):
             return set()
 
     def features(self, name):
-        return self.feature_stores[name].types
+        with self.store_lock:
+            return self.feature_stores[name].types
 
     def plots(self, name):
         return self.feature_stores[name].plots
@@ -253,9 +516,14 @@ class Manager(Collector):
         matched = self.feature_req.match(request)
         if matched:
             if matched.group("type") == "fetch":
-                if matched.group("name") in self.feature_stores[name]:
+                self.mark_viewed(name, matched.group("name"))
+                with self.store_lock:
+                    store = self.feature_stores[name]
+                    found = matched.group("name") in store
+                    value = store.get(matched.group("name")) if found else None
+                if found:
                     self.comm.send_string("ok", zmq.SNDMORE)
-                    self.comm.send_pyobj(self.feature_stores[name].get(matched.group("name")))
+                    self.comm.send_pyobj(value)
                 else:
                     self.comm.send_string("error")
             else:
@@ -265,6 +533,7 @@ class Manager(Collector):
             return False
 
     def client_request(self):
+        start = time.time()
         request = self.comm.recv_string()
         if request in self.global_cmds:
             getattr(self, "cmd_%s" % request, self.cmd_unknown)()
@@ -278,6 +547,12 @@ class Manager(Collector):
         else:
             self.comm.send_string("error")
 
+        # label the feature requests by their type and unknown commands together to bound the label values
+        command = request.partition(":")[0]
+        if command != "fetch" and not hasattr(self, "cmd_%s" % command):
+            command = "unknown"
+        self.command_duration.labels(self.hutch, command, self.name).observe(time.time() - start)
+
     def compile_graph(self, name):
         """
         Tries to compile the named graph. A copy of the original graph is made,
@@ -348,9 +623,13 @@ class Manager(Collector):
         self.publish_graph(name)
 
     def cmd_reset_features(self, name):
-        self.feature_stores[name].clear()
-        self.feature_stores[name].version = 0
-        self.export_store(name)
+        with self.store_lock:
+            self.feature_stores[name].clear()
+            self.feature_stores[name].version = 0
+            self.view_cache.pop(name, None)
+            for history in self.histories[name].values():
+                history.clear()
+            self.export_store(name)
         self.comm.send_string("ok")
 
     def cmd_list_graphs(self):
@@ -440,6 +719,25 @@ class Manager(Collector):
         requested_data = dill.loads(self.comm.recv())
         self.publish_requested_data(name, requested_data)
 
+    def cmd_update_completion(self, name):
+        """
+        Client request to change the policy the collectors use to decide when a
+        heartbeat of the graph is complete. The `CompletionPolicy` is forwarded
+        to the collectors.
+        """
+        policy = dill.loads(self.comm.recv())
+        if policy is None:
+            self.policies.pop(name, None)
+        else:
+            self.policies[name] = policy
+        self.send_policy(name)
+        self.comm.send_string("ok")
+
+    def send_policy(self, name):
+        self.graph_comm.send_string("update_completion", zmq.SNDMORE)
+        self.graph_comm.send_pyobj(self.publish_info(name), zmq.SNDMORE)
+        self.graph_comm.send(dill.dumps(self.policies.get(name)))
+
     def cmd_update_sources(self, name):
         src_cfg = self.comm.recv_pyobj()
         self.graph_comm.send_string("update_sources", zmq.SNDMORE)
@@ -466,15 +764,155 @@ class Manager(Collector):
         self.graph_comm.send(dill.dumps(paths))
         self.comm.send_string("ok")
 
+    def cmd_track_history(self, name):
+        """
+        Client request to start retaining the values of a feature over the
+        most recent heartbeats. The payload is the feature name, the number of
+        heartbeats to retain and the cap on the memory used by the retained
+        values, where None selects the manager defaults for the last two.
+        """
+        feature, capacity, max_bytes = dill.loads(self.comm.recv())
+        if capacity is None:
+            capacity = self.HISTORY_CAPACITY
+        if max_bytes is None:
+            max_bytes = self.HISTORY_MAX_BYTES
+        if capacity < 1:
+            logger.error("Invalid history capacity %s requested for feature '%s'", capacity, feature)
+            self.comm.send_string("error")
+            return
+
+        with self.store_lock:
+            history = self.histories[name].get(feature)
+            if history is None or history.capacity != capacity or history.max_bytes != max_bytes:
+                self.histories[name][feature] = FeatureHistory(capacity, max_bytes)
+        self.comm.send_string("ok")
+
+    def cmd_untrack_history(self, name):
+        feature = dill.loads(self.comm.recv())
+        with self.store_lock:
+            self.histories[name].pop(feature, None)
+        self.comm.send_string("ok")
+
+    def cmd_get_history(self, name):
+        """
+        Client request for the retained values of a feature that fall within
+        a range of heartbeat ids or timestamps. The payload is the feature
+        name, the start and stop of the range and the key to select on.
+        """
+        feature, start, stop, key = dill.loads(self.comm.recv())
+        with self.store_lock:
+            history = self.histories[name].get(feature)
+            if history is not None and key in ("heartbeat", "timestamp"):
+                history = history.range(start, stop, key)
+            else:
+                history = None
+        if history is None:
+            self.comm.send_string("error")
+        else:
+            self.comm.send_string("ok", zmq.SNDMORE)
+            self.comm.send_pyobj(history)
+
+    def cmd_get_histories(self, name):
+        with self.store_lock:
+            histories = {feature: len(history) for feature, history in self.histories[name].items()}
+        self.comm.send_pyobj(histories)
+
+    def cmd_get_profile(self, name):
+        profile = self.profiles.get(name)
+        if profile is None or profile.version != self.versions[name]:
+            self.comm.send_pyobj({})
+        else:
+            self.comm.send_pyobj(profile.summary())
+
     def cmd_update_plots(self, name):
         plots = self.comm.recv_pyobj()
-        self.feature_stores[name].update_plots(plots)
-        self.export_store(name)
+        with self.store_lock:
+            self.feature_stores[name].update_plots(plots)
+            self.export_store(name)
         self.comm.send_string("ok")
 
+    def record_history(self, name, heartbeat, updates):
+        histories = self.histories.get(name)
+        if histories and updates:
+            for feature, history in histories.items():
+                value = updates.get(feature)
+                if value is not None:
+                    history.append(heartbeat, value)
+
     def publish_info(self, name):
         return name, self.versions[name], self.compiler_args
 
+    def demand(self, name):
+        """
+        Returns the features of a graph which are in demand: the ones viewed or
+        fetched in the last `DEMAND_TIMEOUT` seconds, subscribed to on the view
+        stream, exported, or whose history is retained.
+
+        Args:
+            name (str): name of the graph
+
+        Returns:
+            The set of features in demand.
+        """
+        cutoff = time.time() - self.DEMAND_TIMEOUT
+        demand = {feature for feature, last in self.viewed.get(name, {}).items() if last >= cutoff}
+        with self.store_lock:
+            for key in self.view_subscriptions.get(name, ()):
+                try:
+                    demand.add(parse_view_name(key)[0])
+                except ValueError:
+                    pass
+            demand.update(self.histories.get(name, ()))
+        demand.update(self.exports(name))
+        return frozenset(demand)
+
+    def mark_viewed(self, name, feature):
+        """
+        Records a request for a feature of a graph. If the feature was not in
+        demand the new demand is published right away, so that it is computed
+        from the next heartbeat on.
+
+        Args:
+            name (str): name of the graph
+            feature (str): name of the requested feature
+        """
+        if self.prune and name in self.graphs:
+            self.viewed[name][feature] = time.time()
+            if feature not in self.demands.get(name, ()):
+                self.publish_demand(name)
+
+    def publish_demand(self, name):
+        """
+        Publishes the features of a graph in demand to the workers and
+        collectors if they changed since they were last published.
+
+        Args:
+            name (str): name of the graph
+        """
+        demand = self.demand(name)
+        if demand != self.demands.get(name):
+            logger.debug("Features of graph %s in demand: %s", name, sorted(demand))
+            self.demands[name] = demand
+            self.send_demand(name)
+
+    def send_demand(self, name):
+        self.graph_comm.send_string("update_demand", zmq.SNDMORE)
+        self.graph_comm.send_pyobj(self.publish_info(name), zmq.SNDMORE)
+        self.graph_comm.send(dill.dumps(set(self.demands[name])))
+
+    def update_demands(self):
+        """
+        Publishes the demand of each graph which changed, e.g. because a view
+        was closed, and forgets the requests which are too old to count.
+        """
+        for name in list(self.graphs):
+            self.publish_demand(name)
+
+        cutoff = time.time() - self.DEMAND_TIMEOUT
+        for viewed in self.viewed.values():
+            for feature in [feature for feature, last in viewed.items() if last < cutoff]:
+                del viewed[feature]
+
     def publish_purge(self, name, reply=True):
         logger.info("Purging requested graph...")
         try:
@@ -548,17 +986,67 @@ class Manager(Collector):
                 self.comm.send_string("error")
 
     def publish_message(self, topic, node, payload):
-        self.info_comm.send_string(topic, zmq.SNDMORE)
-        self.info_comm.send_string(node, zmq.SNDMORE)
-        self.info_comm.send(payload)
-
-    def publish_view(self, topic, timestamp, data):
-        self.view_comm.send_string(topic + ZMQ_TOPIC_DELIM, zmq.SNDMORE)
-        self.view_comm.send_pyobj(timestamp, zmq.SNDMORE)
-        data = self.serializer(data)
-        self.view_comm.send_multipart(data, copy=False, flags=zmq.NOBLOCK)
+        frames = [topic.encode(), node.encode(), payload]
+        if self.in_control_thread():
+            self.info_comm.send_multipart(frames, copy=False)
+        else:
+            self.relay("info", frames)
+
+    def publish_view(self, name, key):
+        self.view_stream.send_string("view:%s:%s%s" % (name, key, ZMQ_TOPIC_DELIM), zmq.SNDMORE)
+        self.view_stream.send_pyobj(self.heartbeats[name], zmq.SNDMORE)
+        data = self.view_frames(name, key)
+        self.view_stream.send_multipart(data, copy=False, flags=zmq.NOBLOCK)
         return self.serializer.sizeof(data)
 
+    def viewable(self, name, key):
+        """
+        Checks if a view of a feature can be served.
+
+        Args:
+            name (str): name of the graph
+            key (str): name of the view of the feature (see `ami.comm.view_name`)
+
+        Returns:
+            True if the graph has the feature and the level of detail is valid.
+        """
+        try:
+            feature, _, _ = parse_view_name(key)
+        except ValueError:
+            return False
+        return self.exists(name) and feature in self.feature_stores[name]
+
+    def view_frames(self, name, key):
+        """
+        Returns the serialized frames of a view of a feature for the current
+        heartbeat. Each view is reduced to its level of detail and serialized
+        at most once per heartbeat, and the frames are shared by all the view
+        requests and the view stream.
+
+        Args:
+            name (str): name of the graph
+            key (str): name of the view of the feature (see `ami.comm.view_name`)
+
+        Returns:
+            The list of serialized frames of the feature.
+        """
+        store = self.feature_stores[name]
+        heartbeat = self.heartbeats.get(name)
+        cache_key = (key, store.version, None if heartbeat is None else heartbeat.identity)
+        cache = self.view_cache[name]
+        frames = cache.get(cache_key)
+        if frames is None:
+            self.event_counter.labels(self.hutch, "View Cache Miss", self.name).inc()
+            feature, mode, size = parse_view_name(key)
+            value = store.get(feature)
+            if mode is not None:
+                value = downsample(value, mode, size)
+            frames = self.serializer(value)
+            cache[cache_key] = frames
+        else:
+            self.event_counter.labels(self.hutch, "View Cache Hit", self.name).inc()
+        return frames
+
     def graph_request(self):
         request = self.graph_comm.recv_string()
 
@@ -571,6 +1059,10 @@ class Manager(Collector):
                 self.graph_comm.send_string("init", zmq.SNDMORE)
                 self.graph_comm.send_pyobj(self.publish_info(name), zmq.SNDMORE)
                 self.graph_comm.send(dill.dumps(graph))
+                if name in self.policies:
+                    self.send_policy(name)
+                if name in self.demands:
+                    self.send_demand(name)
             # publish a message that a new subscriber has subscribed
             self.graph_comm.send_string("cmd", zmq.SNDMORE)
             self.graph_comm.send_string("subscribed")
@@ -584,10 +1076,9 @@ class Manager(Collector):
         node = self.node_msg_comm.recv_string()
 
         if topic == "profile":
-            # graph = self.node_msg_comm.recv_string()
-            # payload = self.node_msg_comm.recv_multipart(copy=False)
             self.node_msg_comm.recv_string()
-            self.node_msg_comm.recv_multipart(copy=False)
+            payload = self.node_msg_comm.recv_serialized(self.deserializer, copy=False)
+            self.update_profile(node, payload)
         elif topic == "purge":
             name = dill.loads(self.node_msg_comm.recv(copy=False))
             if self.exists(name):
@@ -603,6 +1094,43 @@ class Manager(Collector):
             payload = self.node_msg_comm.recv(copy=False)
             self.publish_message(topic, node, payload)
 
+    def update_profile(self, node, payload):
+        """
+        Adds a profile report of a worker or collector to the profile of its
+        graph and observes the mean execution time and output size per event
+        of each of the reported nodes.
+
+        Args:
+            node (str): the name of the process which sent the report.
+            payload (dict): the report, see `Node.report`.
+        """
+        name = payload["graph"]
+        if not self.exists(name):
+            return
+
+        if name not in self.profiles:
+            self.profiles[name] = GraphProfile()
+        if not self.profiles[name].update(node, payload["version"], payload["heartbeat"], payload["times"]):
+            return
+
+        for node_name, (seconds, calls, nbytes) in payload["times"].items():
+            if calls:
+                self.node_duration.labels(self.hutch, name, node_name).observe(seconds / calls)
+                self.node_output_size.labels(self.hutch, name, node_name).observe(nbytes / calls)
+                self.profiled[name].add(node_name)
+
+    def delete_profile(self, name):
+        """
+        Discards the profile of a graph and the metrics of its nodes.
+
+        Args:
+            name (str): the name of the graph.
+        """
+        self.profiles.pop(name, None)
+        for node_name in self.profiled.pop(name, set()):
+            self.node_duration.remove(self.hutch, name, node_name)
+            self.node_output_size.remove(self.hutch, name, node_name)
+
     def info_request(self):
         request = self.info_comm.recv_string()
 
@@ -611,40 +1139,52 @@ class Manager(Collector):
 
     def view_request(self):
         # Receive batch request (list of "view:graph:feature" strings)
+        start = time.time()
         request = self.view_comm.recv_pyobj()
 
-        # Parse all requests and collect feature data
+        # Parse all requests and collect the serialized feature frames
         graph = None
-        data_dict = {}
-
-        for req_string in request:
-            matched = self.view_req.match(req_string)
-            if matched:
-                req_graph = matched.group("graph")
-                req_name = matched.group("name")
-
-                # Extract graph name (same for all features in batch)
-                if graph is None:
-                    graph = req_graph
-
-                # Get feature data from Manager's store
-                if self.exists(graph) and req_name in self.feature_stores[graph]:
-                    data_dict[req_name] = self.feature_stores[graph].get(req_name)
-                else:
-                    data_dict[req_name] = None
+        features = []
+        frames = []
+        size = 0
 
-        # Build atomic response
-        response = {
-            "graph": graph,
-            "heartbeat": self.heartbeats.get(graph),
-            "data": data_dict,
-        }
+        with self.store_lock:
+            for req_string in request:
+                matched = self.view_req.match(req_string)
+                if matched:
+                    req_graph = matched.group("graph")
+                    req_name = matched.group("name")
+
+                    # Extract graph name (same for all features in batch)
+                    if graph is None:
+                        graph = req_graph
+
+                    try:
+                        self.mark_viewed(graph, parse_view_name(req_name)[0])
+                    except ValueError:
+                        pass
+
+                    # Get the cached feature frames of the Manager's store
+                    if self.viewable(graph, req_name):
+                        data = self.view_frames(graph, req_name)
+                        features.append((req_name, len(data)))
+                        frames.extend(data)
+                        size += self.serializer.sizeof(data)
+                    else:
+                        features.append((req_name, 0))
+
+            # Build atomic response, which is assembled from the cached frames without serializing the features again
+            header = {
+                "graph": graph,
+                "heartbeat": self.heartbeats.get(graph),
+                "features": features,
+            }
+        response = [pickle.dumps(header)] + frames
 
         # Send batch response
-        response = self.serializer(response)
         self.view_comm.send_multipart(response, copy=False, flags=zmq.NOBLOCK)
-        size = self.serializer.sizeof(response)
-        self.event_size.labels(self.hutch, self.name).set(size)
+        self.event_size.labels(self.hutch, self.name).set(size + len(response[0]))
+        self.command_duration.labels(self.hutch, "view", self.name).observe(time.time() - start)
 
     def view_front_forward(self):
         req = self.view_comm_frontend.recv_multipart()
@@ -654,13 +1194,42 @@ class Manager(Collector):
         rep = self.view_comm_backend.recv_multipart()
         self.view_comm_frontend.send_multipart(rep)
 
-    def export_view(self, name, keys=[]):
+    def view_subscribe(self):
+        request = self.view_stream.recv_string()
+        matched = self.view_req.match(request[1:].rstrip(ZMQ_TOPIC_DELIM))
+        if not matched:
+            return
+
+        graph = matched.group("graph")
+        name = matched.group("name")
+        if request[0] == "\x01":
+            # send the latest value right away instead of waiting for the next heartbeat
+            with self.store_lock:
+                self.view_subscriptions[graph].add(name)
+                if self.viewable(graph, name):
+                    self.publish_view(graph, name)
+            if self.prune:
+                # start computing the subscribed feature without waiting for the next demand update
+                self.relay("demand", [graph.encode()])
+        elif request[0] == "\x00":
+            with self.store_lock:
+                self.view_subscriptions[graph].discard(name)
+
+    def export_view(self, name):
+        """
+        Publishes each subscribed feature of a graph once on the view stream,
+        however many clients are subscribed to it.
+
+        Args:
+            name (str): name of the graph
+        """
         size = 0
 
-        for key, value in self.feature_stores[name].namespace.items():
-            if key in keys:
-                size += self.publish_view("view:%s:%s" % (name, key), self.heartbeats[name], value)
-        self.event_size.labels(self.hutch, self.name).set(size)
+        for key in self.view_subscriptions.get(name, ()):
+            if self.viewable(name, key):
+                size += self.publish_view(name, key)
+        if size:
+            self.event_size.labels(self.hutch, self.name).set(size)
 
     def export_request(self):
         request = self.export.recv_string()
@@ -675,31 +1244,33 @@ class Manager(Collector):
             "version": self.versions[name],
             "dill": dill.dumps(self.graphs[name]),
         }
-        self.export.send_string("graph", zmq.SNDMORE)
-        self.export.send_string(name, zmq.SNDMORE)
-        self.export.send_pyobj(data)
+        self.send_export("graph", name, data)
 
     def export_store(self, name):
-        data = {
-            "version": self.feature_stores[name].version,
-            "features": self.features(name),
-            "plots": self.feature_stores[name].plots,
-        }
-        self.export.send_string("store", zmq.SNDMORE)
-        self.export.send_string(name, zmq.SNDMORE)
-        self.export.send_pyobj(data)
+        with self.store_lock:
+            data = {
+                "version": self.feature_stores[name].version,
+                "features": self.features(name),
+                "plots": self.feature_stores[name].plots,
+            }
+        self.send_export("store", name, data)
 
     def export_info(self):
         data = {
             "graphs": set(self.graphs),
         }
-        self.export.send_string("info", zmq.SNDMORE)
-        self.export.send_string("", zmq.SNDMORE)
-        self.export.send_pyobj(data)
+        self.send_export("info", "", data)
 
     def export_config(self):
+        if not self.in_control_thread():
+            # the graphs are only safe to export from the control thread which modifies them
+            self.relay("config", [])
+            return
+
         self.export_info()
-        for name in self.feature_stores:
+        with self.store_lock:
+            names = list(self.feature_stores)
+        for name in names:
             self.export_store(name)
         for name in self.graphs:
             self.export_graph(name)
@@ -711,9 +1282,7 @@ class Manager(Collector):
 
     def export_destroy(self, name):
         self.export_info()
-        self.export.send_string("destroy", zmq.SNDMORE)
-        self.export.send_string(name, zmq.SNDMORE)
-        self.export.send_pyobj(None)
+        self.send_export("destroy", name, None)
 
     def export_data(self, name, data):
         export_data = {}
@@ -722,17 +1291,32 @@ class Manager(Collector):
                 export_data[AutoExport.unmangle(key)] = val
         # Only export the dictionary if it is non-empty
         if export_data:
-            self.export.send_string("data", zmq.SNDMORE)
-            self.export.send_string(name, zmq.SNDMORE)
-            self.export.send_pyobj(export_data)
+            self.send_export("data", name, export_data)
 
     def export_heartbeat(self, name):
-        self.export.send_string("heartbeat", zmq.SNDMORE)
-        self.export.send_string(name, zmq.SNDMORE)
-        self.export.send_pyobj(self.heartbeats[name])
+        self.send_export("heartbeat", name, self.heartbeats[name])
+
+    def send_export(self, topic, name, data):
+        """
+        Publishes a message on the export socket, which the ingest thread does
+        by way of the control thread. The data is serialized with the
+        multipart `Serializer`, so arrays are sent as out-of-band frames
+        without being copied.
+
+        Args:
+            topic (str): the type of the message.
+            name (str): name of the graph the message is about.
+            data (object): the python object to send.
+        """
+        frames = [topic.encode(), name.encode()] + self.serializer(data)
+        if self.in_control_thread():
+            self.export.send_multipart(frames, copy=False)
+        else:
+            # only the data and heartbeats are superseded by the next heartbeat, the rest is state
+            self.relay("export", frames, droppable=topic in ("data", "heartbeat"))
 
     def poll_timeout(self):
-        pass
+        self.relay_sender.flush()
 
     def start_prometheus(self, port):
         while True:
@@ -773,6 +1357,9 @@ def run_manager(
     hutch,
     hwm,
     cprofile,
+    collapsed=False,
+    fan_in=None,
+    prune=False,
 ):
     logger.info("Starting manager, controlling %d workers on %d nodes PID: %d", num_workers, num_nodes, os.getpid())
 
@@ -802,6 +1389,9 @@ def run_manager(
         prometheus_dir,
         hutch,
         hwm,
+        collapsed,
+        fan_in,
+        prune,
     ) as manager:
         if prometheus_port:
             manager.start_prometheus(prometheus_port)
@@ -829,6 +1419,14 @@ def main():
         "-N", "--num-nodes", type=int, default=1, help="number of nodes (a.k.a local collector processes) (default: 1)"
     )
 
+    parser.add_argument(
+        "--fan-in",
+        type=int,
+        nargs="+",
+        default=None,
+        help="fan-in of each intermediate collector tier between the local and global collectors (default: none)",
+    )
+
     parser.add_argument(
         "--log-level",
         default=LogConfig.Level,
@@ -847,6 +1445,12 @@ def main():
 
     parser.add_argument("--cprofile", help="profile with cprofile", action="store_true")
 
+    parser.add_argument(
+        "--prune",
+        action="store_true",
+        help="only execute the nodes needed by the features which are viewed, exported or subscribed to",
+    )
+
     parser.add_argument(
         "--tracing-endpoint",
         help="OpenTelemetry endpoint for tracing (e.g. localhost:4317 or 'console' for stdout)",
@@ -859,6 +1463,9 @@ def main():
 
     args = parser.parse_args()
 
+    if args.fan_in is not None and min(args.fan_in) < 1:
+        parser.error("--fan-in must be at least 1")
+
     if args.tracing_endpoint:
         os.environ["AMI_TRACING_ENDPOINT"] = args.tracing_endpoint
     if args.tracing_session_id:
@@ -896,6 +1503,8 @@ def main():
             args.hutch,
             args.hwm,
             args.cprofile,
+            fan_in=args.fan_in,
+            prune=args.prune,
         )
     except KeyboardInterrupt:
         logger.info("Manager killed by user...")
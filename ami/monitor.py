@@ -14,7 +14,7 @@ from bokeh.models.ranges import DataRange1d
 
 from ami import Defaults, LogConfig
 from ami.client import GraphMgrAddress
-from ami.comm import PlatformAction, Ports
+from ami.comm import ZMQ_TOPIC_DELIM, PlatformAction, Ports, ViewBuffer, view_stream_addr
 from ami.data import Deserializer
 
 logger = logging.getLogger(__name__)
@@ -51,67 +51,74 @@ col_step = 4
 class AsyncFetcher:
     """Single shared data fetcher for all plot widgets.
 
-    Subscribes to heartbeat notifications on the export XPUB socket, then
-    issues a single batched REQ/REP call for all features needed by registered
-    widgets. This avoids N separate ZMQ round-trips.
+    Subscribes to the features needed by the registered widgets on the
+    manager's view stream, where each feature is published once per heartbeat,
+    and conflates the updates that queue up while the widgets are busy to the
+    latest value of each feature.
     """
 
     def __init__(self, addr, ctx):
         self.addr = addr
         self.ctx = ctx
         self.deserializer = Deserializer()
-        self.heartbeat_timestamp = 0
         self.widgets = {}  # name -> PlotWidget
+        self.subscriptions = {}  # feature -> number of widgets using it
+        self.buffer = ViewBuffer()  # the streamed features by heartbeat
+        self.shown = {}  # name -> last heartbeat passed to the widget
 
-        # Subscribe to heartbeat notifications on the export socket
-        self.export = ctx.socket(zmq.SUB)
-        self.export.connect(addr.export)
-        self.export.setsockopt_string(zmq.SUBSCRIBE, "heartbeat")
+        # Subscribe to the features of the registered widgets on the view stream
+        self.view = ctx.socket(zmq.SUB)
+        self.view.connect(view_stream_addr(addr.view))
 
-        # REQ socket for batch view data requests
-        self.view = ctx.socket(zmq.REQ)
-        self.view.connect(addr.view)
+    def topic(self, feature):
+        return f"view:{self.addr.name}:{feature}{ZMQ_TOPIC_DELIM}"
 
     def register(self, name, widget):
+        self.unregister(name)
         self.widgets[name] = widget
+        for feature in set(widget.topics.values()):
+            if feature not in self.subscriptions:
+                self.view.setsockopt_string(zmq.SUBSCRIBE, self.topic(feature))
+            self.subscriptions[feature] = self.subscriptions.get(feature, 0) + 1
 
     def unregister(self, name):
-        self.widgets.pop(name, None)
+        widget = self.widgets.pop(name, None)
+        self.shown.pop(name, None)
+        if widget is None:
+            return
+        for feature in set(widget.topics.values()):
+            self.subscriptions[feature] -= 1
+            if not self.subscriptions[feature]:
+                del self.subscriptions[feature]
+                self.view.setsockopt_string(zmq.UNSUBSCRIBE, self.topic(feature))
+
+    async def recv(self, flags=0):
+        topic = await self.view.recv_string(flags=flags)
+        heartbeat = await self.view.recv_pyobj()
+        data = await self.view.recv_serialized(self.deserializer, copy=False)
+        # topics are of the form view:graph:feature
+        return topic.rstrip(ZMQ_TOPIC_DELIM).split(":", 2)[2], heartbeat, data
 
     async def run(self):
         while True:
-            # Wait for heartbeat notification from manager
-            await self.export.recv_string()  # topic, unused
-            graph = await self.export.recv_string()
-            heartbeat = await self.export.recv_pyobj()
-
-            if graph != self.addr.name:
-                continue
-            if heartbeat.timestamp <= self.heartbeat_timestamp:
-                continue
-            self.heartbeat_timestamp = heartbeat.timestamp
-
-            if not self.widgets:
-                continue
-
-            # Collect all unique features needed by all active widgets
-            all_features = set()
-            for widget in self.widgets.values():
-                all_features.update(widget.topics.values())
+            # Wait for the next update from the manager
+            feature, heartbeat, val = await self.recv()
+            self.buffer.add(feature, heartbeat, val)
 
-            if not all_features:
-                continue
-
-            # Single batch request for all features
-            requests = [f"view:{self.addr.name}:{f}" for f in all_features]
-            await self.view.send_pyobj(requests)
-            response = await self.view.recv_serialized(self.deserializer, copy=False)
-
-            batch_data = response.get("data", {})
-            resp_heartbeat = response.get("heartbeat", heartbeat)
+            # Buffer the updates which queued up in the meantime by heartbeat
+            while True:
+                try:
+                    feature, heartbeat, val = await self.recv(flags=zmq.NOBLOCK)
+                except zmq.Again:
+                    break
+                self.buffer.add(feature, heartbeat, val)
 
-            # Distribute data to each registered widget
-            for widget in self.widgets.values():
+            # Give each registered widget its features from the latest heartbeat which has all of them
+            for name, widget in self.widgets.items():
+                heartbeat, batch_data = self.buffer.latest(set(widget.topics.values()), after=self.shown.get(name))
+                if heartbeat is None:
+                    continue
+                self.shown[name] = heartbeat
                 widget_data = {}
                 for input_name, feature in widget.topics.items():
                     val = batch_data.get(feature)
@@ -123,10 +130,9 @@ class AsyncFetcher:
                     widget_data[input_name] = val
                 if widget_data:
                     widget.data_updated(widget_data)
-                    widget.update_latency(resp_heartbeat)
+                    widget.update_latency(heartbeat)
 
     def close(self):
-        self.export.close()
         self.view.close()
 
 
@@ -362,8 +368,9 @@ class Monitor:
         self.store_sub = self.ctx.socket(zmq.SUB)
         self.store_sub.setsockopt_string(zmq.SUBSCRIBE, "")
         self.store_sub.connect(self.graphmgr_addr.export)
+        self.deserializer = Deserializer()
 
-        # Shared data fetcher (heartbeat + view REQ/REP)
+        # Shared data fetcher (view stream subscriptions)
         self.fetcher = AsyncFetcher(self.graphmgr_addr, self.ctx)
 
         self.lock = asyncio.Lock()
@@ -471,7 +478,7 @@ class Monitor:
         while True:
             topic = await self.store_sub.recv_string()
             graph = await self.store_sub.recv_string()
-            exports = await self.store_sub.recv_pyobj()
+            exports = await self.store_sub.recv_serialized(self.deserializer, copy=False)
 
             if self.graphmgr_addr.name != graph:
                 continue
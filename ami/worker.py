@@ -1,5 +1,6 @@
 #!/usr/bin/env python
 import argparse
+import concurrent.futures
 import cProfile
 import datetime as dt
 import json
@@ -15,8 +16,8 @@ import zmq
 
 from ami import Defaults, LogConfig
 from ami.comm import AutoExport, Colors, Node, PlatformAction, Ports, ResultStore
-from ami.data import MsgTypes, RequestedData, Source, Transitions
-from ami.graphkit_wrapper import Graph
+from ami.data import Codecs, MsgTypes, PrefetchIterator, RequestedData, Serializer, Source, Transitions
+from ami.graphkit_wrapper import Graph, SubexpressionCache
 from ami.tracing import get_trace_id, setup_tracing, start_child_span, start_span
 
 logger = logging.getLogger(__name__)
@@ -36,13 +37,37 @@ class Worker(Node):
         hutch,
         hwm,
         timeout,
-        select_manager,
+        select_table,
+        batch_size=1,
+        prefetch=0,
+        shmem_size=0,
+        compression=None,
+        share_subexpressions=False,
+        branch_threads=0,
     ):
         """
         node : int
             a unique integer identifying this worker
         src : object
             object with an events() method that is an iterable (like psana.DataSource)
+        select_table : SelectTable
+            shared table used to pick the worker that sends each automatic Pick1 (None for a single worker)
+        batch_size : int
+            maximum number of datagrams to buffer and execute as a single batch (default: 1 - batching disabled)
+        prefetch : int
+            number of messages to read ahead from the source on a background thread (default: 0 - disabled)
+        shmem_size : int
+            size in MB of the shared memory ring buffer used to send large arrays to the node collector
+            (default: 0 - disabled)
+        compression : dict
+            options passed to the serializer for compressing large arrays sent to the node collector, e.g.
+            {"codec": "lz4", "threshold": 1048576, "shuffle": True} (default: None - disabled)
+        share_subexpressions : bool
+            compute the stateless nodes found in more than one graph once per event and share their results between
+            the graphs (default: False)
+        branch_threads : int
+            number of threads executing the independent branches of each graph in parallel (default: 0 - the
+            graphs are executed serially)
         """
         super().__init__(
             node,
@@ -56,12 +81,29 @@ class Worker(Node):
 
         self.src = src
         self.pending_src = False
-        self.store = ResultStore(collector_addr, self.ctx, hwm, select_manager)
+        self.shmem_size = shmem_size or 0
+        serializer = None
+        if self.shmem_size > 0:
+            serializer = Serializer("shmem", size=self.shmem_size * 1024 * 1024)
+        elif compression:
+            serializer = Serializer(**compression)
+        self.store = ResultStore(collector_addr, self.ctx, hwm, select_table, serializer)
 
         self.graph_comm.add_handler("update_sources", self.update_sources)
         self.graph_comm.add_handler("update_requested_data", self.update_requests_kwargs)
+        self.graph_comm.add_handler("update_demand", self.update_demand)
 
         self.exports = {}
+        self.batch_size = max(batch_size or 1, 1)
+        self.batch = []
+        self.prefetch = prefetch or 0
+        self.subexpressions = SubexpressionCache() if share_subexpressions else None
+        self.demands = {}
+        self.executor = None
+        if branch_threads > 1:
+            self.executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=branch_threads, thread_name_prefix="%s-branch" % self.name
+            )
 
     def __enter__(self):
         return self
@@ -74,6 +116,10 @@ class Worker(Node):
         return "worker%03d" % self.node
 
     def close(self):
+        if self.shmem_size > 0:
+            self.store.serializer.close()
+        if self.executor is not None:
+            self.executor.shutdown(wait=False)
         self.ctx.destroy()
 
     def init_graph(self, name):
@@ -85,9 +131,8 @@ class Worker(Node):
             self.graphs[name] = None
         if name in self.store:
             self.store.clear(name)
-        # if name in self.times:
-        #     del self.times[name]
         self.update_requests()
+        self.update_subexpressions()
 
     def update_requests(self):
         logger.debug("Update requests")
@@ -104,14 +149,32 @@ class Worker(Node):
         self.src.request(requested_data, is_kws_update=True)
         return
 
+    def update_subexpressions(self):
+        if self.subexpressions is not None:
+            self.subexpressions.update(self.graphs.values())
+
+    def update_demand(self, name, version, args, demand):
+        logger.debug("%s: Updating the outputs in demand of graph %s", self.name, name)
+        self.demands[name] = demand
+        if self.graphs.get(name):
+            self.graphs[name].demand(demand)
+            self.update_requests()
+
     def update_graph(self, name, version, args):
         if self.graphs[name]:
+            self.graphs[name].share_subexpressions(self.subexpressions)
+            self.graphs[name].demand(self.demands.get(name))
+            self.graphs[name].parallelize(self.executor)
             self.graphs[name].compile(**args)
             self.update_requests()
             self.store.configure(name, version, self.graphs[name].outputs["worker"])
         else:
             # Empty graph - just update requests
             self.update_requests()
+            if name in self.store:
+                # release the selection slots of the removed graph outputs
+                self.store.configure(name, version, ())
+        self.update_subexpressions()
 
     def recv_graph(self, name, version, args, graph):
         self.graphs[name] = graph
@@ -131,11 +194,11 @@ class Worker(Node):
     def recv_graph_purge(self, name, version, args, nodes):
         if name in self.graphs:
             del self.graphs[name]
+        self.demands.pop(name, None)
         if name in self.store:
             self.store.remove(name)
-        # if name is self.times:
-        #     del self.times[name]
         self.update_requests()
+        self.update_subexpressions()
 
     def recv_graph_exception(self, name, version, exception):
         logger.exception("%s: Failure encountered updating graph (%s v%d):", self.name, name, self.store.version(name))
@@ -173,12 +236,97 @@ class Worker(Node):
             self.report("event_rate", self.event_rate)
             self.event_rate = {}
 
+        for name, graph in self.graphs.items():
+            if graph:
+                self.report_times(graph.pop_profile(), name, heartbeat)
+
         # clear the data from the store after collecting
         self.store.clear()
         return size
 
+    def report_times(self, times, name, heartbeat):
+        if times:
+            self.report(
+                "profile",
+                {"graph": name, "heartbeat": heartbeat.identity, "times": times, "version": self.store.version(name)},
+            )
+
+    def execute(self, payloads):
+        """
+        Executes all the graphs over a list of datagram payloads. When there is
+        more than one payload the graphs are executed in batched mode.
+
+        Args:
+            payloads (list): the datagram payloads to process
+
+        Returns:
+            The total time spent executing the graphs.
+        """
+        graph_time = 0
+
+        for name, graph in self.graphs.items():
+            try:
+                if graph:
+                    if name in self.exports:
+                        for payload in payloads:
+                            payload.update(self.exports[name])
+
+                    start = time.time()
+                    if len(payloads) > 1:
+                        graph_results = graph.batch(payloads, color=Colors.Worker)
+                    else:
+                        graph_results = [graph(payloads[0], color=Colors.Worker)]
+                    stop = time.time()
+
+                    graph_time += stop - start
+
+                    # only the latest value of each output is kept by the store
+                    updates = {}
+                    for graph_result in graph_results:
+                        updates.update(graph_result)
+                    self.store.update(name, updates)
+
+                    if name not in self.event_rate:
+                        self.event_rate[name] = []
+
+                    self.event_rate[name].append((start, stop))
+
+                    graph.record(updates, calls=len(payloads))
+
+            except Exception as e:
+                e.graph_name = name
+                logger.exception(
+                    "%s: Failure encountered while executing graph (%s, v%d):",
+                    self.name,
+                    name,
+                    self.store.version(name),
+                )
+                self.report("error", e)
+                logger.error("%s: Purging graph (%s v%d)", self.name, name, self.store.version(name))
+                self.clear_graph(name)
+                self.report("purge", name)
+
+        if self.subexpressions is not None:
+            self.subexpressions.clear()
+
+        return graph_time
+
+    def flush(self):
+        """
+        Executes the graphs over any buffered datagrams.
+
+        Returns:
+            The total time spent executing the graphs.
+        """
+        graph_time = 0
+
+        if self.batch:
+            graph_time = self.execute(self.batch)
+            self.batch = []
+
+        return graph_time
+
     def run(self):
-        # self.times = {}
         self.event_rate = {}
         self.num_events = 1
         self.start_prometheus()
@@ -198,6 +346,7 @@ class Worker(Node):
             buckets=[0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5],
         )
         phase_pct = pc.Gauge("ami_heartbeat_phase_pct", "Heartbeat phase percentage", ["hutch", "type", "process"])
+        queue_depth = pc.Gauge("ami_source_queue_depth", "Source prefetch queue depth", ["hutch", "process"])
 
         idle_start = time.time()
         idle_stop = time.time()
@@ -210,10 +359,18 @@ class Worker(Node):
         hb_max_input_latency = 0
 
         while True:
-            for msg in self.src.events():
+            events = self.src.events()
+            if self.prefetch > 0:
+                events = PrefetchIterator(events, self.prefetch)
+
+            for msg in events:
                 idle_stop = time.time()
                 hb_idle_time += idle_stop - idle_start
 
+                if msg.mtype != MsgTypes.Datagram:
+                    # batches never span a heartbeat or transition boundary
+                    hb_graph_time += self.flush()
+
                 # check to see if the graph has been reconfigured after update
                 if msg.mtype == MsgTypes.Heartbeat:
                     heartbeat_start = time.time()
@@ -223,7 +380,7 @@ class Worker(Node):
                     send_time = time.time() - send_start
                     for name, graph in self.graphs.items():
                         if graph:
-                            graph.heartbeat_finished()
+                            graph.heartbeat_finished(color=Colors.Worker)
 
                             for node_name, warning in graph.warnings().items():
                                 warning.graph_name = name
@@ -246,6 +403,13 @@ class Worker(Node):
                             break
 
                     event_counter.labels(self.hutch, "Heartbeat", self.name).inc()
+                    if self.subexpressions is not None:
+                        event_counter.labels(self.hutch, "Subexpression Hit", self.name).inc(self.subexpressions.hits)
+                        event_counter.labels(self.hutch, "Subexpression Miss", self.name).inc(
+                            self.subexpressions.misses
+                        )
+                        self.subexpressions.hits = 0
+                        self.subexpressions.misses = 0
 
                     if self.pending_src:
                         break
@@ -263,6 +427,8 @@ class Worker(Node):
                     )
                     event_time.labels(self.hutch, "Send", self.name).set(send_time)
                     event_latency.labels(self.hutch, "Source", self.name).set(hb_max_input_latency)
+                    if self.prefetch > 0:
+                        queue_depth.labels(self.hutch, self.name).set(events.depth)
                     if hb_partial_events > 0:
                         event_counter.labels(self.hutch, "Partial", self.name).inc(hb_partial_events)
 
@@ -367,42 +533,12 @@ class Worker(Node):
                     if any(v is None for k, v in msg.payload.items()):
                         hb_partial_events += 1
 
-                    for name, graph in self.graphs.items():
-                        graph_result = None
-                        try:
-                            if graph:
-                                if name in self.exports:
-                                    msg.payload.update(self.exports[name])
-
-                                start = time.time()
-                                graph_result = graph(msg.payload, color=Colors.Worker)
-                                stop = time.time()
-
-                                hb_graph_time += stop - start
-
-                                self.store.update(name, graph_result)
-
-                                if name not in self.event_rate:
-                                    self.event_rate[name] = []
-
-                                self.event_rate[name].append((start, stop))
-
-                                # if name not in self.times:
-                                #     self.times[name] = []
-                                # self.times[name].append((start, stop, graph.times()))
-
-                        except Exception as e:
-                            e.graph_name = name
-                            logger.exception(
-                                "%s: Failure encountered while executing graph (%s, v%d):",
-                                self.name,
-                                name,
-                                self.store.version(name),
-                            )
-                            self.report("error", e)
-                            logger.error("%s: Purging graph (%s v%d)", self.name, name, self.store.version(name))
-                            self.clear_graph(name)
-                            self.report("purge", name)
+                    if self.batch_size > 1:
+                        self.batch.append(msg.payload)
+                        if len(self.batch) >= self.batch_size:
+                            hb_graph_time += self.flush()
+                    else:
+                        hb_graph_time += self.execute([msg.payload])
 
                     self.num_events += 1
                     hb_num_datagrams += 1
@@ -439,6 +575,11 @@ class Worker(Node):
 
                 idle_start = time.time()
 
+            self.flush()
+
+            if self.prefetch > 0:
+                events.close()
+
             if self.pending_src:
                 msg = self.src.unconfigure()
                 self.store.send(msg)
@@ -462,7 +603,13 @@ def run_worker(
     hwm=None,
     timeout=None,
     cprofile=False,
-    select_manager=(None, None, None, None, None),
+    select_table=None,
+    batch_size=1,
+    prefetch=0,
+    shmem_size=0,
+    compression=None,
+    share_subexpressions=False,
+    branch_threads=0,
 ):
 
     logger.info("Starting worker # %d, sending to collector at %s PID: %d", num, collector_addr, os.getpid())
@@ -521,7 +668,13 @@ def run_worker(
         hutch,
         hwm,
         timeout,
-        select_manager,
+        select_table,
+        batch_size,
+        prefetch,
+        shmem_size,
+        compression,
+        share_subexpressions,
+        branch_threads,
     ) as worker:
         return worker.run()
 
@@ -548,6 +701,13 @@ def parse_args(args):
     return flags, src_cfg
 
 
+def compression_options(args):
+    if args.compression is None:
+        return None
+
+    return {"codec": args.compression, "threshold": args.compression_threshold * 1024, "shuffle": args.shuffle}
+
+
 def main():
     parser = argparse.ArgumentParser(description="AMII Worker App")
 
@@ -598,6 +758,61 @@ def main():
 
     parser.add_argument("--cprofile", help="profile with cprofile", action="store_true")
 
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=1,
+        help="number of datagrams to execute as a single batch within a heartbeat (default: 1)",
+    )
+
+    parser.add_argument(
+        "--prefetch",
+        type=int,
+        default=0,
+        help="number of messages to read ahead from the data source on a background thread (default: 0)",
+    )
+
+    parser.add_argument(
+        "--shmem-size",
+        type=int,
+        default=0,
+        help="size in MB of the shared memory buffer for sending large arrays to the node collector, which must "
+        "use the same option (default: 0)",
+    )
+
+    parser.add_argument(
+        "--compression",
+        choices=sorted(Codecs),
+        default=None,
+        help="codec used to compress large arrays sent to the node collector (default: None)",
+    )
+
+    parser.add_argument(
+        "--compression-threshold",
+        type=int,
+        default=1024,
+        help="minimum size in kB of arrays to compress (default: 1024)",
+    )
+
+    parser.add_argument(
+        "--shuffle",
+        action="store_true",
+        help="byte shuffle numeric arrays before compressing them",
+    )
+
+    parser.add_argument(
+        "--share-subexpressions",
+        action="store_true",
+        help="compute the stateless nodes found in more than one graph once per event and share their results",
+    )
+
+    parser.add_argument(
+        "--branch-threads",
+        type=int,
+        default=0,
+        help="number of threads executing the independent branches of each graph in parallel (default: 0)",
+    )
+
     parser.add_argument(
         "source",
         nargs="?",
@@ -636,6 +851,12 @@ def main():
             args.hwm,
             args.timeout,
             args.cprofile,
+            batch_size=args.batch_size,
+            prefetch=args.prefetch,
+            shmem_size=args.shmem_size,
+            compression=compression_options(args),
+            share_subexpressions=args.share_subexpressions,
+            branch_threads=args.branch_threads,
         )
     except KeyboardInterrupt:
         logger.info("Worker killed by user...")
@@ -0,0 +1,92 @@
+import amitypes as at
+import numpy as np
+import pytest
+
+from ami.data import CollectorMessage, Deserializer, Heartbeat, MsgTypes, Serializer, lz4, pa, zstd
+
+# protocol name -> (protocol, serializer options)
+protocols = {
+    "pickle": ("pickle", {}),
+    "dill": ("dill", {}),
+    "shmem": ("shmem", {}),
+}
+if pa is not None:
+    protocols["arrow"] = ("arrow", {})
+if lz4 is not None:
+    protocols["pickle-lz4"] = ("pickle", {"codec": "lz4", "shuffle": True})
+if zstd is not None:
+    protocols["pickle-zstd"] = ("pickle", {"codec": "zstd", "shuffle": True})
+
+
+def scalars():
+    return {"sum_%d" % i: float(i) for i in range(32)}
+
+
+def waveforms():
+    rng = np.random.default_rng(0)
+    return {"waveform_%d" % i: rng.normal(size=4096) for i in range(8)}
+
+
+def image():
+    rng = np.random.default_rng(0)
+    return {"image": rng.poisson(5, size=(1024, 1024)).astype(np.float32)}
+
+
+def pickn():
+    rng = np.random.default_rng(0)
+    return {"pick": [rng.poisson(5, size=(256, 256)).astype(np.uint16) for _ in range(10)]}
+
+
+def reduce_by_key():
+    rng = np.random.default_rng(0)
+    return {"binned": {float(key): rng.normal(size=1024) for key in range(64)}}
+
+
+def group():
+    rng = np.random.default_rng(0)
+    grouped = {"raw": rng.poisson(5, size=(512, 512)).astype(np.uint16), "gain": 1.5, "ts": 12345}
+    return {"group": at.Group("det", "psana", "Detector", grouped)}
+
+
+# payload class -> factory for the payload of a CollectorMessage
+payloads = {
+    "scalars": scalars,
+    "waveforms": waveforms,
+    "image": image,
+    "pickn": pickn,
+    "reduce_by_key": reduce_by_key,
+    "group": group,
+}
+
+
+@pytest.fixture(scope="module", params=list(protocols))
+def protocol(request):
+    """
+    Returns a (name, serializer, deserializer) tuple for each protocol.
+    """
+    name = request.param
+    proto, options = protocols[name]
+    serializer = Serializer(proto, **options)
+    deserializer = Deserializer(proto)
+    yield name, serializer, deserializer
+
+    if hasattr(deserializer, "close"):
+        deserializer.close()
+    if hasattr(serializer, "close"):
+        serializer.close()
+
+
+@pytest.fixture(scope="module", params=list(payloads))
+def message(request):
+    """
+    Returns a (payload class, message) tuple for each payload class.
+    """
+    msg = CollectorMessage(
+        mtype=MsgTypes.Datagram,
+        identity=0,
+        heartbeat=Heartbeat(5, 1.0),
+        name="graph",
+        version=1,
+        payload=payloads[request.param](),
+    )
+    return request.param, msg
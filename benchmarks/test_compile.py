@@ -0,0 +1,100 @@
+"""
+Benchmarks of graph compilation on synthetic flowcharts of a few hundred
+nodes.
+
+The full benchmark compiles a freshly built graph, as a worker does when it
+receives the whole graph, and the incremental ones recompile an already
+compiled graph after the kind of small delta the GUI sends when a node is
+tweaked or added.
+
+Run with: pytest benchmarks/test_compile.py --benchmark-only --benchmark-columns=mean,stddev,ops
+"""
+
+import dill
+import numpy as np
+import pytest
+
+from ami.graph_nodes import Accumulator, Map, PickN
+from ami.graphkit_wrapper import Graph
+
+COMPILER_ARGS = {"num_workers": 32, "num_local_collectors": 4}
+
+
+def scale(value):
+    return 2 * value
+
+
+def add(res, *values, **kwargs):
+    return res + sum(values)
+
+
+def synthetic_graph(branches):
+    """
+    Builds a graph with six nodes per branch: a worker side chain of maps, a
+    global PickN and Accumulator, and a map running on the global collector.
+    """
+    graph = Graph(name="synthetic")
+    for b in range(branches):
+        det = "det%d" % (b % 8)
+        graph.add(
+            [
+                Map(name="Roi%d" % b, inputs=[det], outputs=["roi%d" % b], func=np.abs),
+                Map(name="Sum%d" % b, inputs=["roi%d" % b], outputs=["sum%d" % b], func=np.sum),
+                Map(name="Scale%d" % b, inputs=["sum%d" % b], outputs=["scaled%d" % b], func=scale),
+                PickN(name="Pick%d" % b, inputs=["scaled%d" % b], outputs=["picked%d" % b], N=8, parent="Pick%d" % b),
+                Accumulator(
+                    name="Accumulate%d" % b,
+                    inputs=["scaled%d" % b],
+                    outputs=["accumulated%d" % b],
+                    reduction=add,
+                    parent="Accumulate%d" % b,
+                ),
+                Map(name="Total%d" % b, inputs=["accumulated%d" % b], outputs=["total%d" % b], func=scale),
+            ]
+        )
+    return graph
+
+
+@pytest.fixture(scope="module", params=[50, 100])
+def branches(request):
+    return request.param
+
+
+def copies(graph):
+    """
+    Returns a pedantic setup function handing each round its own copy of the graph.
+    """
+    data = dill.dumps(graph)
+
+    def setup():
+        return (dill.loads(data),), {}
+
+    return setup
+
+
+def test_compile_full(benchmark, branches):
+    benchmark.group = "compile-%d" % (6 * branches)
+    benchmark.extra_info["nodes"] = 6 * branches
+
+    def compile(graph):
+        graph.compile(**COMPILER_ARGS)
+
+    benchmark.pedantic(compile, setup=copies(synthetic_graph(branches)), rounds=10)
+
+
+@pytest.mark.parametrize("delta", ["replace", "add"])
+def test_compile_incremental(benchmark, branches, delta):
+    benchmark.group = "compile-%d" % (6 * branches)
+    benchmark.extra_info["nodes"] = 6 * branches
+    graph = synthetic_graph(branches)
+    graph.compile(**COMPILER_ARGS)
+
+    def compile(graph):
+        if delta == "replace":
+            # e.g. a slider changing the parameters of one map
+            graph.add(Map(name="Scale0", inputs=["sum0"], outputs=["scaled0"], func=np.negative))
+        else:
+            graph.add(PickN(name="PickNew", inputs=["sum0"], outputs=["pickedNew"], parent="PickNew"))
+        graph.compile(**COMPILER_ARGS)
+
+    benchmark.pedantic(compile, setup=copies(graph), rounds=10)
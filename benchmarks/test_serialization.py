@@ -0,0 +1,107 @@
+"""
+Benchmarks of the serialization protocols on the message shapes sent
+between AMI processes.
+
+Each benchmark is grouped by payload class so the protocols can be compared
+directly, and records the bytes on the wire, the throughput and the accuracy
+of the serializer's sizeof estimate in the extra info of the results.
+
+Run with: pytest benchmarks --benchmark-only --benchmark-columns=mean,stddev,ops
+"""
+
+import pytest
+import zmq
+
+
+def wire(frames):
+    """
+    Returns the frames as they arrive from zeromq.
+    """
+    return [bytes(memoryview(frame)) for frame in frames]
+
+
+def record(benchmark, serializer, frames, throughput=True):
+    nbytes = sum(len(frame) for frame in wire(frames))
+    benchmark.extra_info["bytes"] = nbytes
+    benchmark.extra_info["frames"] = len(frames)
+    if throughput and benchmark.stats is not None:
+        benchmark.extra_info["MB/s"] = nbytes / benchmark.stats.stats.mean / 1e6
+    if hasattr(serializer, "sizeof"):
+        benchmark.extra_info["sizeof_error"] = serializer.sizeof(frames) / nbytes - 1
+
+
+def skip_unreceived(name):
+    if name == "shmem":
+        pytest.skip("the shmem ring buffer fills up unless a receiver releases it")
+
+
+def reclaim(deserializer):
+    if hasattr(deserializer, "reclaim"):
+        deserializer.reclaim()
+
+
+def test_serialize(benchmark, protocol, message):
+    name, serializer, deserializer = protocol
+    payload, msg = message
+    benchmark.group = "serialize-%s" % payload
+    skip_unreceived(name)
+
+    frames = benchmark(serializer, msg)
+    record(benchmark, serializer, frames)
+
+
+def test_deserialize(benchmark, protocol, message):
+    name, serializer, deserializer = protocol
+    payload, msg = message
+    benchmark.group = "deserialize-%s" % payload
+    frames = wire(serializer(msg))
+
+    def deserialize():
+        result = deserializer(frames)
+        reclaim(deserializer)
+        return result
+
+    result = benchmark(deserialize)
+    assert result.name == msg.name
+    assert result.payload.keys() == msg.payload.keys()
+    record(benchmark, serializer, frames)
+
+
+def test_latency(benchmark, protocol, message):
+    """
+    Time for a message to be serialized, sent over a zeromq socket and
+    deserialized on the other side.
+    """
+    name, serializer, deserializer = protocol
+    payload, msg = message
+    benchmark.group = "latency-%s" % payload
+
+    ctx = zmq.Context()
+    push = ctx.socket(zmq.PUSH)
+    pull = ctx.socket(zmq.PULL)
+    push.bind("inproc://latency")
+    pull.connect("inproc://latency")
+
+    def send_recv():
+        push.send_serialized(msg, serializer, copy=False)
+        result = pull.recv_serialized(deserializer, copy=False)
+        reclaim(deserializer)
+        return result
+
+    try:
+        result = benchmark(send_recv)
+        assert result.name == msg.name
+        record(benchmark, serializer, serializer(msg))
+    finally:
+        ctx.destroy()
+
+
+def test_sizeof(benchmark, protocol, message):
+    name, serializer, deserializer = protocol
+    payload, msg = message
+    benchmark.group = "sizeof-%s" % payload
+    skip_unreceived(name)
+    frames = serializer(msg)
+
+    benchmark(serializer.sizeof, frames)
+    record(benchmark, serializer, frames, throughput=False)
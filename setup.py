@@ -43,6 +43,7 @@ setup(
         "pva": ["p4p"],
         "hdf5": ["h5py"],
         "arrow": ["pyarrow>=0.17"],
+        "compression": ["lz4", "zstandard"],
         "lcls": ["psana", "h5py", "p4p"],
         "console": ["qtconsole"],
         "tracing": [
@@ -56,6 +57,7 @@ setup(
             "isort==5.13.2",
             "flake8",
             "flake8-black",
+            "pytest-benchmark",
         ],
     },
     entry_points={
@@ -63,6 +65,7 @@ setup(
             "ami-worker = ami.worker:main",
             "ami-manager = ami.manager:main",
             "ami-node = ami.collector:node_main",
+            "ami-intermediate = ami.collector:intermediate_main",
             "ami-global = ami.collector:global_main",
             "ami-client = ami.client:main",
             "ami-console = ami.console:main",
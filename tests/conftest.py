@@ -32,6 +32,14 @@ try:
     import h5py
 except ImportError:
     h5py = None
+try:
+    import lz4
+except ImportError:
+    lz4 = None
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
 
 import time
 
@@ -59,6 +67,12 @@ pyarrowtest = pytest.mark.skipif(pa is None, reason="pyarrow not avaliable")
 hdf5test = pytest.mark.skipif(h5py is None, reason="h5py not avaliable")
 
 
+lz4test = pytest.mark.skipif(lz4 is None, reason="lz4 not avaliable")
+
+
+zstdtest = pytest.mark.skipif(zstandard is None, reason="zstandard not avaliable")
+
+
 @pytest.fixture(scope="session")
 def ipc_dir(tmpdir_factory):
     if sys.platform == "darwin":
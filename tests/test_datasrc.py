@@ -1,3 +1,5 @@
+import threading
+import time
 import typing
 
 import amitypes as at
@@ -12,7 +14,7 @@ except ImportError:
 from conftest import hdf5test, psana1test, psanatest
 
 from ami import psana
-from ami.data import MsgTypes, RequestedData, Source, Transition, Transitions
+from ami.data import MsgTypes, PrefetchIterator, RequestedData, Source, Transition, Transitions
 
 
 @pytest.fixture(scope="function")
@@ -1109,6 +1111,97 @@ def test_source_heartbeat(sim_src_cfg):
             assert msg.payload == ((count - 1) // heartbeat_period)
 
 
+@pytest.mark.parametrize("depth", [1, 4])
+def test_source_prefetch(sim_src_cfg, depth):
+    src_cls = Source.find_source("static")
+    assert src_cls is not None
+
+    sim_src_cfg["bound"] = 10
+
+    def summary(msg):
+        if msg.mtype == MsgTypes.Transition:
+            return msg.mtype, msg.payload.ttype
+        elif msg.mtype == MsgTypes.Heartbeat:
+            return msg.mtype, msg.payload.identity
+        else:
+            return msg.mtype, msg.identity
+
+    expected = [summary(msg) for msg in src_cls(0, 1, 3, sim_src_cfg).events()]
+
+    # check that the prefetched messages arrive in the same order
+    events = PrefetchIterator(src_cls(0, 1, 3, sim_src_cfg).events(), depth)
+    assert [summary(msg) for msg in events] == expected
+    assert events.depth == 0
+
+
+def test_source_prefetch_exception():
+    def failing():
+        yield 1
+        yield 2
+        raise ValueError("bad event")
+
+    events = PrefetchIterator(failing(), 4)
+    assert next(events) == 1
+    assert next(events) == 2
+    with pytest.raises(ValueError):
+        next(events)
+    # the iterator is exhausted after an exception
+    with pytest.raises(StopIteration):
+        next(events)
+
+
+def test_source_prefetch_close():
+    state = {"read": 0, "closed": False}
+
+    def endless():
+        try:
+            while True:
+                state["read"] += 1
+                yield state["read"]
+        finally:
+            state["closed"] = True
+
+    events = PrefetchIterator(endless(), 4)
+    assert next(events) == 1
+    events.close()
+    # the reader thread has exited and closed the generator, so nothing else is read from it
+    assert not events._thread.is_alive()
+    assert state["closed"]
+    read = state["read"]
+    time.sleep(0.1)
+    assert state["read"] == read
+    with pytest.raises(StopIteration):
+        next(events)
+
+
+def test_source_prefetch_close_stalled():
+    resume = threading.Event()
+
+    def stalled():
+        yield 1
+        # e.g. a live source without any events
+        resume.wait()
+        yield 2
+
+    events = PrefetchIterator(stalled(), 1)
+    assert next(events) == 1
+    start = time.time()
+    events.close(timeout=0.1)
+    # the blocked reader thread is abandoned instead of hanging the caller
+    assert time.time() - start < 1.0
+    with pytest.raises(StopIteration):
+        next(events)
+
+    # and it exits without queueing the late message once the source yields again
+    resume.set()
+    events._thread.join(1.0)
+    assert not events._thread.is_alive()
+    queued = []
+    while events.depth:
+        queued.append(events._buffer.get_nowait())
+    assert all(isinstance(item, StopIteration) for item in queued)
+
+
 def test_source_request(sim_src_cfg):
     src_cls = Source.find_source("static")
     assert src_cls is not None
@@ -1,8 +1,10 @@
+import time
+
 import dill
 import pytest
 import zmq
 
-from ami.comm import Colors, ContributionBuilder, EventBuilder, TransitionBuilder
+from ami.comm import Colors, CompletionPolicy, ContributionBuilder, EventBuilder, TransitionBuilder
 from ami.data import CollectorMessage, Deserializer, Heartbeat, Message, MsgTypes, Transitions
 from ami.graph_nodes import PickN
 from ami.graphkit_wrapper import Graph
@@ -230,6 +232,88 @@ def test_comp_prune(event_builder):
     assert event_builder.latest(name) == hbs[-1][0]
 
 
+@pytest.mark.parametrize("event_builder", [(2, 2)], indirect=True)
+def test_prune_order(event_builder):
+    name = "test"
+    event_builder.create(name)
+    builder = event_builder.builders[name]
+
+    # heartbeats arrive out of order
+    for hb in [3, 1, 4, 2]:
+        event_builder.update(name, Heartbeat(hb, 0), 0, 0, {})
+    assert builder.oldest() == 1
+
+    event_builder.prune(name, 0)
+    assert builder.oldest() == 3
+    assert set(event_builder.pending(name).keys()) == {3, 4}
+    assert set(event_builder.contribs(name).keys()) == {3, 4}
+
+    # completing the newest heartbeat leaves the heap entry of the oldest intact
+    event_builder.complete(name, 4, 0)
+    assert builder.oldest() == 3
+    event_builder.complete(name, 3, 0)
+    assert builder.oldest() is None
+    assert not builder.records
+
+
+@pytest.mark.parametrize("event_builder", [(4, 5)], indirect=True)
+@pytest.mark.parametrize("late", ["merge", "drop"])
+def test_quorum_policy(event_builder, late):
+    name = "test"
+    event_builder.set_policy(name, CompletionPolicy(quorum=0.5, late=late))
+
+    # half of the contributors are enough to complete the heartbeat
+    assert event_builder.update(name, Heartbeat(0, 0), 0, 0, {}) is None
+    assert not event_builder.ready(name, 0)
+    assert event_builder.update(name, Heartbeat(0, 0), 1, 0, {}) is None
+    assert event_builder.ready(name, 0)
+    event_builder.complete(name, Heartbeat(0, 0), 0)
+
+    assert event_builder.update(name, Heartbeat(1, 0), 0, 0, {}) is None
+
+    # the remaining contributions to the completed heartbeat are late
+    if late == "merge":
+        assert event_builder.update(name, Heartbeat(0, 0), 2, 0, {}) == "merged"
+        assert len(event_builder.pending(name)[1].names) == 2
+    else:
+        assert event_builder.update(name, Heartbeat(0, 0), 2, 0, {}) == "dropped"
+        assert len(event_builder.pending(name)[1].names) == 1
+    assert 0 not in event_builder.pending(name)
+    assert event_builder.contribs(name)[1] == 0b1
+    assert not event_builder.ready(name, 1)
+
+
+@pytest.mark.parametrize("event_builder", [(2, 5)], indirect=True)
+def test_deadline_policy(event_builder):
+    name = "test"
+    event_builder.set_policy(name, CompletionPolicy(deadline=0.05))
+
+    event_builder.update(name, Heartbeat(0, 0), 0, 0, {})
+    event_builder.prune(name, 0)
+    assert 0 in event_builder.pending(name)
+
+    time.sleep(0.1)
+    event_builder.prune(name, 0)
+    assert 0 not in event_builder.pending(name)
+    assert event_builder.update(name, Heartbeat(0, 0), 1, 0, {}) == "dropped"
+
+    # removing the policy goes back to waiting for every contributor
+    event_builder.set_policy(name, None)
+    event_builder.update(name, Heartbeat(1, 0), 0, 0, {})
+    time.sleep(0.1)
+    event_builder.prune(name, 0)
+    assert 1 in event_builder.pending(name)
+
+
+@pytest.mark.parametrize(
+    "kwargs",
+    [{"quorum": 0}, {"quorum": 1.5}, {"deadline": 0}, {"late": "keep"}],
+)
+def test_completion_policy_invalid(kwargs):
+    with pytest.raises(ValueError):
+        CompletionPolicy(**kwargs)
+
+
 @pytest.mark.parametrize("event_builder", [(2, 5)], indirect=True)
 def test_comp_graph(event_builder, eb_graph):
     sock = event_builder.ctx.socket(zmq.PULL)
@@ -336,3 +420,43 @@ def test_pending_graph(event_builder, eb_graph):
         for nv in range(ver + 1, graph_versions):
             assert nv in event_builder.pending_graphs(graph_name)
             assert event_builder.version(graph_name) == ver
+
+
+@pytest.mark.parametrize("event_builder", [(2, 5)], indirect=True)
+def test_streaming_graph(event_builder, eb_graph):
+    sock = event_builder.ctx.socket(zmq.PULL)
+    sock.bind("inproc://eb_test")
+
+    idnum = 0
+    graph_version = 0
+    graph_name = "test"
+    graph_args = {"num_workers": event_builder.num_contribs, "num_local_collectors": 1}
+    event_builder.set_graph(graph_name, graph_version, graph_args, dill.loads(eb_graph))
+
+    # the first contribution is reduced as soon as it arrives
+    event_builder.update(graph_name, Heartbeat(0, 0), 0, graph_version, {"value_%s" % Colors.Worker: 1})
+    assert event_builder.version(graph_name) == graph_version
+    assert not event_builder.pending(graph_name)[0]
+
+    # contributions to newer heartbeats are buffered until the older heartbeat is finished
+    event_builder.update(graph_name, Heartbeat(1, 0), 0, graph_version, {"value_%s" % Colors.Worker: 2})
+    assert event_builder.pending(graph_name)[1]
+
+    event_builder.update(graph_name, Heartbeat(0, 0), 1, graph_version, {"value_%s" % Colors.Worker: 3})
+    assert not event_builder.pending(graph_name)[0]
+    assert event_builder.ready(graph_name, 0)
+    event_builder.complete(graph_name, Heartbeat(0, 0), idnum)
+
+    deserializer = Deserializer()
+    msg = sock.recv_serialized(deserializer, zmq.NOBLOCK)
+    assert msg.heartbeat == 0
+    assert msg.payload.get("value_%s" % Colors.LocalCollector) == 3
+
+    # the buffered contribution is reduced once the heartbeat is at the front
+    event_builder.update(graph_name, Heartbeat(1, 0), 1, graph_version, {"value_%s" % Colors.Worker: 4})
+    assert not event_builder.pending(graph_name)[1]
+    event_builder.complete(graph_name, Heartbeat(1, 0), idnum)
+
+    msg = sock.recv_serialized(deserializer, zmq.NOBLOCK)
+    assert msg.heartbeat == 1
+    assert msg.payload.get("value_%s" % Colors.LocalCollector) == 4
@@ -1,8 +1,25 @@
+import concurrent.futures
+import sys
+
 import dill
 import numpy as np
+import pytest
+
+from ami.graph_nodes import Accumulator, Map, PickN, RollingBuffer, StatefulTransformation, SumN
+from ami.graphkit_wrapper import Graph, SubexpressionCache, reduction_tiers, skip
+
 
-from ami.graph_nodes import Accumulator, Map, PickN, RollingBuffer, SumN
-from ami.graphkit_wrapper import Graph
+@pytest.fixture(params=["serial", "parallel"])
+def complex_graph(request, complex_graph):
+    """
+    Runs the tests of the complex graph both serially and with its independent branches executed in parallel.
+    """
+    if request.param == "serial":
+        yield complex_graph
+    else:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=4) as executor:
+            complex_graph.parallelize(executor)
+            yield complex_graph
 
 
 def test_filter_on(complex_graph):
@@ -18,6 +35,39 @@ def test_filter_on(complex_graph):
     np.testing.assert_equal(globalCollector["BinningOn.Counts"], np.array([10000.0, 10000.0]))
 
 
+def test_collapsed(complex_graph):
+    # without local collectors the workers feed the global collector directly
+    complex_graph.compile(num_workers=2, num_local_collectors=0)
+    assert not any(getattr(node, "color", "") == "localCollector" for node in complex_graph.graph.nodes)
+    worker1 = complex_graph({"cspad": np.ones((200, 200)), "laser": True, "delta_t": 8}, color="worker")
+    complex_graph.heartbeat_finished()
+    worker2 = complex_graph({"cspad": np.ones((200, 200)), "laser": True, "delta_t": 3}, color="worker")
+    assert worker1 == {"BinningOn_reduce_count_worker": {8: (10000.0, 1)}}
+    complex_graph(worker1, color="globalCollector")
+    globalCollector = complex_graph(worker2, color="globalCollector")
+    np.testing.assert_equal(globalCollector["BinningOn.Bins"], np.array([3, 8]))
+    np.testing.assert_equal(globalCollector["BinningOn.Counts"], np.array([10000.0, 10000.0]))
+
+
+def test_reduction_tree(complex_graph):
+    assert reduction_tiers(50, [8, 4]) == [7, 2]
+    assert reduction_tiers(50) == []
+    # an intermediate tier combines the partial reductions of the local collectors
+    complex_graph.compile(num_workers=4, num_local_collectors=2, fan_in=[2])
+    assert not complex_graph.name_is_valid("BinningOn_reduce_count_intermediateCollector1")
+    complex_graph({"cspad": np.ones((200, 200)), "laser": True, "delta_t": 8}, color="worker")
+    worker = complex_graph({"cspad": np.ones((200, 200)), "laser": True, "delta_t": 3}, color="worker")
+    complex_graph(worker, color="localCollector")
+    localCollector = complex_graph(worker, color="localCollector")
+    intermediateCollector = complex_graph(localCollector, color="intermediateCollector1")
+    globalCollector = complex_graph(intermediateCollector, color="globalCollector")
+    assert intermediateCollector == {
+        "BinningOn_reduce_count_intermediateCollector1": {8: (20000.0, 2), 3: (20000.0, 2)}
+    }
+    np.testing.assert_equal(globalCollector["BinningOn.Bins"], np.array([3, 8]))
+    np.testing.assert_equal(globalCollector["BinningOn.Counts"], np.array([10000.0, 10000.0]))
+
+
 def test_filter_off(complex_graph):
     complex_graph.compile(num_workers=4, num_local_collectors=2)
     complex_graph({"cspad": np.ones((200, 200)), "laser": False, "delta_t": 4}, color="worker")
@@ -55,6 +105,189 @@ def test_add(complex_graph):
     np.testing.assert_equal(globalCollector["referenceOne"][1], np.array([10000.0, 10000.0]))
 
 
+def test_incremental_compile(complex_graph):
+    def nodes():
+        return [
+            PickN(name="pickReferenceOne", inputs=["BinningOff.Bins", "BinningOff.Counts"], outputs=["referenceOne"]),
+            Map(name="Scale", inputs=["sum"], outputs=["scaled"], func=lambda s: 2 * s),
+        ]
+
+    full = dill.loads(dill.dumps(complex_graph))
+    full.add(nodes())
+    full.compile(num_workers=4, num_local_collectors=2)
+
+    complex_graph.compile(num_workers=4, num_local_collectors=2)
+    operations = dict(complex_graph.operations)
+    complex_graph.add(nodes())
+    assert {n.name for n in complex_graph.dirty} == {"pickReferenceOne", "Scale"}
+    complex_graph.compile(num_workers=4, num_local_collectors=2)
+    assert not complex_graph.dirty
+
+    # the rest of the graph keeps the networkfox operations of the first compile
+    roi = next(n for n in complex_graph.operations if n.name == "Roi")
+    assert complex_graph.operations[roi] is operations[roi]
+
+    def colors(graph):
+        return {n.name: n.color for n in graph.operations}
+
+    assert colors(complex_graph) == colors(full)
+    assert colors(complex_graph)["Scale"] == "worker"
+
+    # the collectors still subscribe to the outputs of the global operations expanded by the first compile
+    assert complex_graph.inputs == full.inputs
+    assert "BinningOff_reduce_count_worker" in complex_graph.inputs["localCollector"]
+    assert "referenceOne_worker" in complex_graph.inputs["localCollector"]
+    for graph in (full, complex_graph):
+        graph({"cspad": np.ones((200, 200)), "laser": False, "delta_t": 4}, color="worker")
+        worker = graph({"cspad": np.ones((200, 200)), "laser": False, "delta_t": 5}, color="worker")
+        graph(worker, color="localCollector")
+        localCollector = graph(worker, color="localCollector")
+        globalCollector = graph(localCollector, color="globalCollector")
+        np.testing.assert_equal(globalCollector["referenceOne"][0], np.array([4, 5]))
+
+
+def test_node_index(complex_graph):
+    complex_graph.compile(num_workers=4, num_local_collectors=2)
+
+    operations = {n for n in complex_graph.graph.nodes if not skip(n)}
+    assert set(complex_graph.nodes_by_name.values()) == operations
+    for color in ("worker", "localCollector", "globalCollector"):
+        assert set(complex_graph.nodes_by_color[color]) == {n for n in operations if n.color == color}
+        assert set(complex_graph.stateful_by_color[color]) == {
+            n for n in operations if n.color == color and isinstance(n, StatefulTransformation)
+        }
+
+    # removed nodes are no longer found by name and are pruned from the index on the next compile
+    complex_graph.remove("Sum")
+    assert complex_graph._lookup("Sum") is None
+    assert complex_graph._lookup("FilterOn") is None
+    complex_graph.add(Map(name="Sum", inputs=["roi"], outputs=["sum"], func=np.sum))
+    assert complex_graph._lookup("Sum").name == "Sum"
+    complex_graph.compile(num_workers=4, num_local_collectors=2)
+    assert set(complex_graph.nodes_by_name.values()) == {n for n in complex_graph.graph.nodes if not skip(n)}
+    assert "FilterOn" not in complex_graph.nodes_by_name
+
+    # a global operation with the same parent and outputs is still replaced rather than added twice
+    complex_graph.add(PickN(name="PickSum", inputs=["sum"], outputs=["picked"], parent="PickSum"))
+    complex_graph.compile(num_workers=4, num_local_collectors=2)
+    complex_graph.add(PickN(name="PickSum", inputs=["sum"], outputs=["picked"], parent="PickSum", N=2))
+    complex_graph.compile(num_workers=4, num_local_collectors=2)
+    pickers = [n for n in complex_graph.graph.nodes if not skip(n) and n.parent == "PickSum"]
+    assert sorted(n.name for n in pickers) == ["PickSum_globalCollector", "PickSum_localCollector", "PickSum_worker"]
+
+    # the lifecycle hooks only visit the nodes of the requested color
+    calls = []
+    complex_graph.add(
+        Map(name="Hooked", inputs=["sum"], outputs=["hooked"], func=lambda s: s, begin_run=lambda: calls.append("run"))
+    )
+    complex_graph.compile(num_workers=4, num_local_collectors=2)
+    complex_graph.begin_run("globalCollector")
+    assert calls == []
+    complex_graph.begin_run("worker")
+    assert calls == ["run"]
+
+
+def test_demand(complex_graph):
+    calls = []
+
+    def peak(roi):
+        calls.append(1)
+        return roi.max()
+
+    complex_graph.add(Map(name="Peak", inputs=["roi"], outputs=["peak"], func=peak))
+    complex_graph.add(PickN(name="PickPeak", inputs=["peak"], outputs=["picked_peak"]))
+    complex_graph.compile(num_workers=4, num_local_collectors=2)
+    full = dill.loads(dill.dumps(complex_graph))
+    events = [{"cspad": np.ones((200, 200)), "laser": True, "delta_t": dt} for dt in (8, 3)]
+
+    # only the laser off binning is in demand so neither the laser on binning nor the peak are executed
+    complex_graph.demand({"BinningOff.Bins", "BinningOff.Counts"})
+    assert complex_graph.sources.names == {"cspad", "laser", "delta_t"}
+    for event in events:
+        assert complex_graph(dict(event), color="worker") == {}
+    assert calls == []
+
+    # the outputs in demand are computed the same as when the whole graph is executed
+    complex_graph.demand({"BinningOn.Bins", "BinningOn.Counts", "unknown"})
+    for event in events:
+        worker = complex_graph(dict(event), color="worker")
+        expected = full(dict(event), color="worker")
+        assert worker == {k: v for k, v in expected.items() if k.startswith("BinningOn")}
+    localCollector = complex_graph(worker, color="localCollector")
+    globalCollector = complex_graph(localCollector, color="globalCollector")
+    assert "picked_peak" not in globalCollector
+    np.testing.assert_equal(globalCollector["BinningOn.Bins"], np.array([3, 8]))
+    assert calls == []
+
+    # a picked feature only needs the detector it is computed from
+    complex_graph.demand({"picked_peak"})
+    assert complex_graph.sources.names == {"cspad"}
+    assert complex_graph(dict(events[0]), color="worker") == {"picked_peak_worker": 1.0}
+    assert calls == [1]
+
+    complex_graph.demand(None)
+    assert complex_graph.sources.names == {"cspad", "laser", "delta_t"}
+    assert complex_graph(dict(events[0]), color="worker") == full(dict(events[0]), color="worker")
+
+
+def test_branches(complex_graph):
+    # branches which only share the inputs of the graph with the rest of it
+    complex_graph.add(Map(name="Delay", inputs=["delta_t"], outputs=["delay"], func=lambda t: 2 * t))
+    complex_graph.add(PickN(name="PickDelay", inputs=["delay"], outputs=["picked_delay"], N=2))
+    complex_graph.add(Map(name="Projection", inputs=["cspad"], outputs=["projection"], func=lambda img: img.sum(0)))
+    complex_graph.add(PickN(name="PickProjection", inputs=["projection"], outputs=["picked_projection"]))
+
+    # a pickled graph is executed serially
+    serial = dill.loads(dill.dumps(complex_graph))
+    serial.compile(num_workers=4, num_local_collectors=2)
+    assert not serial.branches
+    complex_graph.compile(num_workers=4, num_local_collectors=2)
+    if complex_graph.executor is None:
+        assert not complex_graph.branches
+    else:
+        assert len(complex_graph.branches) >= 3
+
+    events = [{"cspad": np.ones((200, 200)) * i, "laser": i % 2 == 0, "delta_t": i} for i in range(1, 7)]
+    results = []
+    for graph in (serial, complex_graph):
+        worker = [graph(dict(event), color="worker") for event in events]
+        localCollector = graph(worker[-1], color="localCollector")
+        globalCollector = graph(localCollector, color="globalCollector")
+        results.append(worker + [localCollector, globalCollector])
+
+    # the parallel execution gives the same results as the serial one
+    np.testing.assert_equal(results[1], results[0])
+    assert set(results[1][-1]) >= {"BinningOn.Bins", "BinningOff.Bins"}
+
+    # the wall time of each branch is reported along with the time of each node
+    times = complex_graph.times()
+    assert {name for name, graphkit, outputs, colors in complex_graph.branches} <= set(times)
+    assert "Delay" in times
+
+
+def test_profile(complex_graph):
+    complex_graph.compile(num_workers=4, num_local_collectors=2)
+    assert complex_graph.pop_profile() == {}
+
+    results = complex_graph({"cspad": np.ones((200, 200)), "laser": True, "delta_t": 3}, color="worker")
+    # e.g. a batch of two events
+    complex_graph.record(results, calls=2)
+    times = complex_graph.times()
+    profile = complex_graph.pop_profile()
+
+    assert set(times) <= set(profile)
+    for name, seconds in times.items():
+        assert profile[name][0] == pytest.approx(2 * seconds)
+        assert profile[name][1] == 2
+    # the outputs are attributed to the nodes producing them
+    assert results
+    for output, value in results.items():
+        assert profile[complex_graph.producers[output]][2] == 2 * sys.getsizeof(value)
+
+    # the profile starts over once popped
+    assert complex_graph.pop_profile() == {}
+
+
 def test_dill(complex_graph):
     complex_graph.compile(num_workers=4, num_local_collectors=2)
 
@@ -468,3 +701,99 @@ def test_global_replace_matching_fast_path():
     # Verify the fast path was used by checking that children_of_global_operations still exists
     # (mismatch path deletes it, fast path updates it)
     assert len(graph.children_of_global_operations) > 0
+
+
+def test_shared_subexpressions():
+    calls = []
+
+    def roi(img):
+        calls.append(1)
+        return img[:2, :2]
+
+    first = Graph(name="first")
+    first.add(Map(name="Roi", inputs=["cspad"], outputs=["roi"], func=roi))
+    first.add(Map(name="Sum", inputs=["roi"], outputs=["sum"], func=np.sum))
+    first.add(PickN(name="Pick", inputs=["sum"], outputs=["picked"]))
+
+    second = Graph(name="second")
+    second.add(Map(name="Crop", inputs=["cspad"], outputs=["crop"], func=roi))
+    second.add(Map(name="Total", inputs=["crop"], outputs=["total"], func=np.sum))
+    second.add(Map(name="Max", inputs=["cspad"], outputs=["max"], func=np.max))
+    second.add(PickN(name="Pick", inputs=["total", "max"], outputs=["picked"]))
+
+    cache = SubexpressionCache()
+    for graph in (first, second):
+        graph.share_subexpressions(cache)
+        graph.compile(num_workers=1, num_local_collectors=1)
+    cache.update([first, second])
+
+    # the roi and its sum are shared but the max is only found in the second graph
+    assert len(cache.shared) == 2
+    assert first.fingerprints[first._lookup("Sum")] == second.fingerprints[second._lookup("Total")]
+    assert second.fingerprints[second._lookup("Max")] not in cache.shared
+
+    for i in range(2):
+        event = {"cspad": np.ones((4, 4)) * i}
+        assert first(event, color="worker") == {"picked_worker": 4 * i}
+        assert second(event, color="worker") == {"picked_worker": (4 * i, i)}
+        cache.clear()
+
+    # each roi was computed once per event and the second graph used the results of the first
+    assert len(calls) == 2
+    assert cache.hits == 4
+
+    # without sharing each graph computes its own roi
+    second.share_subexpressions(None)
+    second.compile(num_workers=1, num_local_collectors=1)
+    event = {"cspad": np.ones((4, 4))}
+    first(event, color="worker")
+    second(event, color="worker")
+    assert len(calls) == 4
+
+
+def batch_graph(calls):
+    def batch_sum(arr):
+        calls.append(len(arr))
+        return np.sum(arr.reshape(len(arr), -1), axis=1)
+
+    graph = Graph(name="graph")
+    graph.add(Map(name="Sum", inputs=["cspad"], outputs=["sum"], func=np.sum, batch_func=batch_sum))
+    graph.add(Map(name="Scale", inputs=["sum", "scale"], outputs=["scaled"], func=lambda s, c: s * c))
+    graph.add(PickN(name="Pick", inputs=["scaled"], outputs=["picked"], N=3))
+    graph.compile(num_workers=1, num_local_collectors=1)
+    return graph
+
+
+def test_batch():
+    calls = []
+    batched = batch_graph(calls)
+    serial = batch_graph([])
+
+    assert [node.name for node in batched.batch_nodes] == ["Sum"]
+
+    events = [{"cspad": np.ones((4, 4)) * i, "scale": 2} for i in range(3)]
+    expected = [serial(dict(event), color="worker") for event in events]
+    results = batched.batch(events, color="worker")
+
+    # the batched node was only called once for the whole batch
+    assert calls == [3]
+    assert results == expected
+    assert results[-1] == {"picked_worker": [0.0, 32.0, 64.0]}
+
+
+def test_batch_fallback():
+    calls = []
+    batched = batch_graph(calls)
+    serial = batch_graph([])
+
+    # ragged inputs can't be stacked so the batch is executed event by event
+    events = [{"cspad": np.ones(i + 1), "scale": 1} for i in range(3)]
+    expected = [serial(dict(event), color="worker") for event in events]
+    assert batched.batch(events, color="worker") == expected
+    assert calls == []
+
+    # events with missing inputs are left out of the batched call
+    events = [{"cspad": np.ones(2), "scale": 1}, {"cspad": None, "scale": 1}, {"cspad": np.ones(2), "scale": 1}]
+    expected = [serial(dict(event), color="worker") for event in events]
+    assert batched.batch(events, color="worker") == expected
+    assert calls == [2]
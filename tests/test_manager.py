@@ -1,6 +1,13 @@
 import functools
+import glob
+import json
 import multiprocessing as mp
+import os
+import socket
+import sys
+import threading
 import time
+import urllib.request
 
 import amitypes as at
 import dill
@@ -9,9 +16,20 @@ import pytest
 import zmq
 
 import ami.graph_nodes as gn
-from ami.comm import AutoExport, GraphCommHandler, Node, Store, ZmqHandler
-from ami.data import Heartbeat, MsgTypes, Transition, Transitions
-from ami.manager import run_manager
+from ami.comm import (
+    ZMQ_TOPIC_DELIM,
+    AutoExport,
+    CompletionPolicy,
+    GraphCommHandler,
+    Node,
+    Store,
+    ZmqHandler,
+    unpack_view,
+    view_name,
+    view_stream_addr,
+)
+from ami.data import Deserializer, Heartbeat, MsgTypes, Transition, Transitions
+from ami.manager import Relay, run_manager
 
 
 class ExportHelper:
@@ -20,6 +38,7 @@ class ExportHelper:
         self.sock = self.ctx.socket(zmq.SUB)
         self.sock.setsockopt_string(zmq.SUBSCRIBE, "")
         self.sock.connect(addr)
+        self.deserializer = Deserializer()
 
     def __enter__(self):
         return self
@@ -33,7 +52,7 @@ class ExportHelper:
     def recv(self):
         topic = self.sock.recv_string()
         graph = self.sock.recv_string()
-        data = self.sock.recv_pyobj()
+        data = self.sock.recv_serialized(self.deserializer, copy=False)
         return topic, graph, data
 
     @staticmethod
@@ -170,15 +189,7 @@ def result_data():
     }
 
 
-@pytest.fixture(scope="function")
-def manager_proc(ipc_dir):
-    try:
-        from pytest_cov.embed import cleanup_on_sigterm
-
-        cleanup_on_sigterm()
-    except ImportError:
-        pass
-
+def start_manager(ipc_dir, target=run_manager, prometheus_dir=None, prometheus_port=None, prune=False):
     addrs = {
         "results": "ipc://%s/manager_results" % ipc_dir,
         "comm": "ipc://%s/manager_comm" % ipc_dir,
@@ -192,7 +203,7 @@ def manager_proc(ipc_dir):
     # start the manager process
     proc = mp.Process(
         name="manager",
-        target=run_manager,
+        target=target,
         args=(
             1,
             1,
@@ -203,16 +214,35 @@ def manager_proc(ipc_dir):
             addrs["info"],
             addrs["export"],
             addrs["view"],
-            None,
-            None,
+            prometheus_dir,
+            prometheus_port,
             None,
             None,
             None,
         ),
+        kwargs={"prune": prune},
     )
     proc.daemon = False
     proc.start()
 
+    return proc, addrs
+
+
+def exit_manager(*args, **kwargs):
+    sys.exit(run_manager(*args, **kwargs))
+
+
+@pytest.fixture(scope="function")
+def manager_proc(ipc_dir):
+    try:
+        from pytest_cov.embed import cleanup_on_sigterm
+
+        cleanup_on_sigterm()
+    except ImportError:
+        pass
+
+    proc, addrs = start_manager(ipc_dir)
+
     yield addrs
 
     # cleanup the manager process
@@ -519,6 +549,98 @@ def test_manager_add_view(manager_ctrl, names):
         assert remove == "%s_view" % comm.auto(name)
 
 
+def test_manager_view_stream(manager_proc, manager_ctrl):
+    comm, injector = manager_ctrl
+    ctx = zmq.Context()
+    deserializer = Deserializer()
+
+    assert comm.create()
+    injector.data(1, {"delta_t": 10.1, "laser": True}, wait=True)
+
+    try:
+        with ctx.socket(zmq.SUB) as view:
+            view.connect(view_stream_addr(manager_proc["view"]))
+            view.setsockopt_string(zmq.SUBSCRIBE, "view:%s:delta_t%s" % (comm.current, ZMQ_TOPIC_DELIM))
+
+            # the latest value is sent as soon as the subscription arrives
+            assert view.recv_string() == "view:%s:delta_t%s" % (comm.current, ZMQ_TOPIC_DELIM)
+            assert view.recv_pyobj().identity == 1
+            assert view.recv_serialized(deserializer, copy=False) == 10.1
+
+            # afterwards only the subscribed features are published once per heartbeat
+            injector.data(2, {"delta_t": 20.2, "laser": False}, wait=True)
+            assert view.recv_string() == "view:%s:delta_t%s" % (comm.current, ZMQ_TOPIC_DELIM)
+            assert view.recv_pyobj().identity == 2
+            assert view.recv_serialized(deserializer, copy=False) == 20.2
+            assert not view.poll(100)
+    finally:
+        ctx.destroy()
+
+
+def test_manager_demand(ipc_dir):
+    proc, addrs = start_manager(ipc_dir, prune=True)
+    ctx = zmq.Context()
+
+    def wait_demand(check):
+        start = time.time()
+        while not demands or not check(demands[-1]):
+            assert time.time() - start < 5.0
+            inject.wait_graph(timeout=0.1)
+
+    try:
+        with ResultsInjector(addrs, ctx, 0, "graph") as inject, ctx.socket(zmq.SUB) as view:
+            demands = []
+            inject.graph_comm.add_handler("update_demand", lambda *args: demands.append(args[3]))
+            inject.wait_for_subs()
+            assert inject.comm.create()
+
+            # subscribing to a feature on the view stream puts it in demand
+            view.connect(view_stream_addr(addrs["view"]))
+            view.setsockopt_string(zmq.SUBSCRIBE, "view:%s:delta_t%s" % (inject.comm.current, ZMQ_TOPIC_DELIM))
+            wait_demand(lambda demand: "delta_t" in demand)
+
+            # and it is no longer in demand once the subscription is gone
+            view.setsockopt_string(zmq.UNSUBSCRIBE, "view:%s:delta_t%s" % (inject.comm.current, ZMQ_TOPIC_DELIM))
+            wait_demand(lambda demand: "delta_t" not in demand)
+    finally:
+        proc.terminate()
+        proc.join(1)
+        ctx.destroy()
+
+
+def test_manager_view_request(manager_proc, manager_ctrl, result_data):
+    comm, injector = manager_ctrl
+    ctx = zmq.Context()
+    deserializer = Deserializer()
+    views = ["cspad", "delta_t", "fake", view_name("cspad", "max", (5, 5))]
+    request = ["view:%s:%s" % (comm.current, view) for view in views]
+
+    assert comm.create()
+
+    try:
+        with ctx.socket(zmq.REQ) as view:
+            view.connect(manager_proc["view"])
+
+            for hb in range(1, 3):
+                injector.data(hb, result_data, wait=True)
+                # the second request is served from the cached frames of the features
+                for _ in range(2):
+                    view.send_pyobj(request)
+                    reply = unpack_view(view.recv_multipart(copy=False), deserializer)
+                    assert reply["graph"] == comm.current
+                    assert reply["heartbeat"].identity == hb
+                    np.testing.assert_array_equal(reply["data"]["cspad"], result_data["cspad"])
+                    assert reply["data"]["delta_t"] == result_data["delta_t"]
+                    assert reply["data"]["fake"] is None
+                    # the manager reduces the image to the requested level of detail
+                    np.testing.assert_array_equal(
+                        reply["data"][views[-1]], result_data["cspad"].reshape(5, 2, 5, 2).max(axis=(1, 3))
+                    )
+                result_data = {k: v * 2 for k, v in result_data.items()}
+    finally:
+        ctx.destroy()
+
+
 @pytest.mark.parametrize(
     "exports",
     [
@@ -721,6 +843,89 @@ def test_manager_store(manager_ctrl, result_data):
         assert comm.fetch(name) is None
 
 
+def test_manager_history(manager_ctrl, result_data):
+    comm, injector = manager_ctrl
+
+    assert comm.create()
+    assert comm.fetchHistory("delta_t") is None
+    assert comm.trackHistory("delta_t", capacity=3)
+    assert comm.trackHistory("cspad")
+    assert not comm.trackHistory("wave8", capacity=0)
+    assert comm.histories == {"delta_t": 0, "cspad": 0}
+
+    injector.version = comm.graphVersion
+    expected = []
+    for hb in range(1, 6):
+        data = {k: v * hb for k, v in result_data.items()}
+        expected.append(data)
+        injector.data(hb, data, wait=True)
+
+    assert comm.histories == {"delta_t": 3, "cspad": 5}
+    history = comm.fetchHistory("delta_t")
+    np.testing.assert_array_equal(history["heartbeats"], [3, 4, 5])
+    np.testing.assert_array_equal(history["values"], [data["delta_t"] for data in expected[2:]])
+    history = comm.fetchHistory("cspad", start=2, stop=3)
+    np.testing.assert_array_equal(history["heartbeats"], [2, 3])
+    for value, data in zip(history["values"], expected[1:3]):
+        np.testing.assert_array_equal(value, data["cspad"])
+    # the injected heartbeats all have a zero timestamp
+    np.testing.assert_array_equal(comm.fetchHistory("cspad", stop=0.0, key="timestamp")["heartbeats"], range(1, 6))
+    assert len(comm.fetchHistory("cspad", start=1.0, key="timestamp")["heartbeats"]) == 0
+    assert comm.fetchHistory("cspad", key="fake") is None
+
+    # resetting the store discards the retained values but keeps tracking
+    assert comm.reset()
+    assert comm.histories == {"delta_t": 0, "cspad": 0}
+
+    assert comm.untrackHistory("cspad")
+    assert comm.histories == {"delta_t": 0}
+    assert comm.fetchHistory("cspad") is None
+
+
+def test_manager_profile(manager_ctrl):
+    comm, injector = manager_ctrl
+
+    assert comm.create()
+    assert comm.profile == {}
+
+    version = comm.graphVersion
+    times = {"Roi": (0.5, 10, 4000), "graph_branch0": (1.0, 10, 0)}
+    injector.report("profile", {"graph": comm.current, "heartbeat": 1, "times": times, "version": version})
+    # reports of an older version of the graph are ignored
+    stale = {"Roi": (9.0, 1, 0)}
+    injector.report("profile", {"graph": comm.current, "heartbeat": 1, "times": stale, "version": version - 1})
+    injector.report("profile", {"graph": comm.current, "heartbeat": 2, "times": times, "version": version})
+
+    start = time.time()
+    while comm.profile.get("Roi", {}).get("calls") != 20:
+        assert time.time() - start < 5.0
+        time.sleep(0.05)
+
+    profile = comm.profile
+    assert profile["Roi"] == {"time": 1.0, "calls": 20, "mean": 0.05, "bytes": 8000, "mean_bytes": 400.0}
+    assert profile["graph_branch0"]["time"] == 2.0
+
+
+def test_manager_completion(manager_proc, manager_ctrl):
+    comm, injector = manager_ctrl
+
+    assert comm.create()
+    assert comm.updateCompletion(CompletionPolicy(quorum=0.5, late="merge"))
+
+    # a collector subscribing after the policy was set receives it along with the graph
+    policies = {}
+    ctx = zmq.Context()
+    try:
+        with ResultsInjector(manager_proc, ctx, 1, comm.current) as late:
+            late.graph_comm.add_handler("update_completion", lambda *args: policies.update({args[0]: args[3]}))
+            late.wait_for_subs()
+    finally:
+        ctx.destroy()
+
+    assert policies[comm.current].quorum == 0.5
+    assert policies[comm.current].late == "merge"
+
+
 def test_manager_clear(manager_ctrl, complex_graph):
     comm, injector = manager_ctrl
 
@@ -799,3 +1004,163 @@ def test_manager_versions(manager_ctrl):
     assert comm.graphVersion == graph_version
     assert comm.featuresVersion == feature_version
     assert comm.versions == (graph_version, feature_version)
+
+
+def test_relay():
+    ctx = zmq.Context()
+    try:
+        pull = ctx.socket(zmq.PULL)
+        pull.setsockopt(zmq.RCVHWM, 1)
+        pull.bind("inproc://test_relay")
+        push = ctx.socket(zmq.PUSH)
+        push.setsockopt(zmq.SNDHWM, 1)
+        push.connect("inproc://test_relay")
+
+        dropped = []
+        relay = Relay(push, lambda: dropped.append(True))
+        for i in range(20):
+            relay.send([b"state", b"%d" % i])
+            relay.send([b"data", b"%d" % i], droppable=True)
+
+        # nothing is read yet, so the state messages queue up and the droppable ones are discarded
+        assert len(relay) > 0
+        assert dropped
+
+        # the backlog is retried as the messages are read, like the manager does when its ingest loop is idle
+        received = []
+        start = time.time()
+        while relay or pull.poll(10):
+            assert time.time() - start < 5.0
+            if pull.poll(10):
+                received.append(pull.recv_multipart())
+            relay.flush()
+
+        assert len(relay) == 0
+        assert [int(i) for topic, i in received if topic == b"state"] == list(range(20))
+        assert len([topic for topic, i in received if topic == b"data"]) + len(dropped) == 20
+        # the messages keep the order they were sent in
+        order = [int(i) for topic, i in received]
+        assert order == sorted(order)
+    finally:
+        ctx.destroy()
+
+
+def test_manager_concurrent_commands(manager_ctrl, result_data):
+    comm, injector = manager_ctrl
+
+    assert comm.create()
+    injector.version = comm.graphVersion
+
+    stop = threading.Event()
+
+    def inject():
+        hb = 1
+        while not stop.is_set():
+            injector.data(hb, result_data)
+            hb += 1
+            time.sleep(0.001)
+
+    thread = threading.Thread(target=inject, daemon=True)
+    thread.start()
+    try:
+        # the commands are served by the control thread while the results are ingested
+        start = time.time()
+        first = None
+        last = None
+        while last is None or first is None or last - first < 10:
+            assert time.time() - start < 5.0
+            assert comm.graphVersion == injector.version
+            heartbeat = comm.heartbeat
+            if heartbeat is not None:
+                assert last is None or heartbeat >= last
+                if first is None:
+                    first = heartbeat
+                last = heartbeat
+                assert comm.fetch("delta_t") == result_data["delta_t"]
+    finally:
+        stop.set()
+        thread.join()
+
+
+def test_manager_export_relay(manager_export):
+    export, injector = manager_export
+
+    # the initial info message and the ones when the graph is created
+    assert export.recv()[0] == "info"
+    injector.comm.create()
+    assert [export.recv()[0] for _ in range(3)] == ["info", "store", "graph"]
+
+    # each heartbeat adds a feature, so the ingest thread relays a store and a heartbeat export for it
+    injector.version = injector.comm.graphVersion
+    num_heartbeats = 20
+    for hb in range(1, num_heartbeats + 1):
+        injector.data(hb, {"value%d" % hb: float(hb)})
+
+    stores = []
+    heartbeats = []
+    while not heartbeats or heartbeats[-1] < num_heartbeats:
+        topic, graph, data = export.recv()
+        assert graph == injector.comm.current
+        if topic == "store":
+            stores.append(data)
+        elif topic == "heartbeat":
+            assert not heartbeats or data > heartbeats[-1]
+            heartbeats.append(data)
+
+    # the state exports are never dropped by the relay
+    assert len(stores) == num_heartbeats
+    assert set(stores[-1]["features"]) == {"value%d" % hb for hb in range(1, num_heartbeats + 1)}
+
+
+def test_manager_command_duration(ipc_dir, tmp_path):
+    with socket.socket() as sock:
+        sock.bind(("", 0))
+        port = sock.getsockname()[1]
+
+    proc, addrs = start_manager(ipc_dir, prometheus_dir=str(tmp_path), prometheus_port=port)
+    ctx = zmq.Context()
+    try:
+        with ResultsInjector(addrs, ctx, 0, "graph") as inject:
+            inject.wait_for_subs()
+            assert inject.comm.create()
+            assert inject.comm.graphVersion == 0
+
+            # the manager writes the port of its prometheus client once it is serving
+            start = time.time()
+            while not glob.glob(os.path.join(str(tmp_path), "*.json")):
+                assert time.time() - start < 5.0
+                time.sleep(0.05)
+            with open(glob.glob(os.path.join(str(tmp_path), "*.json"))[0]) as f:
+                target = json.load(f)[0]["targets"][0]
+            port = target.rsplit(":", 1)[1]
+
+            with urllib.request.urlopen("http://localhost:%s/metrics" % port) as response:
+                metrics = response.read().decode()
+            counts = [line for line in metrics.splitlines() if line.startswith("ami_command_duration_seconds_count")]
+            assert any('command="create_graph"' in line for line in counts)
+            assert any('command="get_graph_version"' in line for line in counts)
+    finally:
+        proc.terminate()
+        proc.join(1)
+        ctx.destroy()
+
+
+def test_manager_control_exception(ipc_dir):
+    proc, addrs = start_manager(ipc_dir, target=exit_manager)
+    ctx = zmq.Context()
+    try:
+        with ResultsInjector(addrs, ctx, 0, "graph") as inject:
+            inject.wait_for_subs()
+            assert inject.comm.create()
+
+            # a payload that cannot be unpickled raises in the command handler of the control thread
+            inject.comm._header("update_completion", zmq.SNDMORE)
+            inject.comm._sock.send(b"not a pickle")
+
+            proc.join(5)
+            assert proc.exitcode == 1
+    finally:
+        if proc.is_alive():
+            proc.terminate()
+            proc.join(1)
+        ctx.destroy()
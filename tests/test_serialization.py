@@ -1,8 +1,8 @@
 import numpy as np
 import pytest
-from conftest import pyarrowtest
+from conftest import lz4test, pyarrowtest, zstdtest
 
-from ami.data import CollectorMessage, Deserializer, MsgTypes, Serializer, pa
+from ami.data import CollectorMessage, Deserializer, Heartbeat, MsgTypes, Serializer, pa
 
 
 @pytest.fixture(scope="module")
@@ -22,7 +22,7 @@ def collector_msg():
     )
 
 
-serializers = [None, "dill", "pickle"]
+serializers = [None, "dill", "pickle", "shmem"]
 if pa:
     serializers.append(pytest.param("arrow", marks=pyarrowtest))
 
@@ -41,3 +41,122 @@ def test_default_serializer(serializer, obj):
 def test_default_serializer_message(serializer, collector_msg):
     serializer, deserializer = serializer
     assert deserializer(serializer(collector_msg)) == collector_msg
+
+
+def test_shmem_serializer():
+    serializer = Serializer(protocol="shmem", size=4096, threshold=64)
+    deserializer = Deserializer(protocol="shmem")
+    obj = np.arange(100, dtype=np.float64)
+
+    try:
+        # small arrays are sent inline
+        assert len(serializer(np.arange(4))) == 3
+
+        # large arrays are replaced by a descriptor of their location in shared memory
+        frames = serializer(obj)
+        assert len(frames) == 2
+        result = deserializer(frames)
+        np.testing.assert_array_equal(result, obj)
+
+        # arrays are sent inline once the ring buffer is full of arrays which are still in use
+        held = [deserializer(serializer(obj)) for _ in range(4)]
+        assert len(serializer(obj)) == 3
+
+        # the space is reclaimed once the arrays are no longer referenced
+        del result, held
+        deserializer.reclaim()
+        frames = serializer(obj)
+        assert len(frames) == 2
+        np.testing.assert_array_equal(deserializer(frames), obj)
+    finally:
+        deserializer.close()
+        serializer.close()
+
+
+def test_shmem_serializer_readonly():
+    serializer = Serializer(protocol="shmem", size=800, threshold=64)
+    deserializer = Deserializer(protocol="shmem")
+    first = np.ones(100, dtype=np.float64)
+    first.setflags(write=False)
+    second = np.full(100, 7.0)
+    second.setflags(write=False)
+
+    try:
+        # read-only arrays are rebuilt by pickle from a new read-only view of the mapped buffer
+        result = deserializer(serializer(first))
+        assert not result.flags.writeable
+
+        # so the space must not be reclaimed and overwritten while the array is in use
+        deserializer.reclaim()
+        assert len(serializer(second)) == 3
+        np.testing.assert_array_equal(result, first)
+
+        del result
+        deserializer.reclaim()
+        frames = serializer(second)
+        assert len(frames) == 2
+        np.testing.assert_array_equal(deserializer(frames), second)
+    finally:
+        deserializer.close()
+        serializer.close()
+
+
+@pytest.mark.parametrize("codec", [pytest.param("lz4", marks=lz4test), pytest.param("zstd", marks=zstdtest)])
+@pytest.mark.parametrize("shuffle", [False, True])
+def test_compressed_serializer(codec, shuffle, collector_msg):
+    serializer = Serializer(codec=codec, threshold=1024, shuffle=shuffle)
+    deserializer = Deserializer()
+    compressible = np.zeros((64, 64), dtype=np.float64)
+    small = np.arange(16, dtype=np.int32)
+    noise = np.random.default_rng(0).integers(0, 256, 4096, dtype=np.uint8)
+
+    frames = serializer({"compressible": compressible, "small": small, "noise": noise})
+    # buffers are followed by the pickle and the codec frames
+    assert len(frames) == 5
+    assert frames[-1][:4] == b"AMIC"
+    # only the large compressible array is compressed
+    assert len(frames[0]) < compressible.nbytes
+    assert frames[-1][4:] == bytes([serializer.codec.ident, 8 if shuffle else 0, 0, 0, 0, 0])
+
+    result = deserializer(frames)
+    np.testing.assert_array_equal(result["compressible"], compressible)
+    np.testing.assert_array_equal(result["small"], small)
+    np.testing.assert_array_equal(result["noise"], noise)
+
+    # messages without large buffers still round trip
+    assert deserializer(serializer(collector_msg)) == collector_msg
+
+
+def test_compressed_serializer_unknown_codec():
+    with pytest.raises(NotImplementedError):
+        Serializer(codec="unknown")
+
+
+@pyarrowtest
+def test_arrow_serializer_tensors():
+    serializer = Serializer(protocol="arrow")
+    deserializer = Deserializer(protocol="arrow")
+    image = np.arange(64, dtype=np.float32).reshape(8, 8)
+    msg = CollectorMessage(
+        mtype=MsgTypes.Datagram,
+        identity=1,
+        heartbeat=Heartbeat(3, 1.5),
+        name="graph",
+        version=2,
+        payload={"image": image, "waveform": image[:, 0], "points": [1, 2, 3], "complex": image.astype(np.complex64)},
+    )
+
+    frames = serializer(msg)
+    # envelope, tensors, pickle, the two numeric arrays and the out-of-band complex array
+    assert len(frames) == 6
+    # the contiguous array is sent without a copy
+    assert np.shares_memory(np.frombuffer(frames[3], dtype=np.float32), image)
+
+    result = deserializer(frames)
+    assert result.heartbeat == Heartbeat(3, 1.5)
+    assert result.heartbeat.timestamp == 1.5
+    assert (result.name, result.version) == ("graph", 2)
+    np.testing.assert_array_equal(result.payload["image"], image)
+    np.testing.assert_array_equal(result.payload["waveform"], image[:, 0])
+    np.testing.assert_array_equal(result.payload["complex"], image.astype(np.complex64))
+    assert result.payload["points"] == [1, 2, 3]
@@ -2,8 +2,22 @@ import numpy as np
 import pytest
 import zmq
 
-from ami.comm import ResultStore, Store
-from ami.data import CollectorMessage, Datagram, Deserializer, MsgTypes
+from ami.comm import (
+    FeatureHistory,
+    GraphProfile,
+    HashRing,
+    Ports,
+    ResultStore,
+    SelectTable,
+    Store,
+    ViewBuffer,
+    ZmqHandler,
+    downsample,
+    parse_view_name,
+    shard_addr,
+    view_name,
+)
+from ami.data import CollectorMessage, Datagram, Deserializer, Heartbeat, MsgTypes
 
 
 @pytest.fixture(scope="function")
@@ -344,3 +358,293 @@ def test_store_addremove(obj, expected, store):
     # check that the remove worked
     assert name not in store
     assert not store
+
+
+def test_select_table():
+    num_slots = 4
+    table = SelectTable(num_slots, num_locks=2)
+    assert len(table) == num_slots
+
+    # each (graph, output) pair gets its own slot and keeps it
+    slots = {(name, "_auto_out"): table.slot(name, "_auto_out") for name in ("a", "b", "c", "d")}
+    assert len(set(slots.values())) == num_slots
+    for (name, output), idx in slots.items():
+        assert table.slot(name, output) == idx
+
+    # the table is full
+    assert table.slot("e", "_auto_out") is None
+
+    idx = slots[("a", "_auto_out")]
+    # only the first claim of a heartbeat succeeds
+    assert table.claim(idx, 0)
+    assert not table.claim(idx, 0)
+    assert table.claim(idx, 2)
+    # old heartbeats can no longer be claimed
+    assert not table.claim(idx, 1)
+    # other slots are unaffected
+    assert table.claim(slots[("b", "_auto_out")], 1)
+
+    # a slot is not released while a newer version of the graph uses it
+    assert table.slot("a", "_auto_out", version=3) == idx
+    assert not table.release("a", "_auto_out", 2)
+    assert table.release("a", "_auto_out", 3)
+    assert not table.release("a", "_auto_out", 3)
+    # the released slot is reused with a fresh heartbeat and the other pairs keep their slots
+    assert table.slot("e", "_auto_out") == idx
+    assert table.claim(idx, 0)
+    for name in ("b", "c", "d"):
+        assert table.slot(name, "_auto_out") == slots[(name, "_auto_out")]
+
+
+def test_store_select(ipc_dir):
+    addr = "ipc://%s/resultstore" % ipc_dir
+    name = "test_namespace"
+    outputs = ["_auto_value", "value"]
+    table = SelectTable(16)
+    stores = [ResultStore(addr, select_table=table) for _ in range(2)]
+
+    collector = stores[0].ctx.socket(zmq.PULL)
+    collector.bind(addr)
+    deserializer = Deserializer()
+
+    for store in stores:
+        store.configure(name, 0, outputs)
+
+    for hb in range(3):
+        for idnum, store in enumerate(stores):
+            store.update(name, {output: idnum for output in outputs})
+            store.collect(idnum, Heartbeat(hb, 0))
+
+        msgs = [collector.recv_serialized(deserializer) for _ in stores]
+        payloads = {msg.identity: msg.payload for msg in msgs}
+        # all the workers send the normal output
+        assert {idnum: payload["value"] for idnum, payload in payloads.items()} == {0: 0, 1: 1}
+        # only the first worker to collect sends the automatic Pick1 output
+        assert {idnum: payload.get("_auto_value") for idnum, payload in payloads.items()} == {0: 0, 1: None}
+
+    collector.close()
+    for store in stores:
+        store.ctx.destroy()
+
+
+def test_store_select_recycle(ipc_dir):
+    addr = "ipc://%s/resultstore_recycle" % ipc_dir
+    name = "test_namespace"
+    table = SelectTable(2)
+    stores = [ResultStore(addr, select_table=table) for _ in range(2)]
+
+    collector = stores[0].ctx.socket(zmq.PULL)
+    collector.bind(addr)
+    deserializer = Deserializer()
+
+    def collect(hb, outputs):
+        for idnum, store in enumerate(stores):
+            store.update(name, {output: idnum for output in outputs})
+            store.collect(idnum, Heartbeat(hb, 0))
+        msgs = [collector.recv_serialized(deserializer) for _ in stores]
+        return {msg.identity: msg.payload for msg in msgs}
+
+    # the slots of the Pick1 outputs removed from the graph are reused by the new ones
+    for version, outputs in enumerate([["_auto_a", "_auto_b"], ["_auto_c", "_auto_d"], ["_auto_e"]]):
+        for store in stores:
+            if name in store:
+                store.clear(name)
+            store.configure(name, version, outputs)
+        payloads = collect(version, outputs)
+        for output in outputs:
+            assert {idnum: payload.get(output) for idnum, payload in payloads.items()} == {0: 0, 1: None}
+
+    # once the table is full the outputs without a slot are sent by every worker
+    outputs = ["_auto_e", "_auto_f", "_auto_g"]
+    for store in stores:
+        store.clear(name)
+        store.configure(name, 3, outputs)
+    payloads = collect(3, outputs)
+    sent = {output: sorted(idnum for idnum, payload in payloads.items() if output in payload) for output in outputs}
+    assert sum(ids == [0] for ids in sent.values()) == 2
+    assert sum(ids == [0, 1] for ids in sent.values()) == 1
+
+    # removing the graph frees all of its slots
+    for store in stores:
+        store.remove(name)
+    assert table.slot("other", "_auto_a") is not None
+    assert table.slot("other", "_auto_b") is not None
+
+    collector.close()
+    for store in stores:
+        store.ctx.destroy()
+
+
+def test_hash_ring():
+    names = ["graph%d" % i for i in range(200)]
+    ring = HashRing(4)
+
+    # the assignment is deterministic and uses every shard
+    assignment = {name: ring.shard(name) for name in names}
+    assert assignment == {name: HashRing(4).shard(name) for name in names}
+    assert set(assignment.values()) == set(range(4))
+
+    # adding a shard only moves names to the new shard
+    grown = HashRing(5)
+    for name, shard in assignment.items():
+        assert grown.shard(name) in (shard, 4)
+
+
+def test_shard_addr():
+    assert shard_addr("tcp://*:5558", 0) == "tcp://*:5558"
+    assert shard_addr("tcp://localhost:5558", 2) == "tcp://localhost:%d" % (5558 + 2 * Ports.NumPorts)
+    assert shard_addr("ipc:///tmp/ami/collector", 1) == "ipc:///tmp/ami/collector1"
+
+
+def test_sharded_handler(ipc_dir):
+    addrs = [shard_addr("ipc://%s/sharded" % ipc_dir, shard) for shard in range(3)]
+    ctx = zmq.Context()
+    socks = []
+    for addr in addrs:
+        sock = ctx.socket(zmq.PULL)
+        sock.bind(addr)
+        socks.append(sock)
+    handler = ZmqHandler(addrs, ctx=ctx)
+
+    deserializer = Deserializer()
+    try:
+        # collector messages only go to the shard their graph is assigned to
+        for name in ["graph%d" % i for i in range(10)]:
+            handler.collector_message(0, Heartbeat(1, 0), name, 0, {})
+            shard = handler.ring.shard(name)
+            assert socks[shard].poll(1000)
+            assert socks[shard].recv_serialized(deserializer).name == name
+            for idx, sock in enumerate(socks):
+                if idx != shard:
+                    assert not sock.poll(0)
+
+        # all other messages go to every shard
+        handler.message(MsgTypes.Transition, 0, None)
+        for sock in socks:
+            assert sock.poll(1000)
+            assert sock.recv_serialized(deserializer).mtype == MsgTypes.Transition
+    finally:
+        ctx.destroy()
+
+
+def test_view_name():
+    assert view_name("cspad") == "cspad"
+    assert view_name("cspad", "mean", (300, 400)) == "cspad@mean:300x400"
+    assert view_name("wave8", "envelope", 1000) == "wave8@envelope:1000"
+    assert parse_view_name("cspad") == ("cspad", None, None)
+    assert parse_view_name("cspad@mean:300x400") == ("cspad", "mean", (300, 400))
+    assert parse_view_name(view_name("wave8", "envelope", 1000)) == ("wave8", "envelope", (1000,))
+    for bad in ["cspad@sum:300", "cspad@mean:0", "cspad@mean:big"]:
+        with pytest.raises(ValueError):
+            parse_view_name(bad)
+    with pytest.raises(ValueError):
+        view_name("cspad", "median", 100)
+
+
+def test_downsample():
+    image = np.arange(20, dtype=np.int16).reshape(4, 5)
+    # the blocks at the edge are smaller
+    np.testing.assert_array_equal(downsample(image, "mean", (2, 2)), [[3.5, 6.0], [13.5, 16.0]])
+    np.testing.assert_array_equal(downsample(image, "max", (2, 2)), [[7, 9], [17, 19]])
+    # already small enough or not an image
+    assert downsample(image, "mean", (4, 5)) is image
+    assert downsample(image, "mean", (10,)) is image
+    assert downsample(image, "envelope", (2, 2)) is image
+    assert downsample(3.5, "max", (2,)) == 3.5
+    assert downsample(["a", "b"], "max", (1,)) == ["a", "b"]
+
+    wave = np.array([0, 5, -1, 2, 7, 3, -4, 1], dtype=np.float64)
+    np.testing.assert_array_equal(downsample(wave, "envelope", (4,)), [-1, 5, -4, 7])
+    np.testing.assert_array_equal(downsample(list(wave), "max", (2,)), [5, 7])
+    assert downsample(wave, "envelope", (16,)) is wave
+
+
+def test_view_buffer():
+    buffer = ViewBuffer(depth=3)
+    hb1, hb2, hb3, hb4 = (Heartbeat(hb, 100.0 + hb) for hb in range(1, 5))
+
+    # the x of the next heartbeat arrives before the y of the current one is dropped
+    buffer.add("x", hb1, 1)
+    buffer.add("y", hb1, 10)
+    buffer.add("x", hb2, 2)
+    heartbeat, data = buffer.latest({"x", "y"})
+    assert heartbeat == hb1
+    assert data == {"x": 1, "y": 10}
+    # features which are not needed are not returned
+    assert buffer.latest({"x"}) == (hb2, {"x": 2})
+
+    # a heartbeat missing a feature is skipped once a newer complete one arrives
+    buffer.add("x", hb3, 3)
+    buffer.add("y", hb3, 30)
+    assert buffer.latest({"x", "y"}, optional={"z"}) == (hb3, {"x": 3, "y": 30})
+    assert buffer.latest({"x", "y"}, after=hb3) == (None, {})
+
+    # only the most recent heartbeats are buffered
+    buffer.add("z", hb4, 400)
+    assert len(buffer) == 3
+    assert buffer.latest({"x", "y"}, after=hb1) == (hb3, {"x": 3, "y": 30})
+    buffer.discard(hb3)
+    assert len(buffer) == 1
+    assert buffer.latest({"x", "y"}) == (None, {})
+
+
+def test_feature_history():
+    history = FeatureHistory(4)
+    for hb in range(6):
+        history.append(Heartbeat(hb, 100.0 + hb), float(hb))
+    # only the newest entries are retained in numpy columns
+    assert len(history) == 4
+    full = history.range()
+    np.testing.assert_array_equal(full["heartbeats"], [2, 3, 4, 5])
+    np.testing.assert_array_equal(full["values"], [2.0, 3.0, 4.0, 5.0])
+    assert full["values"].dtype == np.float64
+    np.testing.assert_array_equal(history.range(3, 4)["heartbeats"], [3, 4])
+    np.testing.assert_array_equal(history.range(start=104.5, key="timestamp")["values"], [5.0])
+    assert len(history.range(10)["values"]) == 0
+    with pytest.raises(ValueError):
+        history.range(key="fake")
+
+    # arrays are evicted once the memory cap is reached
+    history = FeatureHistory(10, max_bytes=250)
+    for hb in range(6):
+        history.append(Heartbeat(hb, 100.0 + hb), np.full(10, hb, dtype=np.float64))
+    assert len(history) == 3
+    assert history.nbytes == 240
+    values = history.range()["values"]
+    assert isinstance(values, list)
+    np.testing.assert_array_equal([v[0] for v in values], [3, 4, 5])
+
+    # a change of type discards the previous entries
+    history.append(Heartbeat(6, 106.0), 3)
+    assert len(history) == 1
+    np.testing.assert_array_equal(history.range()["values"], [3])
+
+    history.clear()
+    assert len(history) == 0
+    assert history.range()["values"] == []
+    with pytest.raises(ValueError):
+        FeatureHistory(0)
+
+
+def test_graph_profile():
+    profile = GraphProfile()
+    assert profile.summary() == {}
+
+    assert profile.update("worker0", 2, 5, {"Roi": (0.5, 10, 4000), "graph_branch0": (1.0, 10, 0)})
+    assert profile.update("worker1", 2, 4, {"Roi": (1.5, 10, 4000)})
+    assert profile.reporters == {"worker0", "worker1"}
+    assert profile.heartbeat == 5
+    summary = profile.summary()
+    assert summary["Roi"] == {"time": 2.0, "calls": 20, "mean": 0.1, "bytes": 8000, "mean_bytes": 400.0}
+    assert summary["graph_branch0"]["mean"] == 0.1
+
+    # reports of an older version of the graph are ignored
+    assert not profile.update("worker2", 1, 6, {"Roi": (1.0, 1, 0)})
+    assert profile.summary()["Roi"]["calls"] == 20
+
+    # a newer version of the graph starts a new profile
+    assert profile.update("worker0", 3, 6, {"Sum": (0.2, 2, 8)})
+    assert profile.version == 3
+    assert profile.reporters == {"worker0"}
+    assert set(profile.summary()) == {"Sum"}
+    assert profile.summary()["Sum"]["mean"] == pytest.approx(0.1)